@@ -0,0 +1,74 @@
+"""add user_profiles projection
+
+Revision ID: 7aa5da3adde8
+Revises: 44a6dd7619f2
+Create Date: 2026-10-17 10:10:12.418305
+
+"""
+
+from collections.abc import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7aa5da3adde8'
+down_revision: Union[str, None] = '44a6dd7619f2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'user_profiles',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('tg_id', sa.BigInteger(), nullable=False),
+        sa.Column('first_name', sa.String(length=40), nullable=True),
+        sa.Column('username', sa.String(length=40), nullable=True),
+        sa.Column('year', sa.Integer(), nullable=True),
+        sa.Column('total_likes', sa.Integer(), nullable=False),
+        sa.Column('gender', sa.String(length=40), nullable=True),
+        sa.Column('status', sa.String(length=40), nullable=True),
+        sa.Column('target', sa.String(length=40), nullable=True),
+        sa.Column('district', sa.String(length=40), nullable=True),
+        sa.Column('profession', sa.String(length=50), nullable=True),
+        sa.Column('about', sa.Text(), nullable=True),
+        sa.Column('interests', postgresql.ARRAY(sa.Text()), server_default='{}', nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id'),
+        sa.UniqueConstraint('tg_id'),
+    )
+
+    # Заполняем проекцию для существующих пользователей
+    op.execute(
+        """
+        INSERT INTO user_profiles (
+            user_id, tg_id, first_name, username, year, total_likes,
+            gender, status, target, district, profession, about, interests
+        )
+        SELECT
+            u.id, u.tg_id, u.first_name, u.username, u.year, u.total_likes,
+            max(o.name) FILTER (WHERE c.name = 'gender'),
+            max(o.name) FILTER (WHERE c.name = 'status'),
+            max(o.name) FILTER (WHERE c.name = 'target'),
+            max(o.name) FILTER (WHERE c.name = 'district'),
+            u.profession, u.about,
+            coalesce(array_agg(o.name ORDER BY o.id) FILTER (WHERE c.name = 'interest'), ARRAY[]::TEXT[])
+        FROM users u
+        LEFT JOIN user_options uo ON uo.user_id = u.id
+        LEFT JOIN options o ON uo.option_id = o.id
+        LEFT JOIN options_categories c ON o.category_id = c.id
+        WHERE u.tg_id IS NOT NULL
+        GROUP BY u.id
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('user_profiles')
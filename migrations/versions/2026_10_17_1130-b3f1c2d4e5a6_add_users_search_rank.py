@@ -0,0 +1,34 @@
+"""add users search_rank
+
+Revision ID: b3f1c2d4e5a6
+Revises: 7aa5da3adde8
+Create Date: 2026-10-17 11:30:41.207113
+
+"""
+
+from collections.abc import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3f1c2d4e5a6'
+down_revision: Union[str, None] = '7aa5da3adde8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # random() volatile, поэтому Postgres вычисляет его для каждой существующей строки
+    op.add_column('users', sa.Column('search_rank', sa.Float(), server_default=sa.text('random()'), nullable=False))
+    op.create_index('ix_users_search_rank_id', 'users', ['search_rank', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_users_search_rank_id', table_name='users')
+    op.drop_column('users', 'search_rank')
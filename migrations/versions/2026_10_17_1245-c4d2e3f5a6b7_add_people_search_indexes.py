@@ -0,0 +1,47 @@
+"""add people search indexes
+
+Revision ID: c4d2e3f5a6b7
+Revises: b3f1c2d4e5a6
+Create Date: 2026-10-17 12:45:09.531876
+
+"""
+
+from collections.abc import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4d2e3f5a6b7'
+down_revision: Union[str, None] = 'b3f1c2d4e5a6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        'ix_user_options_option_user_selected',
+        'user_options',
+        ['option_id', 'user_id'],
+        unique=False,
+        postgresql_where=sa.text('selected'),
+    )
+    op.create_index(op.f('ix_users_year'), 'users', ['year'], unique=False)
+    op.create_index(
+        'ix_users_tg_id_covering',
+        'users',
+        ['tg_id'],
+        unique=False,
+        postgresql_include=['id', 'year', 'search_rank'],
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_users_tg_id_covering', table_name='users')
+    op.drop_index(op.f('ix_users_year'), table_name='users')
+    op.drop_index('ix_user_options_option_user_selected', table_name='user_options')
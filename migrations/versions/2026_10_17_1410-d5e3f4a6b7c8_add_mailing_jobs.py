@@ -0,0 +1,58 @@
+"""add mailing jobs
+
+Revision ID: d5e3f4a6b7c8
+Revises: c4d2e3f5a6b7
+Create Date: 2026-10-17 14:10:27.904512
+
+"""
+
+from collections.abc import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5e3f4a6b7c8'
+down_revision: Union[str, None] = 'c4d2e3f5a6b7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'mailing_jobs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('admin_chat_id', sa.BigInteger(), nullable=False),
+        sa.Column('progress_message_id', sa.Integer(), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('text', sa.Text(), nullable=True),
+        sa.Column('media', sa.JSON(), nullable=False),
+        sa.Column('total', sa.Integer(), nullable=False),
+        sa.Column('date_create', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.Column('date_update', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_mailing_jobs_status'), 'mailing_jobs', ['status'], unique=False)
+    op.create_table(
+        'mailing_deliveries',
+        sa.Column('job_id', sa.Integer(), nullable=False),
+        sa.Column('tg_id', sa.BigInteger(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('date_update', sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(['job_id'], ['mailing_jobs.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('job_id', 'tg_id'),
+    )
+    op.create_index('ix_mailing_deliveries_job_status', 'mailing_deliveries', ['job_id', 'status'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_mailing_deliveries_job_status', table_name='mailing_deliveries')
+    op.drop_table('mailing_deliveries')
+    op.drop_index(op.f('ix_mailing_jobs_status'), table_name='mailing_jobs')
+    op.drop_table('mailing_jobs')
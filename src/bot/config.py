@@ -0,0 +1,71 @@
+import logging
+import os
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from dotenv import load_dotenv
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def load_env() -> None:
+    project_root = Path(__file__).parent.parent.parent
+    env_path = project_root / '.env.local'
+
+    if env_path.exists():
+        load_dotenv(env_path)
+        logger.info('Load bot: .env.local')
+    else:
+        load_dotenv()
+        logger.info('Load bot: .env')
+
+
+@dataclass(frozen=True, slots=True)
+class BotConfig:
+    """Настройки запуска, общие для polling и webhook"""
+
+    token: str
+    mode: str  # polling | webhook
+    webhook_url: Optional[str]  # Публичный адрес, на который Telegram шлет апдейты
+    webhook_path: str
+    webhook_secret: Optional[str]
+    web_host: str
+    web_port: int
+    workers: int
+    api_url: Optional[str]  # Свой сервер Bot API, например локальный для нагрузочных прогонов рассылки
+
+    @property
+    def is_webhook(self) -> bool:
+        return self.mode == 'webhook'
+
+
+def load_config() -> BotConfig:
+    load_env()
+
+    token = os.environ.get('BOT_TOKEN')
+    if token is None:
+        raise ValueError('BOT_TOKEN is not set')
+
+    mode = os.environ.get('BOT_MODE', 'polling').lower()
+    if mode not in ('polling', 'webhook'):
+        raise ValueError(f'Unknown BOT_MODE: {mode}')
+
+    webhook_url = os.environ.get('WEBHOOK_URL')
+    if mode == 'webhook' and not webhook_url:
+        raise ValueError('WEBHOOK_URL is not set')
+
+    return BotConfig(
+        token=token,
+        mode=mode,
+        webhook_url=webhook_url,
+        webhook_path=os.environ.get('WEBHOOK_PATH', '/webhook'),
+        webhook_secret=os.environ.get('WEBHOOK_SECRET') or None,
+        web_host=os.environ.get('WEB_SERVER_HOST', '0.0.0.0'),
+        web_port=int(os.environ.get('WEB_SERVER_PORT', 3000)),
+        workers=max(1, int(os.environ.get('WEBHOOK_WORKERS', 1))),
+        api_url=os.environ.get('TELEGRAM_API_URL') or None,
+    )
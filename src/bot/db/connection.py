@@ -1,11 +1,18 @@
+import asyncio
 import logging
 import os
+import time
 
+from contextvars import ContextVar, Token
 from pathlib import Path
+from typing import Any, Callable, Optional
 
 from dotenv import load_dotenv
-from sqlalchemy.ext.asyncio import AsyncAttrs, async_sessionmaker, create_async_engine
-from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy import event, make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncAttrs, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import DeclarativeBase, Session, SessionTransaction
+from sqlalchemy.pool import AsyncAdaptedQueuePool, ConnectionPoolEntry
 
 
 logging.basicConfig(level=logging.INFO)
@@ -27,10 +34,211 @@ DATABASE_URL = os.environ.get('DATABASE_URL')
 if DATABASE_URL is None:
     raise ValueError('DATABASE_URL is not set')
 
-engine = create_async_engine(url=DATABASE_URL)
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    return value.lower() in ('1', 'true', 'yes') if value else default
+
+
+def _db_processes() -> int:
+    """Сколько процессов бота держат свой пул: в webhook-режиме каждый воркер"""
+    if os.environ.get('BOT_MODE', 'polling').lower() != 'webhook':
+        return 1
+    return max(1, _env_int('WEBHOOK_WORKERS', 1))
+
+
+# Настройки пула (DB_POOL_SIZE + DB_MAX_OVERFLOW должно покрывать число одновременных апдейтов).
+# Это бюджет на весь бот: при WEBHOOK_WORKERS воркерах он делится между их пулами поровну,
+# так что сумма соединений не растет с числом воркеров и должна помещаться в max_connections Postgres
+DB_PROCESSES = _db_processes()
+DB_POOL_SIZE = max(1, _env_int('DB_POOL_SIZE', 10) // DB_PROCESSES)
+DB_MAX_OVERFLOW = _env_int('DB_MAX_OVERFLOW', 20) // DB_PROCESSES
+DB_POOL_TIMEOUT = _env_int('DB_POOL_TIMEOUT', 30)
+DB_POOL_RECYCLE = _env_int('DB_POOL_RECYCLE', 1800)
+DB_POOL_PRE_PING = _env_bool('DB_POOL_PRE_PING', True)
+
+# Кэши подготовленных выражений asyncpg (0 — отключить, нужно для pgbouncer в режиме transaction)
+DB_STATEMENT_CACHE_SIZE = _env_int('DB_STATEMENT_CACHE_SIZE', 100)
+DB_PREPARED_STATEMENT_CACHE_SIZE = _env_int('DB_PREPARED_STATEMENT_CACHE_SIZE', 100)
+
+
+class PoolStats:
+    """Счетчики ожидания соединений из пула"""
+
+    def __init__(self) -> None:
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record_wait(self, wait: float) -> None:
+        self.checkouts += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+
+pool_stats = PoolStats()
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Пул, который замеряет время ожидания свободного соединения"""
+
+    def _do_get(self) -> ConnectionPoolEntry:
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            pool_stats.timeouts += 1
+            raise
+        pool_stats.record_wait(time.perf_counter() - started)
+        return connection
+
+
+connect_args: dict[str, Any] = {}
+if make_url(DATABASE_URL).get_driver_name() == 'asyncpg':
+    connect_args = {
+        'statement_cache_size': DB_STATEMENT_CACHE_SIZE,
+        'prepared_statement_cache_size': DB_PREPARED_STATEMENT_CACHE_SIZE,
+    }
+
+engine = create_async_engine(
+    url=DATABASE_URL,
+    poolclass=TimedQueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+    connect_args=connect_args,
+)
+
+
+def get_pool_stats() -> dict[str, Any]:
+    """Текущее состояние пула соединений"""
+    pool = engine.sync_engine.pool
+    if not isinstance(pool, TimedQueuePool):
+        return {}
+
+    return {
+        'size': pool.size(),
+        'max_overflow': DB_MAX_OVERFLOW,
+        'checked_in': pool.checkedin(),
+        'checked_out': pool.checkedout(),
+        'overflow': max(pool.overflow(), 0),
+        'checkouts': pool_stats.checkouts,
+        'timeouts': pool_stats.timeouts,
+        'avg_wait_ms': pool_stats.total_wait / pool_stats.checkouts * 1000 if pool_stats.checkouts else 0.0,
+        'max_wait_ms': pool_stats.max_wait * 1000,
+    }
+
 
 async_session = async_sessionmaker(engine, expire_on_commit=False)
 
 
+class UnitOfWorkSession(AsyncSession):
+    """Сессия одного апдейта: commit() в репозиториях только сбрасывает изменения в БД,
+    фиксацию транзакции выполняет complete() - перед запросами к Telegram и в конце апдейта"""
+
+    async def commit(self) -> None:
+        await self.flush()
+
+    async def complete(self) -> None:
+        await super().commit()
+
+
+unit_of_work_session = async_sessionmaker(engine, class_=UnitOfWorkSession, expire_on_commit=False)
+
+
+AFTER_COMMIT_HOOKS = 'after_commit_hooks'
+
+
+def after_commit(session: AsyncSession, callback: Callable[[], None]) -> None:
+    """Вызывает callback один раз после фиксации транзакции сессии
+
+    Для UnitOfWorkSession это complete() перед запросом к Telegram или в конце апдейта, а не commit() в репозитории.
+    Если транзакция или SAVEPOINT, в котором зарегистрирован callback, откатывается, callback отменяется.
+    """
+    sync_session = session.sync_session
+    transaction = sync_session.get_nested_transaction() or sync_session.get_transaction()
+    sync_session.info.setdefault(AFTER_COMMIT_HOOKS, []).append((transaction, callback))
+
+
+def _inside(transaction: Optional[SessionTransaction], rolled_back: SessionTransaction) -> bool:
+    if transaction is None:
+        # Зарегистрирован до начала транзакции: принадлежит корневой
+        return rolled_back.parent is None
+    while transaction is not None:
+        if transaction is rolled_back:
+            return True
+        transaction = transaction.parent
+    return False
+
+
+@event.listens_for(Session, 'after_commit')
+def _run_after_commit_hooks(session: Session) -> None:
+    # Событие приходит и на RELEASE SAVEPOINT, а данные фиксируются только вместе с корневой транзакцией
+    if session.in_nested_transaction():
+        return
+    for _, callback in session.info.pop(AFTER_COMMIT_HOOKS, []):
+        callback()
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _drop_after_commit_hooks(session: Session, previous_transaction: SessionTransaction) -> None:
+    hooks = session.info.get(AFTER_COMMIT_HOOKS)
+    if hooks:
+        session.info[AFTER_COMMIT_HOOKS] = [
+            (transaction, callback) for transaction, callback in hooks if not _inside(transaction, previous_transaction)
+        ]
+
+
+# Сессия текущего апдейта и задача, которой она принадлежит
+CurrentSession = Optional[tuple[asyncio.Task, UnitOfWorkSession]]
+_current_session: ContextVar[CurrentSession] = ContextVar('current_session', default=None)
+
+
+def bind_current_session(session: UnitOfWorkSession) -> Token[CurrentSession]:
+    """Делает сессию общей для всех репозиториев в текущей задаче"""
+    task = asyncio.current_task()
+    if task is None:
+        raise RuntimeError('Unit of work session must be bound inside a running task')
+    return _current_session.set((task, session))
+
+
+def unbind_current_session(token: Token[CurrentSession]) -> None:
+    _current_session.reset(token)
+
+
+def get_current_session() -> Optional[UnitOfWorkSession]:
+    """Сессия апдейта или None, если вызов идет из фоновой задачи"""
+    current = _current_session.get()
+    if current is None:
+        return None
+
+    # Задачи из asyncio.create_task наследуют контекст, но не должны делить соединение с апдейтом
+    task, session = current
+    if task is not asyncio.current_task():
+        return None
+    return session
+
+
+async def release_current_session() -> None:
+    """Фиксирует транзакцию апдейта и возвращает соединение в пул
+
+    Вызывается перед запросами к Telegram и паузами, чтобы соединение не простаивало в открытой
+    транзакции. Следующий запрос к БД в том же апдейте возьмет соединение заново. Внутри SAVEPOINT
+    ничего не делает: фиксация закрыла бы его посреди блока begin_nested().
+    """
+    session = get_current_session()
+    if session is None or not session.in_transaction() or session.in_nested_transaction():
+        return
+    await session.complete()
+
+
 class Base(AsyncAttrs, DeclarativeBase):
     pass
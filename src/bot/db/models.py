@@ -2,15 +2,19 @@ import logging
 
 from sqlalchemy import (
     ARRAY,
+    JSON,
     BigInteger,
     Boolean,
     DateTime,
+    Float,
     ForeignKey,
     Index,
     Integer,
     String,
     Text,
     UniqueConstraint,
+    func,
+    text,
 )
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
@@ -28,7 +32,7 @@ class User(Base):
     tg_id = mapped_column(BigInteger, unique=True)
     first_name: Mapped[str] = mapped_column(String(40), nullable=True)
     username: Mapped[str] = mapped_column(String(40), nullable=True)
-    year: Mapped[int] = mapped_column(Integer(), nullable=True)
+    year: Mapped[int] = mapped_column(Integer(), nullable=True, index=True)
     date_create: Mapped[DateTime] = mapped_column(DateTime(timezone=True), nullable=True)
     date_update: Mapped[DateTime] = mapped_column(DateTime(timezone=True), nullable=True)
     points: Mapped[int] = mapped_column(Integer(), default=100, nullable=False)
@@ -36,6 +40,14 @@ class User(Base):
     profession: Mapped[str] = mapped_column(String(50), nullable=True)
     about: Mapped[str] = mapped_column(Text, nullable=True)
     total_likes: Mapped[int] = mapped_column(Integer(), default=0, nullable=False)
+    # Случайный ранг для выдачи в поиске людей вместо ORDER BY random()
+    search_rank: Mapped[float] = mapped_column(Float(), server_default=text('random()'), nullable=False)
+
+    __table_args__ = (
+        Index('ix_users_search_rank_id', 'search_rank', 'id'),
+        # Покрывающий индекс для поиска по tg_id без обращения к таблице
+        Index('ix_users_tg_id_covering', 'tg_id', postgresql_include=['id', 'year', 'search_rank']),
+    )
 
     options: Mapped[list['UserOption']] = relationship(
         back_populates='user',
@@ -81,6 +93,26 @@ class User(Base):
         return f'User id: {self.id}, tg_id: {self.tg_id}'
 
 
+class UserProfile(Base):
+    """Денормализованная проекция профиля для чтения, обновляется репозиториями при каждой записи"""
+
+    __tablename__ = 'user_profiles'
+
+    user_id: Mapped[int] = mapped_column(ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    tg_id = mapped_column(BigInteger, unique=True, nullable=False)
+    first_name: Mapped[str] = mapped_column(String(40), nullable=True)
+    username: Mapped[str] = mapped_column(String(40), nullable=True)
+    year: Mapped[int] = mapped_column(Integer(), nullable=True)
+    total_likes: Mapped[int] = mapped_column(Integer(), default=0, nullable=False)
+    gender: Mapped[str] = mapped_column(String(40), nullable=True)
+    status: Mapped[str] = mapped_column(String(40), nullable=True)
+    target: Mapped[str] = mapped_column(String(40), nullable=True)
+    district: Mapped[str] = mapped_column(String(40), nullable=True)
+    profession: Mapped[str] = mapped_column(String(50), nullable=True)
+    about: Mapped[str] = mapped_column(Text, nullable=True)
+    interests: Mapped[list[str]] = mapped_column(ARRAY(Text), default=list, server_default='{}', nullable=False)
+
+
 class SupportTicket(Base):
     __tablename__ = 'support_tickets'
 
@@ -210,6 +242,11 @@ class UserOption(Base):
     option_id: Mapped[int] = mapped_column(ForeignKey('options.id', ondelete='CASCADE'), index=True, primary_key=True)
     selected: Mapped[bool] = mapped_column(Boolean(), nullable=True)
 
+    __table_args__ = (
+        # Поиск пользователей по выбранной опции (округ, цель, пол)
+        Index('ix_user_options_option_user_selected', 'option_id', 'user_id', postgresql_where=text('selected')),
+    )
+
     user: Mapped['User'] = relationship(back_populates='options')
     option: Mapped['Option'] = relationship(back_populates='users')
 
@@ -242,6 +279,57 @@ class EventInterest(Base):
     interest: Mapped['Option'] = relationship(back_populates='events', lazy='joined')
 
 
+class MailingJob(Base):
+    """Задание массовой рассылки: контент, статус и сообщение с прогрессом у администратора"""
+
+    __tablename__ = 'mailing_jobs'
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    admin_chat_id = mapped_column(BigInteger, nullable=False)
+    progress_message_id: Mapped[int] = mapped_column(Integer(), nullable=True)
+    status: Mapped[str] = mapped_column(String(20), default='running', nullable=False, index=True)
+    text: Mapped[str] = mapped_column(Text, nullable=True)
+    media: Mapped[list[dict]] = mapped_column(JSON, default=list, nullable=False)
+    # Аудитория рассылки (MailingFilter), получатели выбираются по ней при создании задания
+    filters: Mapped[dict] = mapped_column(JSON, nullable=True)
+    total: Mapped[int] = mapped_column(Integer(), default=0, nullable=False)
+    date_create: Mapped[DateTime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    date_update: Mapped[DateTime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+
+
+class MailingDelivery(Base):
+    """Получатель рассылки и результат доставки ему"""
+
+    __tablename__ = 'mailing_deliveries'
+
+    job_id: Mapped[int] = mapped_column(ForeignKey('mailing_jobs.id', ondelete='CASCADE'), primary_key=True)
+    tg_id = mapped_column(BigInteger, primary_key=True)
+    status: Mapped[str] = mapped_column(String(20), default='pending', nullable=False)
+    error: Mapped[str] = mapped_column(Text, nullable=True)
+    date_update: Mapped[DateTime] = mapped_column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        # Выборка следующей пачки получателей и подсчет прогресса
+        Index('ix_mailing_deliveries_job_status', 'job_id', 'status'),
+    )
+
+
+class DeliveryHealth(Base):
+    """Доступность чата для сообщений бота по итогам отправок"""
+
+    __tablename__ = 'delivery_health'
+
+    tg_id = mapped_column(BigInteger, primary_key=True)
+    last_success_at: Mapped[DateTime] = mapped_column(DateTime(timezone=True), nullable=True)
+    last_failure_at: Mapped[DateTime] = mapped_column(DateTime(timezone=True), nullable=True)
+    consecutive_failures: Mapped[int] = mapped_column(Integer(), default=0, nullable=False)
+    # Бот заблокирован, пользователь удален или чат не найден: отправка бессмысленна
+    is_dead: Mapped[bool] = mapped_column(Boolean(), default=False, nullable=False)
+    dead_reason: Mapped[str] = mapped_column(Text, nullable=True)
+
+
 async def create_db_and_tables() -> None:
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
@@ -1,13 +1,17 @@
+import asyncio
 import logging
+import os
 
-from typing import Optional
+from collections.abc import AsyncIterator
+from dataclasses import asdict, dataclass, field
+from typing import Any, Optional
 
-from aiogram.fsm.context import FSMContext
-from sqlalchemy import and_, or_, select
+from sqlalchemy import ColumnElement, exists, func, or_, select
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import aliased
 
-from src.bot.db.models import Option, User, UserOption
+from src.bot.db.connection import async_session
+from src.bot.db.models import DeliveryHealth, Option, User, UserOption
+from src.bot.utils.cache import MISSING, StatsTTLCache
 from src.bot.utils.decorators import connect_db
 
 
@@ -15,106 +19,157 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
 
+# Администраторы меняются вручную в БД, поэтому кэш живет недолго
+ADMIN_CACHE_TTL = int(os.environ.get('ADMIN_CACHE_TTL', 60))
+ADMIN_CACHE_KEY = 'admins'
+
+admin_cache = StatsTTLCache('admins', maxsize=1, ttl=ADMIN_CACHE_TTL)
+_admin_lock = asyncio.Lock()
+
+
+async def get_admin_ids() -> frozenset[int]:
+    """tg_id администраторов из кэша; при промахе все ожидающие получают результат одного запроса"""
+    admins = admin_cache.lookup(ADMIN_CACHE_KEY)
+    if admins is MISSING:
+        async with _admin_lock:
+            admins = admin_cache.get(ADMIN_CACHE_KEY, MISSING)
+            if admins is MISSING:
+                admins = await load_admin_ids()
+                admin_cache[ADMIN_CACHE_KEY] = admins
+    return admins
+
+
+def invalidate_admin_cache() -> None:
+    """Сбросить кэш после изменения users.is_admin"""
+    admin_cache.invalidate(ADMIN_CACHE_KEY)
+
 
 @connect_db
-async def is_admin(session: AsyncSession, tg_id: int) -> bool:
+async def load_admin_ids(session: AsyncSession) -> frozenset[int]:
+    admins = await session.scalars(select(User.tg_id).where(User.is_admin))
+    return frozenset(admins.all())
+
+
+async def is_admin(tg_id: int) -> bool:
     try:
-        check_admin = await session.scalar(select(User.is_admin).where(User.tg_id == tg_id))
-        if check_admin:
-            return bool(check_admin)
-        return False
+        return tg_id in await get_admin_ids()
     except Exception as e:
         print(f'Проверка администратора для tg_id {tg_id} {e}')
         return False
 
 
-@connect_db
-async def get_all_admin(session: AsyncSession) -> list[int]:
-    admin = await session.scalars(select(User.tg_id).where(User.is_admin))
-    list_admin = [tg_id for tg_id in admin.all()]
-
-    return list_admin
+async def get_all_admin() -> list[int]:
+    return sorted(await get_admin_ids())
 
 
-@connect_db
-async def get_all_users_tg_id(session: AsyncSession) -> list[int]:
-    """Получаем список всех пользователей (tg_id)"""
-    users = await session.scalars(select(User.tg_id))
-    list_users = [tg_id for tg_id in users.all()]
+@dataclass(frozen=True, slots=True)
+class MailingFilter:
+    """Аудитория рассылки: хранится вместо списка получателей и в FSM, и в задании рассылки"""
 
-    return list_users
+    all_users: bool = False
+    ages: list[str] = field(default_factory=list)
+    districts: list[str] = field(default_factory=list)
+    targets: list[str] = field(default_factory=list)
+    genders: list[str] = field(default_factory=list)
 
+    @classmethod
+    def from_state_data(cls, data: dict[str, Any]) -> 'MailingFilter':
+        return cls(
+            ages=data.get('age_users', []),
+            districts=data.get('district_users', []),
+            targets=data.get('target_users', []),
+            genders=data.get('gender_users', []),
+        )
 
-@connect_db
-async def get_users_for_mass_send(session: AsyncSession, state: FSMContext) -> list[tuple[int, Optional[str]]]:
-    """Получаем список всех пользователей (tg_id, username) согласно фильтрам рассылки"""
-    data = await state.get_data()
-
-    # Базовый запрос
-    query = select(User.tg_id, User.username).where(User.username.is_not(None))
-
-    # Оптимизация возрастных диапазонов
-    if age_ranges := data.get('age_users', []):
-        age_conditions = []
-        current_min: Optional[int] = None
-        current_max: Optional[int] = None
-
-        # Сортируем диапазоны
-        sorted_ranges = sorted([r for r in age_ranges if isinstance(r, str)], key=lambda x: int(x.split('-')[0]))
-
-        for age_range in sorted_ranges:
-            try:
-                range_min, range_max = map(int, age_range.split('-'))
-                if current_min is None or current_max is None:
-                    current_min, current_max = range_min, range_max
-                elif range_min == current_max + 1:
-                    current_max = range_max
-                else:
-                    if current_min is not None and current_max is not None:
-                        age_conditions.append((User.year >= current_min) & (User.year <= current_max))
-                    current_min, current_max = range_min, range_max
-            except (ValueError, AttributeError):
-                continue
-
-        if current_min is not None and current_max is not None:
-            age_conditions.append((User.year >= current_min) & (User.year <= current_max))
-
-        if age_conditions:
-            query = query.where(or_(*age_conditions))
-
-    # Собираем ID опций для фильтров
-    option_filters = []
-
-    # Фильтр по району
-    if districts := data.get('district_users', []):
-        district_options = await session.scalars(select(Option.id).where(Option.name.in_(districts)))
-        option_filters.append(district_options.all())  # Сохраняем список ID
-
-    # Фильтр по цели
-    if targets := data.get('target_users', []):
-        target_options = await session.scalars(select(Option.id).where(Option.name.in_(targets)))
-        option_filters.append(target_options.all())
-
-    # Фильтр по полу
-    if genders := data.get('gender_users', []):
-        gender_options = await session.scalars(select(Option.id).where(Option.name.in_(genders)))
-        option_filters.append(gender_options.all())
-
-    # Добавляем условия JOIN для каждого фильтра
-    for i, option_ids in enumerate(option_filters):
-        if not option_ids:  # Пропускаем пустые списки
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> 'MailingFilter':
+        return cls(**data)
+
+    def to_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+def age_conditions(age_ranges: list[str]) -> list[ColumnElement[bool]]:
+    """Условия по годам рождения; соседние диапазоны склеиваются в один"""
+    conditions: list[ColumnElement[bool]] = []
+    current_min: Optional[int] = None
+    current_max: Optional[int] = None
+
+    # Сортируем диапазоны
+    sorted_ranges = sorted([r for r in age_ranges if isinstance(r, str)], key=lambda x: int(x.split('-')[0]))
+
+    for age_range in sorted_ranges:
+        try:
+            range_min, range_max = map(int, age_range.split('-'))
+            if current_min is None or current_max is None:
+                current_min, current_max = range_min, range_max
+            elif range_min == current_max + 1:
+                current_max = range_max
+            else:
+                conditions.append((User.year >= current_min) & (User.year <= current_max))
+                current_min, current_max = range_min, range_max
+        except (ValueError, AttributeError):
             continue
 
-        uo_alias = aliased(UserOption, name=f'uo_{i}')
-        query = query.join(
-            uo_alias,
-            and_(
-                uo_alias.user_id == User.id,
-                uo_alias.selected,
-                uo_alias.option_id.in_(option_ids),  # Теперь передается список ID
-            ),
+    if current_min is not None and current_max is not None:
+        conditions.append((User.year >= current_min) & (User.year <= current_max))
+    return conditions
+
+
+def mailing_recipients_conditions(mailing_filter: MailingFilter) -> list[ColumnElement[bool]]:
+    """WHERE для пользователей из аудитории рассылки
+
+    Опции выбираются подзапросом по названию, а фильтры по опциям - полусоединениями (EXISTS),
+    поэтому запрос не дает дублей и не требует отдельных обращений к БД.
+    """
+    conditions: list[ColumnElement[bool]] = [
+        User.tg_id.is_not(None),
+        # Чаты, заблокировавшие бота, в рассылку не попадают
+        ~exists().where(DeliveryHealth.tg_id == User.tg_id, DeliveryHealth.is_dead),
+    ]
+    if mailing_filter.all_users:
+        return conditions
+
+    conditions.append(User.username.is_not(None))
+    if ages := age_conditions(mailing_filter.ages):
+        conditions.append(or_(*ages))
+
+    for names in (mailing_filter.districts, mailing_filter.targets, mailing_filter.genders):
+        if not names:
+            continue
+        conditions.append(
+            exists().where(
+                UserOption.user_id == User.id,
+                UserOption.selected,
+                UserOption.option_id.in_(select(Option.id).where(Option.name.in_(names))),
+            )
         )
+    return conditions
 
-    # Выполняем запрос
-    result = await session.execute(query)
-    return [(row.tg_id, row.username) for row in result.unique()]
+
+@connect_db
+async def count_mailing_recipients(session: AsyncSession, mailing_filter: MailingFilter) -> int:
+    count = await session.scalar(
+        select(func.count()).select_from(User).where(*mailing_recipients_conditions(mailing_filter))
+    )
+    return int(count or 0)
+
+
+async def stream_mailing_recipients(
+    mailing_filter: MailingFilter, batch_size: int = 1000
+) -> AsyncIterator[list[tuple[int, Optional[str]]]]:
+    """Пачки (tg_id, username) аудитории рассылки через серверный курсор
+
+    В памяти одновременно только одна пачка, сколько бы ни было получателей. Курсор держит
+    соединение, пока идет обход, поэтому используется собственная сессия, а не сессия апдейта.
+    """
+    query = (
+        select(User.tg_id, User.username)
+        .where(*mailing_recipients_conditions(mailing_filter))
+        .order_by(User.id)
+        .execution_options(yield_per=batch_size)
+    )
+    async with async_session() as session:
+        result = await session.stream(query)
+        async for partition in result.partitions():
+            yield [(row.tg_id, row.username) for row in partition]
@@ -0,0 +1,251 @@
+import asyncio
+import heapq
+import logging
+import os
+import time
+
+from array import array
+from bisect import bisect_left
+from collections.abc import Iterable, Iterator
+from typing import NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.bot.db.models import User, UserProfile
+from src.bot.db.repositories.options_repository import option_catalog
+from src.bot.utils.age_range_utils import is_age_in_range
+from src.bot.utils.decorators import connect_db
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CANDIDATE_POOLS_REFRESH_INTERVAL = int(os.environ.get('CANDIDATE_POOLS_REFRESH_INTERVAL', 600))
+
+# Соседние округа, в которых ищем людей
+DISTRICT_GROUPS = {
+    'ЦАО': ['ЦАО', 'ЗАО', 'СЗАО', 'САО', 'СВАО', 'ВАО', 'ЮВАО', 'ЮАО', 'ЮЗАО'],
+    'ЗАО': ['ЗАО', 'СЗАО', 'ЮЗАО', 'ЦАО'],
+    'СЗАО': ['СЗАО', 'САО', 'ЗАО', 'ЦАО'],
+    'САО': ['САО', 'СЗАО', 'СВАО', 'ЦАО'],
+    'СВАО': ['СВАО', 'САО', 'ВАО', 'ЦАО'],
+    'ВАО': ['ВАО', 'СВАО', 'ЮВАО', 'ЦАО'],
+    'ЮВАО': ['ЮВАО', 'ВАО', 'ЮАО', 'ЦАО'],
+    'ЮАО': ['ЮАО', 'ЮВАО', 'ЮЗАО', 'ЦАО'],
+    'ЮЗАО': ['ЮЗАО', 'ЮАО', 'ЗАО', 'ЦАО'],
+}
+
+PoolKey = tuple[Optional[str], str]  # (округ, возрастной диапазон)
+
+
+def search_districts(district: str) -> list[str]:
+    return DISTRICT_GROUPS.get(district, [district])
+
+
+class Candidate(NamedTuple):
+    search_rank: float
+    id: int
+    tg_id: int
+
+
+class CandidateRow(NamedTuple):
+    id: int
+    tg_id: int
+    search_rank: float
+    year: Optional[int]
+    district: Optional[str]
+
+
+@connect_db
+async def load_candidates(session: AsyncSession) -> list[CandidateRow]:
+    """Пользователи с указанным возрастом для построения пулов"""
+    rows = await session.execute(
+        select(User.id, User.tg_id, User.search_rank, User.year, UserProfile.district)
+        .join(UserProfile, UserProfile.user_id == User.id)
+        .where(User.year.is_not(None))
+    )
+    return [CandidateRow(*row) for row in rows]
+
+
+class _Pool:
+    """Пользователи одного пула в параллельных массивах, отсортированных по (search_rank, id)"""
+
+    __slots__ = ('ranks', 'ids', 'tg_ids')
+
+    def __init__(self) -> None:
+        self.ranks = array('d')
+        self.ids = array('q')
+        self.tg_ids = array('q')
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _position(self, rank: float, user_id: int) -> int:
+        """Индекс первого элемента не меньше (rank, user_id)"""
+        i = bisect_left(self.ranks, rank)
+        while i < len(self.ranks) and self.ranks[i] == rank and self.ids[i] < user_id:
+            i += 1
+        return i
+
+    def insert(self, candidate: Candidate) -> None:
+        i = self._position(candidate.search_rank, candidate.id)
+        self.ranks.insert(i, candidate.search_rank)
+        self.ids.insert(i, candidate.id)
+        self.tg_ids.insert(i, candidate.tg_id)
+
+    def remove(self, rank: float, user_id: int) -> None:
+        i = self._position(rank, user_id)
+        if i < len(self.ids) and self.ids[i] == user_id:
+            del self.ranks[i]
+            del self.ids[i]
+            del self.tg_ids[i]
+
+    def iter_range(self, low: float, high: float, after: Optional[tuple[float, int]]) -> Iterator[Candidate]:
+        """Элементы с low <= rank < high строго после позиции after"""
+        i = bisect_left(self.ranks, low)
+        if after is not None:
+            i = max(i, self._position(*after))
+            if i < len(self.ids) and (self.ranks[i], self.ids[i]) == after:
+                i += 1
+        while i < len(self.ids) and self.ranks[i] < high:
+            yield Candidate(self.ranks[i], self.ids[i], self.tg_ids[i])
+            i += 1
+
+
+class CandidatePools:
+    """Пулы кандидатов для поиска людей по (округ, возрастной диапазон) в памяти процесса
+
+    Полностью перестраиваются фоновой задачей и точечно обновляются после сохранения анкеты.
+    """
+
+    def __init__(self, refresh_interval: int = CANDIDATE_POOLS_REFRESH_INTERVAL) -> None:
+        self.refresh_interval = refresh_interval
+        self._pools: dict[PoolKey, _Pool] = {}
+        self._members: dict[int, tuple[float, list[PoolKey]]] = {}
+        self._age_ranges: tuple[str, ...] = ()
+        self._loaded_at: Optional[float] = None
+        self._pending: Optional[list[CandidateRow]] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def is_ready(self) -> bool:
+        # Если фоновое обновление перестало работать, поиск уходит в SQL
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.refresh_interval * 3
+
+    def can_answer(self, age_ranges: list[str]) -> bool:
+        return self.is_ready and bool(age_ranges) and all(age_range in self._age_ranges for age_range in age_ranges)
+
+    async def rebuild(self) -> None:
+        """Перестраивает все пулы одним запросом"""
+        async with self._lock:
+            self._pending = []
+            try:
+                age_ranges = tuple(option.name for option in await option_catalog.get_category('age_ranges'))
+                rows = await load_candidates()
+
+                pools: dict[PoolKey, _Pool] = {}
+                members: dict[int, tuple[float, list[PoolKey]]] = {}
+                for row in sorted(rows, key=lambda row: (row.search_rank, row.id)):
+                    keys = self._keys(row, age_ranges)
+                    candidate = Candidate(row.search_rank, row.id, row.tg_id)
+                    for key in keys:
+                        # Строки уже отсортированы, поэтому просто дописываем в конец
+                        pool = pools.setdefault(key, _Pool())
+                        pool.ranks.append(candidate.search_rank)
+                        pool.ids.append(candidate.id)
+                        pool.tg_ids.append(candidate.tg_id)
+                    members[row.id] = (row.search_rank, keys)
+
+                self._pools, self._members, self._age_ranges = pools, members, age_ranges
+                self._loaded_at = time.monotonic()
+
+                # Применяем изменения анкет, пришедшие во время загрузки
+                for row in self._pending:
+                    self._apply(row)
+            finally:
+                self._pending = None
+
+        logger.info(f'Candidate pools rebuilt: {len(rows)} users in {len(pools)} pools')
+
+    async def run(self) -> None:
+        """Фоновая задача периодической перестройки пулов"""
+        while True:
+            try:
+                await self.rebuild()
+            except Exception as e:
+                logger.error(f'Failed to rebuild candidate pools: {e}', exc_info=True)
+            await asyncio.sleep(self.refresh_interval)
+
+    def update_user(self, row: CandidateRow) -> None:
+        """Переносит пользователя в пулы по новым возрасту и округу"""
+        if self._pending is not None:
+            self._pending.append(row)
+        self._apply(row)
+
+    def _apply(self, row: CandidateRow) -> None:
+        previous = self._members.pop(row.id, None)
+        if previous is not None:
+            rank, keys = previous
+            for key in keys:
+                self._pools[key].remove(rank, row.id)
+
+        keys = self._keys(row, self._age_ranges)
+        candidate = Candidate(row.search_rank, row.id, row.tg_id)
+        for key in keys:
+            self._pools.setdefault(key, _Pool()).insert(candidate)
+        self._members[row.id] = (row.search_rank, keys)
+
+    @staticmethod
+    def _keys(row: CandidateRow, age_ranges: Iterable[str]) -> list[PoolKey]:
+        if row.year is None:
+            return []
+        return [(row.district, age_range) for age_range in age_ranges if is_age_in_range(row.year, age_range)]
+
+    def fetch(
+        self,
+        districts: Optional[list[str]],
+        age_ranges: list[str],
+        low: float,
+        high: float,
+        after: Optional[tuple[float, int]],
+        limit: int,
+        exclude_tg_id: int,
+    ) -> list[Candidate]:
+        """Следующие limit кандидатов по (search_rank, id) из объединения подходящих пулов
+
+        districts=None означает любые округа.
+        """
+        selected = set(age_ranges)
+        pools = [
+            pool
+            for (district, age_range), pool in self._pools.items()
+            if age_range in selected and (districts is None or district in districts)
+        ]
+
+        # Из каждого пула достаточно первых limit элементов, дальше k-way merge
+        heads: list[list[Candidate]] = []
+        for pool in pools:
+            head: list[Candidate] = []
+            for candidate in pool.iter_range(low, high, after):
+                if candidate.tg_id == exclude_tg_id:
+                    continue
+                head.append(candidate)
+                if len(head) == limit:
+                    break
+            heads.append(head)
+
+        result: list[Candidate] = []
+        seen: set[int] = set()
+        for candidate in heapq.merge(*heads):
+            # Пересекающиеся возрастные диапазоны дают одного пользователя в нескольких пулах
+            if candidate.id in seen:
+                continue
+            seen.add(candidate.id)
+            result.append(candidate)
+            if len(result) == limit:
+                break
+        return result
+
+
+candidate_pools = CandidatePools()
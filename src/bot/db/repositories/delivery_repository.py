@@ -0,0 +1,88 @@
+import logging
+
+from datetime import datetime, timezone
+from typing import Any, Callable, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.bot.db.models import DeliveryHealth
+from src.bot.utils.decorators import connect_db
+from src.bot.utils.mailing import DeliveryStatus
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def _upsert(session: AsyncSession, rows: list[dict[str, Any]], set_: Callable[[Any], dict[str, Any]]) -> None:
+    if not rows:
+        return
+    stmt = pg_insert(DeliveryHealth).values(rows)
+    await session.execute(stmt.on_conflict_do_update(index_elements=[DeliveryHealth.tg_id], set_=set_(stmt)))
+
+
+@connect_db
+async def record_deliveries(session: AsyncSession, results: list[tuple[int, DeliveryStatus, Optional[str]]]) -> None:
+    """Обновляет здоровье чатов по итогам отправок: по одному upsert на каждый исход"""
+    now = datetime.now(timezone.utc)
+    # Последний исход по чату, если он встретился в пачке несколько раз
+    latest = {tg_id: (status, error) for tg_id, status, error in results}
+    by_status: dict[DeliveryStatus, list[dict[str, Any]]] = {}
+    for tg_id, (status, error) in latest.items():
+        row: dict[str, Any] = {'tg_id': tg_id, 'is_dead': status is DeliveryStatus.BLOCKED, 'dead_reason': None}
+        if status is DeliveryStatus.SENT:
+            row.update(last_success_at=now, consecutive_failures=0)
+        else:
+            row.update(last_failure_at=now, consecutive_failures=1)
+            if status is DeliveryStatus.BLOCKED:
+                row['dead_reason'] = error
+        by_status.setdefault(status, []).append(row)
+
+    await _upsert(
+        session,
+        by_status.get(DeliveryStatus.SENT, []),
+        lambda stmt: {
+            'last_success_at': stmt.excluded.last_success_at,
+            'consecutive_failures': 0,
+            'is_dead': False,
+            'dead_reason': None,
+        },
+    )
+    await _upsert(
+        session,
+        by_status.get(DeliveryStatus.BLOCKED, []),
+        lambda stmt: {
+            'last_failure_at': stmt.excluded.last_failure_at,
+            'consecutive_failures': DeliveryHealth.consecutive_failures + 1,
+            'is_dead': True,
+            'dead_reason': stmt.excluded.dead_reason,
+        },
+    )
+    await _upsert(
+        session,
+        by_status.get(DeliveryStatus.FAILED, []),
+        lambda stmt: {
+            'last_failure_at': stmt.excluded.last_failure_at,
+            'consecutive_failures': DeliveryHealth.consecutive_failures + 1,
+        },
+    )
+    await session.commit()
+
+
+@connect_db
+async def get_dead_chat_ids(session: AsyncSession) -> set[int]:
+    result = await session.scalars(select(DeliveryHealth.tg_id).where(DeliveryHealth.is_dead))
+    return set(result.all())
+
+
+@connect_db
+async def mark_alive(session: AsyncSession, tg_id: int) -> None:
+    """Пользователь снова пишет боту: значит, разблокировал его"""
+    await session.execute(
+        update(DeliveryHealth)
+        .where(DeliveryHealth.tg_id == tg_id)
+        .values(is_dead=False, dead_reason=None, consecutive_failures=0)
+    )
+    await session.commit()
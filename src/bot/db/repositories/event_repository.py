@@ -2,13 +2,15 @@ import logging
 
 from collections.abc import Sequence
 
-from sqlalchemy import and_, or_, select
+from sqlalchemy import Integer, all_, and_, bindparam, or_, select
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.bot.db.models import Event, EventInterest, Option, OptionCategory
 from src.bot.db.repositories.user_data_utils import get_user_data
 from src.bot.utils.age_range_utils import is_age_in_range
 from src.bot.utils.decorators import connect_db
+from src.bot.utils.seen import seen_events
 
 
 logging.basicConfig(level=logging.INFO)
@@ -28,12 +30,12 @@ async def get_recommended_events(session: AsyncSession, tg_id: int, limit: int =
         return None
 
     # Проверка возраста (обязательное поле)
-    if not user_data.get('year'):
+    if not user_data.year:
         logger.warning(f'Age not specified for user: {tg_id}')
         return None
 
     try:
-        user_age = int(user_data['year'])
+        user_age = int(user_data.year)
     except (ValueError, TypeError) as e:
         logger.error(f'Invalid age format for user {tg_id}: {e}')
         return None
@@ -65,21 +67,21 @@ async def get_recommended_events(session: AsyncSession, tg_id: int, limit: int =
     conditions.append(or_(*age_conditions))
 
     # 2. Фильтр по полу (если указан)
-    if user_data.get('gender'):
-        conditions.append(or_(Event.gender == user_data['gender'], Event.gender.is_(None), Event.gender == 'Любой'))
+    if user_data.gender:
+        conditions.append(or_(Event.gender == user_data.gender, Event.gender.is_(None), Event.gender == 'Любой'))
 
     # 3. Фильтр по статусу (если указан)
-    if user_data.get('status'):
-        conditions.append(or_(Event.status == user_data['status'], Event.status.is_(None), Event.status == 'Любой'))
+    if user_data.status:
+        conditions.append(or_(Event.status == user_data.status, Event.status.is_(None), Event.status == 'Любой'))
 
     # 4. Фильтр по интересам (если указаны)
-    if user_data.get('interests'):
+    if user_data.interests:
         # Получаем ID выбранных интересов
         interest_ids = (
             await session.scalars(
                 select(Option.id)
                 .join(OptionCategory)
-                .where(OptionCategory.name == 'interest', Option.name.in_(user_data['interests']))
+                .where(OptionCategory.name == 'interest', Option.name.in_(user_data.interests))
             )
         ).all()
 
@@ -103,14 +105,15 @@ async def get_recommended_events(session: AsyncSession, tg_id: int, limit: int =
     logger.info(f'Final query: {final_query}')
 
     try:
-        result = await session.scalars(final_query)
-        events = result.all()
+        async with session.begin_nested():
+            result = await session.scalars(final_query)
+            events = result.all()
 
-        if not events:
-            logger.info('No events after all filters applied')
-            return []
+            if not events:
+                logger.info('No events after all filters applied')
+                return []
 
-        return events
+            return events
     except Exception as e:
         logger.error(f'Query execution error: {e}')
         return None
@@ -124,21 +127,22 @@ async def get_recommended_events_new(
     session: AsyncSession,
     tg_id: int,
     limit: int = 3,
-    exclude_ids: list[int] | None = None,
 ) -> Sequence[Event] | None:
+    """Следующие непоказанные события, новые первыми
+
+    Показанные события берутся из seen_events и исключаются в самом запросе (id <> ALL(:seen_ids)),
+    так что выдача - один запрос, сколько бы событий пользователь ни видел.
+    """
     # Получаем данные пользователя
     user_data = await get_user_data(tg_id)
-    if not user_data or not user_data.get('year'):
+    if not user_data or not user_data.year:
         return None
 
     try:
-        user_age = int(user_data['year'])
+        user_age = int(user_data.year)
     except (ValueError, TypeError):
         return None
 
-    # Базовый запрос без лишних джойнов
-    query = select(Event)
-
     # Основные условия фильтрации
     conditions = []
 
@@ -154,15 +158,15 @@ async def get_recommended_events_new(
     conditions.append(or_(*age_conds))
 
     # Фильтр по полу (если указан)
-    if gender := user_data.get('gender'):
+    if gender := user_data.gender:
         conditions.append(or_(Event.gender == gender, Event.gender.is_(None), Event.gender == 'Любой'))
 
     # Фильтр по статусу (если указан)
-    if status := user_data.get('status'):
+    if status := user_data.status:
         conditions.append(or_(Event.status == status, Event.status.is_(None), Event.status == 'Любой'))
 
     # Фильтр по интересам (только если указаны)
-    if interests := user_data.get('interests'):
+    if interests := user_data.interests:
         stmt = (
             select(EventInterest.event_id)
             .join(Option, EventInterest.interest_id == Option.id)
@@ -171,18 +175,17 @@ async def get_recommended_events_new(
         )
         conditions.append(Event.id.in_(stmt))
 
-    # Исключаем уже показанные события
-    if exclude_ids:
-        conditions.append(Event.id.not_in(exclude_ids))
+    # Исключаем уже показанные: один параметр-массив вместо списка литералов
+    if seen_ids := seen_events.seen_ids(tg_id):
+        conditions.append(Event.id != all_(bindparam('seen_ids', sorted(seen_ids), type_=ARRAY(Integer))))
 
     # Применяем все условия
-    query = query.where(and_(*conditions))
-
-    # Случайная сортировка и лимит
-    query = query.order_by().limit(limit)
+    query = select(Event).where(and_(*conditions)).order_by(Event.id.desc()).limit(limit)
 
     try:
-        return (await session.scalars(query)).all()
+        async with session.begin_nested():
+            events = await session.scalars(query)
+            return events.all()
     except Exception as e:
         logger.error(f'Query error: {e}')
         return None
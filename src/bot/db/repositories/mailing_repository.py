@@ -0,0 +1,151 @@
+import logging
+
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+from sqlalchemy import func, insert, literal, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.bot.db.models import MailingDelivery, MailingJob, User
+from src.bot.db.repositories.admin_repository import MailingFilter, mailing_recipients_conditions
+from src.bot.utils.decorators import connect_db
+from src.bot.utils.mailing import DeliveryStatus, JobStatus
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+@connect_db
+async def create_mailing_job(
+    session: AsyncSession,
+    admin_chat_id: int,
+    text: Optional[str],
+    media: list[dict[str, Any]],
+    mailing_filter: MailingFilter,
+) -> MailingJob:
+    """Создает задание и строки получателей в статусе pending
+
+    Получатели выбираются из users одним INSERT ... SELECT, не проходя через Python.
+    """
+    job = MailingJob(
+        admin_chat_id=admin_chat_id,
+        status=JobStatus.RUNNING.value,
+        text=text,
+        media=media,
+        filters=mailing_filter.to_dict(),
+    )
+    session.add(job)
+    await session.flush()
+
+    recipients = select(literal(job.id), User.tg_id, literal(DeliveryStatus.PENDING.value)).where(
+        *mailing_recipients_conditions(mailing_filter)
+    )
+    result = await session.execute(insert(MailingDelivery).from_select(['job_id', 'tg_id', 'status'], recipients))
+    job.total = int(result.rowcount)  # type: ignore[attr-defined]
+    await session.commit()
+    logger.info(f'Mailing job {job.id} created for {job.total} recipients')
+    return job
+
+
+@connect_db
+async def get_mailing_job(session: AsyncSession, job_id: int) -> Optional[MailingJob]:
+    return await session.get(MailingJob, job_id)
+
+
+@connect_db
+async def get_job_status(session: AsyncSession, job_id: int) -> Optional[JobStatus]:
+    status = await session.scalar(select(MailingJob.status).where(MailingJob.id == job_id))
+    return JobStatus(status) if status else None
+
+
+@connect_db
+async def get_running_job_ids(session: AsyncSession) -> list[int]:
+    result = await session.scalars(select(MailingJob.id).where(MailingJob.status == JobStatus.RUNNING.value))
+    return list(result.all())
+
+
+@connect_db
+async def set_progress_message(session: AsyncSession, job_id: int, message_id: int) -> None:
+    await session.execute(update(MailingJob).where(MailingJob.id == job_id).values(progress_message_id=message_id))
+    await session.commit()
+
+
+@connect_db
+async def set_job_status(
+    session: AsyncSession, job_id: int, status: JobStatus, expected: tuple[JobStatus, ...]
+) -> bool:
+    """Меняет статус, только если текущий входит в expected; False - если задание уже в другом статусе"""
+    result = await session.execute(
+        update(MailingJob)
+        .where(MailingJob.id == job_id, MailingJob.status.in_([item.value for item in expected]))
+        .values(status=status.value)
+    )
+    await session.commit()
+    return bool(result.rowcount)  # type: ignore[attr-defined]
+
+
+@connect_db
+async def claim_deliveries(session: AsyncSession, job_id: int, limit: int) -> list[int]:
+    """Забирает следующую пачку получателей и помечает ее sending до отправки
+
+    SKIP LOCKED не дает двум воркерам забрать одни и те же строки, а пометка фиксируется
+    отдельной транзакцией: после падения процесса такие получатели не получат сообщение повторно.
+    """
+    pending = (
+        select(MailingDelivery.tg_id)
+        .where(MailingDelivery.job_id == job_id, MailingDelivery.status == DeliveryStatus.PENDING.value)
+        .order_by(MailingDelivery.tg_id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    result = await session.scalars(
+        update(MailingDelivery)
+        .where(MailingDelivery.job_id == job_id, MailingDelivery.tg_id.in_(pending))
+        .values(status=DeliveryStatus.SENDING.value, date_update=func.now())
+        .returning(MailingDelivery.tg_id)
+    )
+    claimed = list(result.all())
+    await session.commit()
+    return claimed
+
+
+@connect_db
+async def save_delivery_results(
+    session: AsyncSession, job_id: int, results: list[tuple[int, DeliveryStatus, Optional[str]]]
+) -> None:
+    """Записывает итог доставки пачкой UPDATE по первичному ключу"""
+    if not results:
+        return
+
+    now = datetime.now(timezone.utc)
+    await session.execute(
+        update(MailingDelivery),
+        [
+            {'job_id': job_id, 'tg_id': tg_id, 'status': status.value, 'error': error, 'date_update': now}
+            for tg_id, status, error in results
+        ],
+    )
+    await session.commit()
+
+
+@connect_db
+async def interrupt_sending(session: AsyncSession, job_id: int) -> int:
+    """Получатели, забранные упавшим процессом, помечаются interrupted"""
+    result = await session.execute(
+        update(MailingDelivery)
+        .where(MailingDelivery.job_id == job_id, MailingDelivery.status == DeliveryStatus.SENDING.value)
+        .values(status=DeliveryStatus.INTERRUPTED.value, date_update=func.now())
+    )
+    await session.commit()
+    return int(result.rowcount)  # type: ignore[attr-defined]
+
+
+@connect_db
+async def count_deliveries(session: AsyncSession, job_id: int) -> dict[DeliveryStatus, int]:
+    result = await session.execute(
+        select(MailingDelivery.status, func.count())
+        .where(MailingDelivery.job_id == job_id)
+        .group_by(MailingDelivery.status)
+    )
+    return {DeliveryStatus(status): count for status, count in result.all()}
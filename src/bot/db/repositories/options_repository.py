@@ -1,6 +1,11 @@
+import asyncio
 import logging
+import os
+import time
 
-from collections.abc import Sequence
+from collections.abc import Iterable, Sequence
+from dataclasses import dataclass
+from typing import Optional
 
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -13,56 +18,106 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
 
+OPTIONS_CACHE_TTL = int(os.environ.get('OPTIONS_CACHE_TTL', 3600))
 
-@connect_db
-async def get_all_gender(session: AsyncSession) -> Sequence[Option]:
-    gender = await session.scalars(
-        select(Option).join(OptionCategory).where(OptionCategory.name == 'gender').order_by(Option.id)
-    )
 
-    return gender.all()
+@dataclass(frozen=True, slots=True)
+class OptionItem:
+    id: int
+    name: str
+    category: str
 
 
 @connect_db
-async def get_all_marital_status(session: AsyncSession) -> Sequence[Option]:
-    marital_status = await session.scalars(
-        select(Option).join(OptionCategory).where(OptionCategory.name == 'status').order_by(Option.id)
+async def load_all_options(session: AsyncSession) -> list[OptionItem]:
+    """Загружает все опции со своими категориями одним запросом"""
+    rows = await session.execute(
+        select(Option.id, Option.name, OptionCategory.name)
+        .join(OptionCategory, Option.category_id == OptionCategory.id)
+        .order_by(Option.id)
     )
 
-    return marital_status.all()
+    return [OptionItem(id=option_id, name=name, category=category) for option_id, name, category in rows]
 
 
-@connect_db
-async def get_all_target(session: AsyncSession) -> Sequence[Option]:
-    target = await session.scalars(
-        select(Option).join(OptionCategory).where(OptionCategory.name == 'target').order_by(Option.id)
-    )
+class OptionCatalog:
+    """Справочник опций в памяти процесса с индексами по категории и по имени"""
 
-    return target.all()
+    def __init__(self, ttl: int = OPTIONS_CACHE_TTL) -> None:
+        self.ttl = ttl
+        self._by_category: dict[str, tuple[OptionItem, ...]] = {}
+        self._ids: dict[tuple[str, str], int] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
 
+    @property
+    def is_fresh(self) -> bool:
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
 
-@connect_db
-async def get_all_districts(session: AsyncSession) -> Sequence[Option]:
-    districts = await session.scalars(
-        select(Option).join(OptionCategory).where(OptionCategory.name == 'district').order_by(Option.id)
-    )
+    def invalidate(self) -> None:
+        """Помечает справочник устаревшим, он перезагрузится при следующем обращении"""
+        self._loaded_at = None
 
-    return districts.all()
+    async def refresh(self) -> None:
+        """Принудительно перезагружает справочник из БД"""
+        async with self._lock:
+            await self._load()
 
+    async def _ensure_loaded(self) -> None:
+        if self.is_fresh:
+            return
 
-@connect_db
-async def get_all_interests(session: AsyncSession) -> Sequence[Option]:
-    interests = await session.scalars(
-        select(Option).join(OptionCategory).where(OptionCategory.name == 'interest').order_by(Option.id)
-    )
+        async with self._lock:
+            if not self.is_fresh:
+                await self._load()
 
-    return interests.all()
+    async def _load(self) -> None:
+        options = await load_all_options()
 
+        by_category: dict[str, list[OptionItem]] = {}
+        for option in options:
+            by_category.setdefault(option.category, []).append(option)
+
+        self._by_category = {category: tuple(items) for category, items in by_category.items()}
+        self._ids = {(option.category, option.name): option.id for option in options}
+        self._loaded_at = time.monotonic()
+        logger.info(f'Option catalog loaded: {len(options)} options in {len(by_category)} categories')
+
+    async def get_category(self, category: str) -> tuple[OptionItem, ...]:
+        await self._ensure_loaded()
+        return self._by_category.get(category, ())
+
+    async def get_id(self, category: str, name: str) -> Optional[int]:
+        await self._ensure_loaded()
+        return self._ids.get((category, name))
+
+    async def get_ids(self, category: str, names: Iterable[str]) -> list[int]:
+        await self._ensure_loaded()
+        return [option_id for name in names if (option_id := self._ids.get((category, name))) is not None]
+
+
+option_catalog = OptionCatalog()
+
+
+async def get_all_gender() -> Sequence[OptionItem]:
+    return await option_catalog.get_category('gender')
+
+
+async def get_all_marital_status() -> Sequence[OptionItem]:
+    return await option_catalog.get_category('status')
+
+
+async def get_all_target() -> Sequence[OptionItem]:
+    return await option_catalog.get_category('target')
+
+
+async def get_all_districts() -> Sequence[OptionItem]:
+    return await option_catalog.get_category('district')
+
+
+async def get_all_interests() -> Sequence[OptionItem]:
+    return await option_catalog.get_category('interest')
 
-@connect_db
-async def get_all_age_range(session: AsyncSession) -> Sequence[Option]:
-    age_range = await session.scalars(
-        select(Option).join(OptionCategory).where(OptionCategory.name == 'age_ranges').order_by(Option.id)
-    )
 
-    return age_range.all()
+async def get_all_age_range() -> Sequence[OptionItem]:
+    return await option_catalog.get_category('age_ranges')
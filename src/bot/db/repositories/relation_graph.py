@@ -0,0 +1,134 @@
+import logging
+import os
+
+from dataclasses import dataclass, field
+
+from sqlalchemy import literal, select, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.bot.db.models import FriendRequest, LikeProfile, User
+from src.bot.utils.cache import MISSING, StatsTTLCache
+from src.bot.utils.decorators import connect_db
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Входящие связи меняют другие пользователи (возможно, в другом воркере), поэтому запись живет ограниченно
+RELATION_CACHE_SIZE = int(os.environ.get('RELATION_CACHE_SIZE', 20000))
+RELATION_CACHE_TTL = int(os.environ.get('RELATION_CACHE_TTL', 600))
+
+
+@dataclass(slots=True)
+class UserRelations:
+    """Связи пользователя в tg_id: кому он поставил лайк или дружбу, кто ему, с кем взаимно"""
+
+    liked: set[int] = field(default_factory=set)
+    friends: set[int] = field(default_factory=set)
+    liked_by: set[int] = field(default_factory=set)
+    friended_by: set[int] = field(default_factory=set)
+    reciprocated_likes: set[int] = field(default_factory=set)
+    reciprocated_friends: set[int] = field(default_factory=set)
+
+    def outgoing(self, action_type: str) -> set[int]:
+        return self.liked if action_type == 'like' else self.friends
+
+    def incoming(self, action_type: str) -> set[int]:
+        return self.liked_by if action_type == 'like' else self.friended_by
+
+    def mutual(self, action_type: str) -> set[int]:
+        return self.reciprocated_likes if action_type == 'like' else self.reciprocated_friends
+
+    @property
+    def reciprocated(self) -> set[int]:
+        """С кем есть хотя бы одна взаимная связь"""
+        return self.reciprocated_likes | self.reciprocated_friends
+
+
+@connect_db
+async def load_relations(session: AsyncSession, tg_id: int) -> UserRelations:
+    """Все связи пользователя одним запросом UNION ALL с меткой вида"""
+    me = select(User.id).where(User.tg_id == tg_id).scalar_subquery()
+    query = union_all(
+        # Лайки и запросы в друзья пользователя
+        select(literal('liked').label('kind'), User.tg_id)
+        .join(LikeProfile, User.id == LikeProfile.to_user_id)
+        .where(LikeProfile.from_user_id == me),
+        select(literal('friends'), User.tg_id)
+        .join(FriendRequest, User.id == FriendRequest.to_user_id)
+        .where(FriendRequest.from_user_id == me),
+        # Лайки и запросы в друзья пользователю; взаимные отмечены флагом
+        select(literal('liked_by'), User.tg_id)
+        .join(LikeProfile, User.id == LikeProfile.from_user_id)
+        .where(LikeProfile.to_user_id == me),
+        select(literal('friended_by'), User.tg_id)
+        .join(FriendRequest, User.id == FriendRequest.from_user_id)
+        .where(FriendRequest.to_user_id == me),
+        select(literal('reciprocated_likes'), User.tg_id)
+        .join(LikeProfile, User.id == LikeProfile.from_user_id)
+        .where(LikeProfile.to_user_id == me, LikeProfile.is_reciprocated),
+        select(literal('reciprocated_friends'), User.tg_id)
+        .join(FriendRequest, User.id == FriendRequest.from_user_id)
+        .where(FriendRequest.to_user_id == me, FriendRequest.is_reciprocated),
+    )
+
+    relations = UserRelations()
+    for kind, other_tg_id in await session.execute(query):
+        getattr(relations, kind).add(other_tg_id)
+
+    logger.info(
+        f'Loaded relations for user {tg_id}: likes={len(relations.liked)}, friends={len(relations.friends)}, '
+        f'reciprocated likes={len(relations.reciprocated_likes)}, friends={len(relations.reciprocated_friends)}'
+    )
+    return relations
+
+
+class RelationGraph:
+    """Граф лайков и дружбы процесса: списки смежности пользователей в LRU-кэше
+
+    Запись пользователя загружается при первом обращении, а запись в БД (после коммита)
+    обновляет уже загруженные записи обоих участников вместо сброса.
+    """
+
+    def __init__(self, maxsize: int = RELATION_CACHE_SIZE, ttl: int = RELATION_CACHE_TTL) -> None:
+        self._cache = StatsTTLCache('relations', maxsize=maxsize, ttl=ttl)
+
+    async def get(self, tg_id: int) -> UserRelations:
+        relations = self._cache.lookup(tg_id)
+        if relations is MISSING:
+            relations = await load_relations(tg_id)
+            self._cache[tg_id] = relations
+        return relations
+
+    async def has_edge(self, from_tg_id: int, to_tg_id: int, action_type: str) -> bool:
+        return to_tg_id in (await self.get(from_tg_id)).outgoing(action_type)
+
+    async def is_reciprocated(self, tg_id: int, other_tg_id: int, action_type: str) -> bool:
+        return other_tg_id in (await self.get(tg_id)).mutual(action_type)
+
+    def add_edge(self, from_tg_id: int, to_tg_id: int, action_type: str, reciprocated: bool) -> None:
+        sender = self._cache.get(from_tg_id)
+        if sender is not None:
+            sender.outgoing(action_type).add(to_tg_id)
+            if reciprocated:
+                sender.mutual(action_type).add(to_tg_id)
+
+        receiver = self._cache.get(to_tg_id)
+        if receiver is not None:
+            receiver.incoming(action_type).add(from_tg_id)
+            if reciprocated:
+                receiver.mutual(action_type).add(from_tg_id)
+
+    def remove_edge(self, from_tg_id: int, to_tg_id: int, action_type: str) -> None:
+        sender = self._cache.get(from_tg_id)
+        if sender is not None:
+            sender.outgoing(action_type).discard(to_tg_id)
+            sender.mutual(action_type).discard(to_tg_id)
+
+        receiver = self._cache.get(to_tg_id)
+        if receiver is not None:
+            receiver.incoming(action_type).discard(from_tg_id)
+            receiver.mutual(action_type).discard(from_tg_id)
+
+
+relation_graph = RelationGraph()
@@ -98,10 +98,11 @@ async def get_ticket_with_messages(session: AsyncSession, ticket_id: int) -> Opt
 async def get_ticket_by_id(session: AsyncSession, ticket_id: int) -> Optional[SupportTicket]:
     """Получаем тикет по ID с информацией о пользователе"""
     try:
-        result = await session.execute(
-            select(SupportTicket).options(selectinload(SupportTicket.user)).where(SupportTicket.id == ticket_id)
-        )
-        return result.scalar_one_or_none()
+        async with session.begin_nested():
+            result = await session.execute(
+                select(SupportTicket).options(selectinload(SupportTicket.user)).where(SupportTicket.id == ticket_id)
+            )
+            return result.scalar_one_or_none()
     except Exception as e:
         logger.error(f'❗Error getting ticket by id: {ticket_id} - {e}')
         return None
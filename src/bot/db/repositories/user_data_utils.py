@@ -1,11 +1,16 @@
 import logging
+import os
 
-from typing import Any
+from dataclasses import dataclass
+from typing import Any, Optional
 
-from sqlalchemy import select
+from sqlalchemy import Text, func, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by, array, insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.bot.db.models import Option, OptionCategory, User, UserOption
+from src.bot.db.connection import after_commit
+from src.bot.db.models import Option, OptionCategory, PhotoProfile, User, UserOption, UserProfile
+from src.bot.utils.cache import MISSING, StatsTTLCache
 from src.bot.utils.decorators import connect_db
 
 
@@ -13,60 +18,196 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
 
+PROFILE_CACHE_SIZE = int(os.environ.get('PROFILE_CACHE_SIZE', 10000))
+PROFILE_CACHE_TTL = int(os.environ.get('PROFILE_CACHE_TTL', 300))
+
+# Кэши по tg_id: проекция профиля и file_id фотографий
+profile_cache = StatsTTLCache('profiles', maxsize=PROFILE_CACHE_SIZE, ttl=PROFILE_CACHE_TTL)
+photos_cache = StatsTTLCache('photos', maxsize=PROFILE_CACHE_SIZE, ttl=PROFILE_CACHE_TTL)
+
+
+@dataclass(frozen=True, slots=True)
+class UserProfileData:
+    tg_id: int
+    first_name: Optional[str]
+    username: Optional[str]
+    year: Optional[int]
+    total_likes: int
+    gender: Optional[str]
+    status: Optional[str]
+    target: Optional[str]
+    district: Optional[str]
+    profession: Optional[str]
+    about: Optional[str]
+    interests: tuple[str, ...]
 
-@connect_db
-async def get_user_data(session: AsyncSession, user_id: int) -> dict[str, Any]:
-    user = await session.scalar(select(User).where(User.tg_id == user_id))
-
-    if not user:
-        return {
-            'first_name': None,
-            'username': None,
-            'total_likes': None,
-            'year': None,
-            'gender': None,
-            'status': None,
-            'target': None,
-            'district': None,
-            'profession': None,
-            'about': None,
-            'interests': [],
-        }
-
-    # Получаем все выбранные опции пользователя
-    user_options = await session.execute(
-        select(Option.name, OptionCategory.name)
-        .select_from(UserOption)
-        .join(Option, UserOption.option_id == Option.id)
-        .join(OptionCategory, Option.category_id == OptionCategory.id)
-        .where(UserOption.user_id == user.id)
-    )
 
-    result: dict = {
-        'first_name': user.first_name,
-        'username': user.username,
-        'year': user.year,
-        'total_likes': user.total_likes,
-        'gender': None,
-        'status': None,
-        'target': None,
-        'district': None,
-        'profession': user.profession,
-        'about': user.about,
-        'interests': [],
+def profile_form_data(user_data: Optional[UserProfileData]) -> dict[str, Any]:
+    """Поля анкеты для предзаполнения FSM при редактировании профиля"""
+    return {
+        'year': user_data.year if user_data else None,
+        'gender': user_data.gender if user_data else None,
+        'status': user_data.status if user_data else None,
+        'target': user_data.target if user_data else None,
+        'district': user_data.district if user_data else None,
+        'profession': user_data.profession if user_data else None,
+        'about': user_data.about if user_data else None,
+        'interests': list(user_data.interests) if user_data else [],
     }
 
-    for option_name, category_name in user_options:
-        if category_name == 'gender':
-            result['gender'] = option_name
-        if category_name == 'status':
-            result['status'] = option_name
-        if category_name == 'target':
-            result['target'] = option_name
-        if category_name == 'district':
-            result['district'] = option_name
-        if category_name == 'interest':
-            if isinstance(result['interests'], list):
-                result['interests'].append(option_name)
-
-    return result
+
+def invalidate_user_cache(tg_id: int, session: Optional[AsyncSession] = None) -> None:
+    """Сбрасывает кэш профиля и фото пользователя
+
+    Если передана сессия, кэш сбрасывается ещё раз после её коммита, чтобы параллельное
+    чтение до коммита не оставило в кэше старые данные.
+    """
+    profile_cache.invalidate(tg_id)
+    photos_cache.invalidate(tg_id)
+
+    if session is not None:
+        after_commit(session, lambda: invalidate_user_cache(tg_id))
+
+
+def _option_by_category(category: str) -> Any:
+    return func.max(Option.name).filter(OptionCategory.name == category)
+
+
+async def sync_user_profile(
+    session: AsyncSession, *, user_id: Optional[int] = None, tg_id: Optional[int] = None
+) -> None:
+    """Пересчитывает проекцию профиля одним INSERT ... SELECT ... ON CONFLICT DO UPDATE"""
+    if user_id is None and tg_id is None:
+        raise ValueError('user_id or tg_id is required')
+
+    interests = func.array_agg(aggregate_order_by(Option.name, Option.id)).filter(OptionCategory.name == 'interest')
+    profile_query = (
+        select(
+            User.id,
+            User.tg_id,
+            User.first_name,
+            User.username,
+            User.year,
+            User.total_likes,
+            _option_by_category('gender'),
+            _option_by_category('status'),
+            _option_by_category('target'),
+            _option_by_category('district'),
+            User.profession,
+            User.about,
+            func.coalesce(interests, array([], type_=Text)),
+        )
+        .select_from(User)
+        .outerjoin(UserOption, UserOption.user_id == User.id)
+        .outerjoin(Option, UserOption.option_id == Option.id)
+        .outerjoin(OptionCategory, Option.category_id == OptionCategory.id)
+        .where(User.id == user_id if user_id is not None else User.tg_id == tg_id)
+        .group_by(User.id)
+    )
+
+    columns = [
+        'user_id',
+        'tg_id',
+        'first_name',
+        'username',
+        'year',
+        'total_likes',
+        'gender',
+        'status',
+        'target',
+        'district',
+        'profession',
+        'about',
+        'interests',
+    ]
+    stmt = pg_insert(UserProfile).from_select(columns, profile_query)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserProfile.user_id],
+        set_={column: stmt.excluded[column] for column in columns[1:]},
+    )
+    await session.execute(stmt)
+
+
+async def get_user_data(user_id: int) -> Optional[UserProfileData]:
+    """Профиль пользователя из кэша, при промахе из проекции user_profiles"""
+    user_data = profile_cache.lookup(user_id)
+    if user_data is MISSING:
+        user_data = await load_user_data(user_id)
+        profile_cache[user_id] = user_data
+    return user_data
+
+
+PROFILE_COLUMNS = (
+    UserProfile.tg_id,
+    UserProfile.first_name,
+    UserProfile.username,
+    UserProfile.year,
+    UserProfile.total_likes,
+    UserProfile.gender,
+    UserProfile.status,
+    UserProfile.target,
+    UserProfile.district,
+    UserProfile.profession,
+    UserProfile.about,
+    UserProfile.interests,
+)
+
+
+def _profile_from_row(row: Any) -> UserProfileData:
+    return UserProfileData(
+        tg_id=row.tg_id,
+        first_name=row.first_name,
+        username=row.username,
+        year=row.year,
+        total_likes=row.total_likes,
+        gender=row.gender,
+        status=row.status,
+        target=row.target,
+        district=row.district,
+        profession=row.profession,
+        about=row.about,
+        interests=tuple(row.interests or ()),
+    )
+
+
+@connect_db
+async def load_user_data(session: AsyncSession, user_id: int) -> Optional[UserProfileData]:
+    row = (await session.execute(select(*PROFILE_COLUMNS).where(UserProfile.tg_id == user_id))).first()
+    return _profile_from_row(row) if row is not None else None
+
+
+async def get_profile_cards(tg_ids: list[int]) -> dict[int, tuple[UserProfileData, tuple[str, ...]]]:
+    """Профили и фото нескольких пользователей: из кэшей, промахи одним запросом"""
+    cards: dict[int, tuple[UserProfileData, tuple[str, ...]]] = {}
+    missing: list[int] = []
+    for tg_id in tg_ids:
+        user_data = profile_cache.lookup(tg_id)
+        if user_data is None:
+            continue
+        photo_ids = photos_cache.lookup(tg_id) if user_data is not MISSING else MISSING
+        if photo_ids is MISSING:
+            missing.append(tg_id)
+        else:
+            cards[tg_id] = (user_data, photo_ids)
+
+    if missing:
+        loaded = await load_profile_cards(missing)
+        for tg_id in missing:
+            if tg_id in loaded:
+                cards[tg_id] = loaded[tg_id]
+                profile_cache[tg_id], photos_cache[tg_id] = loaded[tg_id]
+            else:
+                profile_cache[tg_id] = None
+    return cards
+
+
+@connect_db
+async def load_profile_cards(
+    session: AsyncSession, tg_ids: list[int]
+) -> dict[int, tuple[UserProfileData, tuple[str, ...]]]:
+    result = await session.execute(
+        select(*PROFILE_COLUMNS, PhotoProfile.profile_photo_ids)
+        .outerjoin(PhotoProfile, PhotoProfile.user_id == UserProfile.user_id)
+        .where(UserProfile.tg_id.in_(tg_ids))
+    )
+    return {row.tg_id: (_profile_from_row(row), tuple(row.profile_photo_ids or ())) for row in result}
@@ -1,27 +1,48 @@
 import logging
+import math
+import random
+import zlib
 
-from collections.abc import Sequence
+from dataclasses import asdict, dataclass
 from datetime import datetime
-from typing import Optional, Union
+from functools import partial
+from typing import Any, NamedTuple, Optional, Union
 
 import pytz
 
 from aiogram import Bot
-from aiogram.fsm.context import FSMContext
-from sqlalchemy import and_, delete, exists, func, or_, select, update
+from sqlalchemy import and_, delete, exists, func, literal, or_, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import aliased
 
+from src.bot.db.connection import after_commit
 from src.bot.db.models import FriendRequest, LikeProfile, Option, OptionCategory, PhotoProfile, User, UserOption
-from src.bot.db.repositories.user_data_utils import get_user_data
+from src.bot.db.repositories.candidate_pools import (
+    Candidate,
+    CandidateRow,
+    candidate_pools,
+    search_districts,
+)
+from src.bot.db.repositories.options_repository import option_catalog
+from src.bot.db.repositories.relation_graph import relation_graph
+from src.bot.db.repositories.user_data_utils import (
+    get_user_data,
+    invalidate_user_cache,
+    photos_cache,
+    sync_user_profile,
+)
+from src.bot.utils.cache import MISSING
 from src.bot.utils.decorators import connect_db
-from src.bot.utils.user_helpers import send_match_notification
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
 
+# Пространства advisory lock для пар пользователей: лайки и дружба блокируются независимо
+PAIR_LOCK_NAMESPACES = {'like': 1, 'friend': 2}
+
 
 @connect_db
 async def get_user(session: AsyncSession, tg_id: int) -> User | None:
@@ -49,36 +70,23 @@ async def user_data_exists(session: AsyncSession, tg_id: int) -> bool:
     return has_year
 
 
-@connect_db
-async def add_total_like(session: AsyncSession, to_tg_id: int) -> None:
-    user_exists = await session.scalar(select(exists().where(User.tg_id == to_tg_id)))
-    if not user_exists:
-        return
-
-    await session.execute(update(User).where(User.tg_id == to_tg_id).values(total_likes=User.total_likes + 1))
-    await session.commit()
-
-
-@connect_db
-async def delete_total_like(session: AsyncSession, to_tg_id: int) -> None:
-    user_exists = await session.scalar(select(exists().where(User.tg_id == to_tg_id)))
-    if not user_exists:
-        return
-
-    await session.execute(
-        update(User).where(User.tg_id == to_tg_id).values(total_likes=func.greatest(User.total_likes - 1, 0))
-    )
-    await session.commit()
-
-
 @connect_db
 async def get_user_by_username(session: AsyncSession, username: str) -> User | None:
     return await session.scalar(select(User).where(func.lower(User.username) == func.lower(username)))
 
 
+async def get_user_photos(tg_id: int) -> list[str] | None:
+    """Получает фото пользователя, сначала из кэша"""
+    photo_ids = photos_cache.lookup(tg_id)
+    if photo_ids is MISSING:
+        photo_ids = tuple(await load_user_photos(tg_id))
+        photos_cache[tg_id] = photo_ids
+    return list(photo_ids)
+
+
 @connect_db
-async def get_user_photos(session: AsyncSession, tg_id: int) -> list[str] | None:
-    """Получает фото пользователя"""
+async def load_user_photos(session: AsyncSession, tg_id: int) -> list[str]:
+    """Получает фото пользователя из БД"""
     photo_list = await session.scalar(
         select(PhotoProfile.profile_photo_ids).join(User, PhotoProfile.user_id == User.id).where(User.tg_id == tg_id)
     )
@@ -103,20 +111,23 @@ async def update_user_photos(session: AsyncSession, bot: Bot, tg_id: int) -> lis
 
         new_photo_ids = [photo[-1].file_id for photo in user_photos.photos]
 
-        user = await session.scalar(select(User).where(User.tg_id == tg_id))
-        if not user:
-            logger.warning(f'❗User {tg_id} not found in database')
-            return []
+        async with session.begin_nested():
+            user = await session.scalar(select(User).where(User.tg_id == tg_id))
+            if not user:
+                logger.warning(f'❗User {tg_id} not found in database')
+                return []
 
-        await session.execute(delete(PhotoProfile).where(PhotoProfile.user_id == user.id))
-        if new_photo_ids:
-            # Сохраняем в базу
-            session.add(
-                PhotoProfile(
-                    user_id=user.id,
-                    profile_photo_ids=new_photo_ids,
+            await session.execute(delete(PhotoProfile).where(PhotoProfile.user_id == user.id))
+            if new_photo_ids:
+                # Сохраняем в базу
+                session.add(
+                    PhotoProfile(
+                        user_id=user.id,
+                        profile_photo_ids=new_photo_ids,
+                    )
                 )
-            )
+            invalidate_user_cache(tg_id, session)
+
         await session.commit()
         logger.info(f'✅ User {tg_id} photos updated, len {len(new_photo_ids)}')
         return new_photo_ids
@@ -125,32 +136,40 @@ async def update_user_photos(session: AsyncSession, bot: Bot, tg_id: int) -> lis
         return []
 
 
-@connect_db
-async def update_only_interests(session: AsyncSession, tg_id: int, interests: list[str]) -> bool:
-    """Обновляет только интересы пользователя"""
-    try:
-        user = await session.scalar(select(User).where(User.tg_id == tg_id))
-        if not user:
-            logger.warning(f'User {tg_id} not found')
-            return False
+async def replace_user_options(
+    session: AsyncSession, user_id: int, categories: list[str], option_ids: list[int]
+) -> None:
+    """Заменяет выбор пользователя в категориях: один DELETE и один многострочный INSERT"""
+    await session.execute(
+        delete(UserOption).where(
+            UserOption.user_id == user_id,
+            UserOption.option_id.in_(select(Option.id).join(OptionCategory).where(OptionCategory.name.in_(categories))),
+        )
+    )
 
-        # Удаляем старые интересы
+    if option_ids:
         await session.execute(
-            delete(UserOption).where(
-                UserOption.user_id == user.id,
-                UserOption.option_id.in_(
-                    select(Option.id).join(OptionCategory).where(OptionCategory.name == 'interest')
-                ),
-            )
+            pg_insert(UserOption)
+            .values([{'user_id': user_id, 'option_id': option_id, 'selected': True} for option_id in option_ids])
+            .on_conflict_do_nothing(index_elements=[UserOption.user_id, UserOption.option_id])
         )
 
-        # Добавляем новые интересы
-        interest_options = await session.scalars(
-            select(Option).join(OptionCategory).where(OptionCategory.name == 'interest', Option.name.in_(interests))
-        )
 
-        for option in interest_options:
-            session.add(UserOption(user_id=user.id, option_id=option.id, selected=True))
+@connect_db
+async def update_only_interests(session: AsyncSession, tg_id: int, interests: list[str]) -> bool:
+    """Обновляет только интересы пользователя"""
+    try:
+        # SAVEPOINT: при ошибке откатываются только эти изменения, а не весь апдейт
+        async with session.begin_nested():
+            user = await session.scalar(select(User).where(User.tg_id == tg_id))
+            if not user:
+                logger.warning(f'User {tg_id} not found')
+                return False
+
+            interest_ids = await option_catalog.get_ids('interest', interests)
+            await replace_user_options(session, user.id, ['interest'], interest_ids)
+            await sync_user_profile(session, user_id=user.id)
+            invalidate_user_cache(tg_id, session)
 
         await session.commit()
         logger.info(f'Interests updated for user {tg_id}')
@@ -158,28 +177,14 @@ async def update_only_interests(session: AsyncSession, tg_id: int, interests: li
 
     except Exception as e:
         logger.error(f'Error updating interests: {e}')
-        await session.rollback()
         return False
 
 
-@connect_db
-async def find_compatible_users(
-    session: AsyncSession, tg_id: int, age_ranges: list[str], limit: int = 7, exclude_ids: list[int] | None = None
-) -> Sequence[User]:
-    """Находит совместимых пользователей с учетом цели (по возрасту и округу)"""
-    logger.info(f'Searching compatible users for tg_id: {tg_id}')
-
-    # Получаем данные текущего пользователя
-    current_user = await get_user(tg_id)
-    if not current_user:
-        return []
-
-    user_data = await get_user_data(tg_id)
-    if not user_data:
-        return []
-
-    # Базовые условия
-    conditions = [User.tg_id != tg_id]
+def compatible_users_conditions(
+    tg_id: int, age_ranges: list[str], district_option_ids: Optional[list[int]]
+) -> list[Any]:
+    """Условия поиска совместимых пользователей по возрасту и округу"""
+    conditions: list[Any] = [User.tg_id != tg_id]
 
     # 1. Фильтр по возрасту
     age_conditions = []
@@ -197,56 +202,113 @@ async def find_compatible_users(
     if age_conditions:
         conditions.append(or_(*age_conditions))
 
-    DISTRICT_GROUPS = {
-        'ЦАО': ['ЦАО', 'ЗАО', 'СЗАО', 'САО', 'СВАО', 'ВАО', 'ЮВАО', 'ЮАО', 'ЮЗАО'],
-        'ЗАО': ['ЗАО', 'СЗАО', 'ЮЗАО', 'ЦАО'],
-        'СЗАО': ['СЗАО', 'САО', 'ЗАО', 'ЦАО'],
-        'САО': ['САО', 'СЗАО', 'СВАО', 'ЦАО'],
-        'СВАО': ['СВАО', 'САО', 'ВАО', 'ЦАО'],
-        'ВАО': ['ВАО', 'СВАО', 'ЮВАО', 'ЦАО'],
-        'ЮВАО': ['ЮВАО', 'ВАО', 'ЮАО', 'ЦАО'],
-        'ЮАО': ['ЮАО', 'ЮВАО', 'ЮЗАО', 'ЦАО'],
-        'ЮЗАО': ['ЮЗАО', 'ЮАО', 'ЗАО', 'ЦАО'],
-    }
-
-    districts = DISTRICT_GROUPS.get(user_data['district'], [user_data['district']])
-    logger.info(f'User districts: {user_data["district"]},  searched districts: {districts}')
-
-    # 2. Фильтр по округу
-    if user_data.get('district'):
-        district_condition = exists().where(
-            and_(
+    # 2. Фильтр по округу: semi-join по индексу user_options(option_id, user_id) WHERE selected
+    if district_option_ids is not None:
+        conditions.append(
+            exists().where(
                 UserOption.user_id == User.id,
-                UserOption.option_id == Option.id,
-                Option.name.in_(districts),
-                OptionCategory.name == 'district',
                 UserOption.selected,
+                UserOption.option_id.in_(district_option_ids),
             )
         )
-        conditions.append(district_condition)
-
-    # Исключаем уже показанных пользователей
-    if exclude_ids:
-        conditions.append(User.tg_id.not_in(exclude_ids))
-
-    # Формируем запрос
-    query = (
-        select(User)
-        .where(and_(*conditions))
-        .options(
-            selectinload(User.photo_profile),
-            selectinload(User.options).joinedload(UserOption.option).joinedload(Option.category),
+
+    return conditions
+
+
+@dataclass(slots=True)
+class SearchCursor:
+    """Позиция выдачи поиска людей
+
+    Пользователи обходятся по (search_rank, id) начиная со случайной точки start и до конца,
+    затем с начала до start, так что каждый показывается за обход ровно один раз.
+    """
+
+    start: float
+    last_rank: Optional[float] = None
+    last_id: Optional[int] = None
+    wrapped: bool = False
+
+    @classmethod
+    def new(cls) -> 'SearchCursor':
+        return cls(start=random.random())
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict[str, Any]]) -> 'SearchCursor':
+        return cls(**data) if data else cls.new()
+
+    def to_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+@connect_db
+async def find_compatible_users(
+    session: AsyncSession, tg_id: int, age_ranges: list[str], limit: int = 7, cursor: Optional[SearchCursor] = None
+) -> tuple[list[int], SearchCursor]:
+    """Находит следующую порцию совместимых пользователей с учетом цели (по возрасту и округу)
+
+    Возвращает tg_id найденных пользователей и курсор для следующей страницы.
+    """
+    logger.info(f'Searching compatible users for tg_id: {tg_id}')
+    position = cursor or SearchCursor.new()
+
+    # Получаем данные текущего пользователя
+    user_data = await get_user_data(tg_id)
+    if not user_data:
+        return [], position
+
+    districts = search_districts(user_data.district) if user_data.district else None
+    logger.info(f'User districts: {user_data.district},  searched districts: {districts}')
+
+    if candidate_pools.can_answer(age_ranges):
+
+        async def fetch_page(wrapped: bool, count: int) -> list[Candidate]:
+            low, high = (0.0, position.start) if wrapped else (position.start, math.inf)
+            after = None
+            if position.last_rank is not None and position.last_id is not None:
+                after = (position.last_rank, position.last_id)
+            return candidate_pools.fetch(districts, age_ranges, low, high, after, count, exclude_tg_id=tg_id)
+
+    else:
+        # Пулы еще не построены или выбран нестандартный диапазон: ищем в БД
+        district_option_ids = await option_catalog.get_ids('district', districts) if districts else None
+        base_query = select(User.search_rank, User.id, User.tg_id).where(
+            and_(*compatible_users_conditions(tg_id, age_ranges, district_option_ids))
         )
-        .order_by(func.random())
-        .limit(limit)
-    )
+
+        async def fetch_page(wrapped: bool, count: int) -> list[Candidate]:
+            # Keyset по индексу (search_rank, id): без сортировки всей выборки и без списка показанных
+            page_conditions = [User.search_rank < position.start if wrapped else User.search_rank >= position.start]
+            if position.last_rank is not None and position.last_id is not None:
+                page_conditions.append(
+                    tuple_(User.search_rank, User.id) > tuple_(literal(position.last_rank), literal(position.last_id))
+                )
+            query = base_query.where(*page_conditions).order_by(User.search_rank, User.id).limit(count)
+            # Ошибка запроса откатывает только SAVEPOINT, транзакция апдейта остается рабочей
+            async with session.begin_nested():
+                return [Candidate(*row) for row in await session.execute(query)]
 
     try:
-        result = await session.scalars(query)
-        return result.unique().all()
+        rows: list[Candidate] = []
+        if not position.wrapped:
+            rows = await fetch_page(False, limit)
+            if len(rows) < limit:
+                # Дошли до конца рангов, продолжаем с начала до точки старта
+                position = SearchCursor(start=position.start, wrapped=True)
+        if position.wrapped:
+            rows += await fetch_page(True, limit - len(rows))
+
+        if rows:
+            last = rows[-1]
+            position = SearchCursor(
+                start=position.start,
+                last_rank=last.search_rank,
+                last_id=last.id,
+                wrapped=position.wrapped,
+            )
+        return [row.tg_id for row in rows], position
     except Exception as e:
         logger.error(f'Error finding compatible users: {e}')
-        return []
+        return [], position
 
 
 @connect_db
@@ -257,22 +319,26 @@ async def save_first_user(session: AsyncSession, tg_id: int, first_name: str, us
         local_timezone = pytz.timezone('Europe/Moscow')
         created_at_local = created_at_utc.astimezone(local_timezone)
 
-        user = await session.scalar(select(User).where(User.tg_id == tg_id))
-        if not user:
-            session.add(
-                User(
-                    tg_id=tg_id,
-                    first_name=first_name,
-                    username=username,
-                    date_create=created_at_local,
-                )
+        async with session.begin_nested():
+            user = await session.scalar(select(User).where(User.tg_id == tg_id))
+            if user:
+                logger.info(f'User {tg_id} already exists')
+                return True
+
+            new_user = User(
+                tg_id=tg_id,
+                first_name=first_name,
+                username=username,
+                date_create=created_at_local,
             )
-            await session.commit()
-            logger.info(f'User {tg_id} saved successfully')
-            return True
-        else:
-            logger.info(f'User {tg_id} already exists')
-            return True
+            session.add(new_user)
+            await session.flush()
+            await sync_user_profile(session, user_id=new_user.id)
+            invalidate_user_cache(tg_id, session)
+
+        await session.commit()
+        logger.info(f'User {tg_id} saved successfully')
+        return True
     except Exception as e:
         logger.error(f'Failed to save user {tg_id}: {e}', exc_info=True)
         return False
@@ -281,24 +347,27 @@ async def save_first_user(session: AsyncSession, tg_id: int, first_name: str, us
 @connect_db
 async def save_user_photos(session: AsyncSession, tg_id: int, photo_ids: list[str], max_photos: int = 10) -> None:
     try:
-        user = await session.scalar(select(User).where(User.tg_id == tg_id))
+        async with session.begin_nested():
+            user = await session.scalar(select(User).where(User.tg_id == tg_id))
 
-        if not user:
-            logger.error(f'User with tg_id {tg_id} not found')
-            return
+            if not user:
+                logger.error(f'User with tg_id {tg_id} not found')
+                return
 
-        if len(photo_ids) > max_photos:
-            photo_ids = photo_ids[:max_photos]
+            if len(photo_ids) > max_photos:
+                photo_ids = photo_ids[:max_photos]
 
-        logger.info(f'➡️ User {tg_id} tried to save {len(photo_ids)} photos, limiting to  {max_photos}')
-        await session.execute(delete(PhotoProfile).where(PhotoProfile.user_id == user.id))
+            logger.info(f'➡️ User {tg_id} tried to save {len(photo_ids)} photos, limiting to  {max_photos}')
+            await session.execute(delete(PhotoProfile).where(PhotoProfile.user_id == user.id))
 
-        session.add(
-            PhotoProfile(
-                user_id=user.id,
-                profile_photo_ids=photo_ids,
+            session.add(
+                PhotoProfile(
+                    user_id=user.id,
+                    profile_photo_ids=photo_ids,
+                )
             )
-        )
+            invalidate_user_cache(tg_id, session)
+
         await session.commit()
         logger.info(f'User {tg_id} photos saved')
     except Exception as e:
@@ -324,213 +393,74 @@ async def set_user_data_save(
         local_timezone = pytz.timezone('Europe/Moscow')
         created_at_local = created_at_utc.astimezone(local_timezone)
 
-        # Проверка существующего пользователя
-        user = await session.scalar(select(User).where(User.tg_id == tg_id))
-        if not user:
-            logger.error(f'User with tg_id {tg_id} not found')
-            raise ValueError(f'User with tg_id {tg_id} not found')
-
-        # Сохроняем tg_id до коммита
-        user_tg_id = user.tg_id
-
-        # Обновляем основную информацию о пользователе
-        await session.execute(
-            update(User)
-            .where(User.tg_id == tg_id)
-            .values(
-                year=year,
-                date_update=created_at_local,
-                profession=profession,
-                about=about,
-            )
-        )
-
-        # Находим ID гендера
-        gender_option = await session.scalar(
-            select(Option)
-            .join(OptionCategory)
-            .where(
-                OptionCategory.name == 'gender',
-                Option.name == gender,
-            )
-        )
-        if not gender_option:
-            logger.error(f'Gender {gender} not found in database')
-            raise ValueError(f'Gender {gender} not found')
-
-        # Находим ID статуса
-        status_option = await session.scalar(
-            select(Option)
-            .join(OptionCategory)
-            .where(
-                OptionCategory.name == 'status',
-                Option.name == status,
-            )
-        )
-        if not status_option:
-            logger.error(f'Status {status} not found in database')
-            raise ValueError(f'Status {status} not found')
-
-        # Находим ID цели
-        target_option = await session.scalar(
-            select(Option)
-            .join(OptionCategory)
-            .where(
-                OptionCategory.name == 'target',
-                Option.name == target,
-            )
-        )
-        if not target_option:
-            logger.error(f'Target {target} not found in database')
-            raise ValueError(f'Target {target} not found')
-
-        # Находиь ID округа
-        district_option = await session.scalar(
-            select(Option)
-            .join(OptionCategory)
-            .where(
-                OptionCategory.name == 'district',
-                Option.name == district,
-            )
-        )
-        if not district_option:
-            logger.error(f'District {district} not found in database')
-            raise ValueError(f'District {district} not found')
-
-        # Удаляем старый выбор пользователя (кроме интересов)
-        await session.execute(
-            delete(UserOption).where(
-                UserOption.user_id == user.id,
-                UserOption.option_id.in_(
-                    select(Option.id)
-                    .join(OptionCategory)
-                    .where(OptionCategory.name.in_(['gender', 'status', 'target', 'district']))
-                ),
-            )
-        )
-
-        # Добавляем новый выбор пользователя
-        session.add_all(
-            [
-                UserOption(
-                    user_id=user.id,
-                    option_id=gender_option.id,
-                    selected=True,
-                ),
-                UserOption(
-                    user_id=user.id,
-                    option_id=status_option.id,
-                    selected=True,
-                ),
-                UserOption(
-                    user_id=user.id,
-                    option_id=target_option.id,
-                    selected=True,
-                ),
-                UserOption(
-                    user_id=user.id,
-                    option_id=district_option.id,
-                    selected=True,
-                ),
-            ]
-        )
-
-        # Обрабатываем интересы
-        if interests:
-            await session.execute(
-                delete(UserOption).where(
-                    UserOption.user_id == user.id,
-                    UserOption.option_id.in_(
-                        select(Option.id).join(OptionCategory).where(OptionCategory.name == 'interest')
-                    ),
-                )
-            )
-            interests_options = await session.scalars(
-                select(Option).join(OptionCategory).where(OptionCategory.name == 'interest', Option.name.in_(interests))
-            )
-            logger.info(f'Added {interests_options} interests for user {user_tg_id}')
-
-            for interest in interests_options:
-                session.add(
-                    UserOption(
-                        user_id=user.id,
-                        option_id=interest.id,
-                        selected=True,
+        async with session.begin_nested():
+            # Находим ID опций в справочнике
+            option_ids: dict[str, int] = {}
+            for category, name in (('gender', gender), ('status', status), ('target', target), ('district', district)):
+                option_id = await option_catalog.get_id(category, name)
+                if option_id is None:
+                    logger.error(f'{category.capitalize()} {name} not found in database')
+                    raise ValueError(f'{category.capitalize()} {name} not found')
+                option_ids[category] = option_id
+
+            # Обновляем основную информацию и заодно проверяем существование пользователя
+            updated = (
+                await session.execute(
+                    update(User)
+                    .where(User.tg_id == tg_id)
+                    .values(
+                        year=year,
+                        date_update=created_at_local,
+                        profession=profession,
+                        about=about,
                     )
+                    .returning(User.id, User.search_rank)
                 )
+            ).first()
+            if updated is None:
+                logger.error(f'User with tg_id {tg_id} not found')
+                raise ValueError(f'User with tg_id {tg_id} not found')
+            user_id, search_rank = updated
+
+            # Заменяем выбор пользователя, интересы только если они переданы
+            categories = list(option_ids)
+            new_option_ids = list(option_ids.values())
+            if interests:
+                categories.append('interest')
+                new_option_ids.extend(await option_catalog.get_ids('interest', interests))
+
+            await replace_user_options(session, user_id, categories, new_option_ids)
+            await sync_user_profile(session, user_id=user_id)
+            invalidate_user_cache(tg_id, session)
+            candidate = CandidateRow(
+                id=user_id, tg_id=tg_id, search_rank=search_rank, year=int(year), district=district
+            )
+            after_commit(session, lambda: candidate_pools.update_user(candidate))
 
-            await session.commit()
-            logger.info(f'Successfully saved user data for user {user_tg_id}')
+        await session.commit()
+        logger.info(f'Successfully saved user data for user {tg_id}')
     except Exception as e:
-        await session.rollback()
         logger.error(f'Failed to save user data: {str(e)}', exc_info=True)
         raise
 
 
-@connect_db
-async def load_user_like_and_friend(session: AsyncSession, user_id: int, state: FSMContext) -> None:
-    """Загрузка пользователем своих лайков и друзей"""
-    try:
-        # Получаем пользователя из БД
-        user = await session.scalar(select(User).where(User.tg_id == user_id))
-        if not user:
-            logger.error(f'User {user_id} not found')
-            return
-
-        # Получаем все лайки пользователя
-        like_ids = await session.scalars(
-            select(User.tg_id)
-            .join(LikeProfile, User.id == LikeProfile.to_user_id)
-            .where(LikeProfile.from_user_id == user.id)
-        )
+class LikeResult(NamedTuple):
+    created: bool  # Связь добавлена этим вызовом, а не существовала раньше
+    reciprocated: bool  # Есть встречная связь
 
-        # Получаем все запросы в друзья
-        friend_ids = await session.scalars(
-            select(User.tg_id)
-            .join(FriendRequest, User.id == FriendRequest.to_user_id)
-            .where(FriendRequest.from_user_id == user.id)
-        )
 
-        # Получаем взаимные лайки
-        reciprocated_like_ids = await session.scalars(
-            select(User.tg_id)
-            .join(LikeProfile, User.id == LikeProfile.from_user_id)
-            .where(
-                LikeProfile.to_user_id == user.id,
-                LikeProfile.is_reciprocated,
-            )
-        )
+def _pair_lock_key(first_tg_id: int, second_tg_id: int) -> int:
+    """Ключ advisory lock для пары пользователей, одинаковый в обе стороны и во всех процессах"""
+    low, high = sorted((first_tg_id, second_tg_id))
+    key = zlib.crc32(f'{low}:{high}'.encode())
+    return key - 2**32 if key >= 2**31 else key
 
-        # Получаем взаимные запросы в друзья
-        reciprocated_friend_ids = await session.scalars(
-            select(User.tg_id)
-            .join(FriendRequest, User.id == FriendRequest.from_user_id)
-            .where(
-                FriendRequest.to_user_id == user.id,
-                FriendRequest.is_reciprocated,
-            )
-        )
-
-        reciprocated_ids = set(reciprocated_like_ids) | set(reciprocated_friend_ids)
-
-        # Обновляем состояние
-        await state.update_data(
-            {
-                'liked_profile_ids': list(like_ids),
-                'friend_profile_ids': list(friend_ids),
-                'reciprocated_profile_ids': list(reciprocated_ids),
-            }
-        )
-
-        logger.info(
-            f'Loaded likes and friends for user {user_id}: '
-            f'likes={list(like_ids)}, friends={list(friend_ids)}, '
-            f'reciprocated={list(reciprocated_ids)}'
-        )
 
-    except Exception as e:
-        logger.error(f'Error loading likes and friends: {e}')
-        raise
+async def _lock_pair(session: AsyncSession, first_tg_id: int, second_tg_id: int, action_type: str) -> None:
+    """Блокирует пару пользователей до конца транзакции: добавление и удаление связей пары идут по очереди"""
+    await session.execute(
+        select(func.pg_advisory_xact_lock(PAIR_LOCK_NAMESPACES[action_type], _pair_lock_key(first_tg_id, second_tg_id)))
+    )
 
 
 @connect_db
@@ -539,112 +469,79 @@ async def add_like_and_friend_to_db(
     from_tg_id: int,
     to_tg_id: int,
     action_type: str,
-    state: FSMContext,
-    bot: Bot,
-) -> None:
-    """Добавление лайка и дружбы в БД, проверка существования пользователей"""
+) -> LikeResult:
+    """Добавление лайка или дружбы одним запросом
 
-    try:
-        # Проверяем существование пользователей
-        from_user_exists = await session.scalar(select(exists().where(User.tg_id == from_tg_id)))
-        to_user_exists = await session.scalar(select(exists().where(User.tg_id == to_tg_id)))
-
-        if not from_user_exists or not to_user_exists:
-            logger.info(f'*** Пользователи с tg_id  {from_tg_id} и {to_tg_id} не существуют в базе данных')
-            return
-
-        # Получаем id пользователей
-        from_user_id = await session.scalar(select(User.id).where(User.tg_id == from_tg_id))
-        to_user_id = await session.scalar(select(User.id).where(User.tg_id == to_tg_id))
-        logger.info(
-            f'*** Пользователи с id  {from_tg_id}-{from_user_id} и {to_tg_id}-{to_user_id} получают существующие id'
-        )
+    CTE находит id пользователей, вставляет связь через ON CONFLICT DO NOTHING и только при вставке
+    увеличивает total_likes и отмечает взаимность у встречной связи. Advisory lock на пару
+    пользователей не дает двум встречным лайкам разминуться и оба остаться невзаимными.
+    """
+    model: Union[type[LikeProfile], type[FriendRequest]]
 
-        model: Union[type[LikeProfile], type[FriendRequest]]
+    # Определяем модель
+    if action_type == 'like':
+        model = LikeProfile
+    elif action_type == 'friend':
+        model = FriendRequest
+    else:
+        raise ValueError(f'Unknown action type: {action_type}')
 
-        # Определяем модель
-        if action_type == 'like':
-            model = LikeProfile
-        elif action_type == 'friend':
-            model = FriendRequest
-        else:
-            raise ValueError(f'Unknown action type: {action_type}')
+    await _lock_pair(session, from_tg_id, to_tg_id, action_type)
 
-        # Проверяем существование связи
-        exist = await session.scalar(
-            select(
-                exists().where(
-                    model.from_user_id == from_user_id,
-                    model.to_user_id == to_user_id,
-                )
-            )
+    from_user = aliased(User)
+    to_user = aliased(User)
+    ids = (
+        select(from_user.id.label('from_id'), to_user.id.label('to_id'))
+        .where(from_user.tg_id == from_tg_id, to_user.tg_id == to_tg_id)
+        .cte('ids')
+    )
+    reverse = (
+        select(model.id)
+        .join(ids, and_(model.from_user_id == ids.c.to_id, model.to_user_id == ids.c.from_id))
+        .cte('reverse_edge')
+    )
+    inserted = (
+        pg_insert(model)
+        .from_select(
+            ['from_user_id', 'to_user_id', 'date_create', 'is_reciprocated'],
+            select(ids.c.from_id, ids.c.to_id, func.now(), exists(select(reverse.c.id))),
         )
-
-        if not exist:
-            session.add(
-                model(
-                    from_user_id=from_user_id,
-                    to_user_id=to_user_id,
-                    date_create=datetime.now(),
-                )
-            )
-            await session.commit()
-
-        # Проверяем взамность лайков
-        is_reciprocal = await session.scalar(
+        .on_conflict_do_nothing(index_elements=['from_user_id', 'to_user_id'])
+        .returning(model.id)
+        .cte('inserted')
+    )
+    marked = (
+        update(model)
+        .where(model.id.in_(select(reverse.c.id)), exists(select(inserted.c.id)))
+        .values(is_reciprocated=True)
+        .returning(model.id)
+        .cte('marked')
+    )
+    bumped = (
+        update(User)
+        .where(User.id.in_(select(ids.c.to_id)), exists(select(inserted.c.id)))
+        .values(total_likes=User.total_likes + 1)
+        .returning(User.id)
+        .cte('bumped')
+    )
+    row = (
+        await session.execute(
             select(
-                exists().where(
-                    model.from_user_id == to_user_id,
-                    model.to_user_id == from_user_id,
-                )
-            )
+                exists(select(inserted.c.id)).label('created'),
+                exists(select(reverse.c.id)).label('reciprocated'),
+            ).add_cte(marked, bumped)
         )
+    ).one()
+    result = LikeResult(created=bool(row.created), reciprocated=bool(row.reciprocated))
 
-        # Устанавливаем взамность True
-        if is_reciprocal:
-            data = await state.get_data()
-            reciprocated_ids = data.get('reciprocated_profile_ids', [])
-            if from_tg_id not in reciprocated_ids:
-                reciprocated_ids.append(from_tg_id)
-            if to_tg_id not in reciprocated_ids:
-                reciprocated_ids.append(to_tg_id)
-            await state.update_data({'reciprocated_profile_ids': reciprocated_ids})
-            await session.execute(
-                update(model)
-                .where(model.from_user_id == to_user_id)
-                .where(model.to_user_id == from_user_id)
-                .values(is_reciprocated=True)
-            )
-            await session.execute(
-                update(model)
-                .where(model.from_user_id == from_user_id)
-                .where(model.to_user_id == to_user_id)
-                .values(is_reciprocated=True)
-            )
-            await session.commit()
-
-            # Получаем цель
-            target = 'like' if action_type == 'like' else 'friend'
-
-            # Отправляем уведомления обоим пользователям
-            if bot:
-                try:
-                    await send_match_notification(bot, from_tg_id, to_tg_id, state, target)
-                    await send_match_notification(bot, to_tg_id, from_tg_id, state, target)
-                except Exception as e:
-                    logger.error(f'*** Ошибка в send_match_notification: {e}', exc_info=True)
-
-    except Exception as e:
-        logger.error(f'*** Ошибка в add_like_and_friend_to_db: {e}', exc_info=True)
-        await session.rollback()
-    finally:
-        data = await state.get_data()
-        liked_ids = data.get('liked_profile_ids', [])
-        logger.info(f'*** liked_ids: {liked_ids}')
+    if result.created:
+        await sync_user_profile(session, tg_id=to_tg_id)
+        invalidate_user_cache(to_tg_id, session)
+        after_commit(session, partial(relation_graph.add_edge, from_tg_id, to_tg_id, action_type, result.reciprocated))
+    await session.commit()
 
-        if to_tg_id not in liked_ids:
-            liked_ids.append(to_tg_id)
-            await state.update_data({'liked_profile_ids': liked_ids})
+    logger.info(f'{action_type} {from_tg_id} -> {to_tg_id}: {result}')
+    return result
 
 
 @connect_db
@@ -653,24 +550,13 @@ async def delete_like_and_friend_from_db(
     from_tg_id: int,
     to_tg_id: int,
     action_type: str,
-) -> None:
-    """Удаление лайка и дружбы из БД, проверка перед удалением"""
-
-    # Проверяем существование пользователей
-    from_user_exists = await session.scalar(select(exists().where(User.tg_id == from_tg_id)))
-    to_user_exists = await session.scalar(select(exists().where(User.tg_id == to_tg_id)))
-
-    if not from_user_exists or not to_user_exists:
-        logger.info(f'*** Пользователи с tg_id  {from_tg_id} и {to_tg_id} не существуют в базе данных')
-        return
-
-    # Получаем id пользователей
-    from_user_id = await session.scalar(select(User.id).where(User.tg_id == from_tg_id))
-    to_user_id = await session.scalar(select(User.id).where(User.tg_id == to_tg_id))
-    logger.info(
-        f'*** Пользователи с id  {from_tg_id}-{from_user_id} и {to_tg_id}-{to_user_id} получают существующие id'
-    )
+) -> bool:
+    """Удаление лайка или дружбы одним запросом
 
+    total_likes уменьшается, только если связь была; у встречной связи снимается отметка взаимности.
+    Берется та же блокировка пары, что и при добавлении, иначе встречный лайк, пришедший одновременно
+    с удалением, отмечает взаимность уже удаленной связи.
+    """
     model: Union[type[LikeProfile], type[FriendRequest]]
 
     if action_type == 'like':
@@ -680,25 +566,47 @@ async def delete_like_and_friend_from_db(
     else:
         raise ValueError(f'Unknown action type: {action_type}')
 
-    await session.execute(
-        delete(model).where(
-            model.from_user_id == from_user_id,
-            model.to_user_id == to_user_id,
+    await _lock_pair(session, from_tg_id, to_tg_id, action_type)
+
+    from_user_id = select(User.id).where(User.tg_id == from_tg_id).scalar_subquery()
+    to_user_id = select(User.id).where(User.tg_id == to_tg_id).scalar_subquery()
+    deleted = (
+        delete(model)
+        .where(model.from_user_id == from_user_id, model.to_user_id == to_user_id)
+        .returning(model.to_user_id)
+        .cte('deleted')
+    )
+    decremented = (
+        update(User)
+        .where(User.id.in_(select(deleted.c.to_user_id)))
+        .values(total_likes=func.greatest(User.total_likes - 1, 0))
+        .returning(User.id)
+        .cte('decremented')
+    )
+    # Встречная связь остается, но взаимности больше нет
+    unmarked = (
+        update(model)
+        .where(
+            model.from_user_id == to_user_id,
+            model.to_user_id == from_user_id,
+            exists(select(deleted.c.to_user_id)),
         )
+        .values(is_reciprocated=False)
+        .returning(model.id)
+        .cte('unmarked')
     )
+    removed = bool(await session.scalar(select(exists(select(deleted.c.to_user_id))).add_cte(decremented, unmarked)))
+
+    if removed:
+        await sync_user_profile(session, tg_id=to_tg_id)
+        invalidate_user_cache(to_tg_id, session)
+        after_commit(session, partial(relation_graph.remove_edge, from_tg_id, to_tg_id, action_type))
     await session.commit()
 
+    logger.info(f'{action_type} {from_tg_id} -> {to_tg_id} removed: {removed}')
+    return removed
 
-@connect_db
-async def check_reciprocity(session: AsyncSession, from_tg_id: int, to_tg_id: int) -> bool | None:
-    # Сначала находим пользователей по tg_id
-    from_user = await session.scalar(select(User).where(User.tg_id == from_tg_id))
-    to_user = await session.scalar(select(User).where(User.tg_id == to_tg_id))
 
-    if not from_user or not to_user:
-        return False
-
-    # Теперь сравниваем их внутренние ID
-    return await session.scalar(
-        select(exists().where(LikeProfile.from_user_id == from_user.id, LikeProfile.to_user_id == to_user.id))
-    )
+async def check_reciprocity(from_tg_id: int, to_tg_id: int) -> bool:
+    """Поставил ли from_tg_id лайк to_tg_id; ответ из графа связей"""
+    return await relation_graph.has_edge(from_tg_id, to_tg_id, 'like')
@@ -0,0 +1,72 @@
+import asyncio
+import logging
+
+from typing import Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from src.bot.config import BotConfig
+from src.bot.db.repositories.candidate_pools import candidate_pools
+from src.bot.db.repositories.options_repository import option_catalog
+from src.bot.fsm.storage import create_fsm_storage
+from src.bot.handlers.admin import router_admin
+from src.bot.handlers.user import router_user
+from src.bot.middlewares import (
+    ROUTING_PROFILE,
+    DbSessionMiddleware,
+    DeliveryHealthMiddleware,
+    ReleaseDbSessionRequestMiddleware,
+    RoutingProfileMiddleware,
+    StateProxyMiddleware,
+    instrument_router,
+)
+from src.bot.utils.delivery_health import delivery_health
+from src.bot.utils.mailing_jobs import mailing_jobs
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def create_bot(config: BotConfig) -> Bot:
+    """Бот с официальным Bot API или с сервером из TELEGRAM_API_URL"""
+    session = AiohttpSession(api=TelegramAPIServer.from_base(config.api_url)) if config.api_url else AiohttpSession()
+    # Соединение с БД не держится открытым, пока хендлер ждет Telegram
+    session.middleware(ReleaseDbSessionRequestMiddleware())
+    return Bot(token=config.token, session=session)
+
+
+def create_dispatcher() -> Dispatcher:
+    """Диспетчер с хранилищем FSM, middleware и роутерами; один на процесс"""
+    dp = Dispatcher(storage=create_fsm_storage())
+    if ROUTING_PROFILE:
+        dp.update.outer_middleware(RoutingProfileMiddleware())
+    dp.update.outer_middleware(DbSessionMiddleware())
+    dp.update.outer_middleware(StateProxyMiddleware())
+    dp.update.outer_middleware(DeliveryHealthMiddleware())
+    dp.include_router(router_admin)
+    dp.include_router(router_user)
+    if ROUTING_PROFILE:
+        instrument_router(router_admin)
+        instrument_router(router_user)
+    return dp
+
+
+async def start_background(bot: Optional[Bot] = None) -> list[asyncio.Task]:
+    """Прогревает справочники процесса и запускает фоновые задачи
+
+    С bot продолжает незавершенные рассылки: это должен делать только один процесс.
+    """
+    await option_catalog.refresh()
+    await delivery_health.refresh()
+    if bot is not None:
+        await mailing_jobs.resume_all(bot)
+    # Пулы кандидатов для поиска людей строятся и обновляются в фоне
+    return [asyncio.create_task(candidate_pools.run()), asyncio.create_task(delivery_health.run())]
+
+
+def stop_background(tasks: list[asyncio.Task]) -> None:
+    for task in tasks:
+        task.cancel()
@@ -9,7 +9,7 @@ class MassSendMessage(StatesGroup):
     message_text = State()  # str
     media_upload = State()  # list[dict]
     preview = State()  # bool - состояние предппросмотра
-    selected_users = State()  # list[int]
+    mailing_filter = State()  # dict - MailingFilter.to_dict()
     is_full_mailing = State()  # bool
 
 
@@ -0,0 +1,291 @@
+import inspect
+import logging
+import os
+import time
+
+from typing import Any, Optional, Protocol
+
+import msgpack
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FSM_STATE_TTL = int(os.environ.get('FSM_STATE_TTL', 7 * 24 * 3600))
+# Как часто InMemoryKeyValue удаляет истекшие ключи, к которым больше не обращаются
+FSM_SWEEP_INTERVAL = int(os.environ.get('FSM_SWEEP_INTERVAL', 60))
+
+
+class KeyValueClient(Protocol):
+    """Подмножество API redis.asyncio.Redis, которое использует хранилище"""
+
+    def pipeline(self, transaction: bool = True) -> Any: ...
+
+    async def get(self, name: str) -> Any: ...
+
+    async def hgetall(self, name: str) -> Any: ...
+
+    async def aclose(self) -> None: ...
+
+
+class InMemoryPipeline:
+    """Пайплайн InMemoryKeyValue: команды копятся и выполняются разом в execute()"""
+
+    def __init__(self, client: 'InMemoryKeyValue') -> None:
+        self._client = client
+        self._commands: list[tuple[str, tuple[Any, ...], dict[str, Any]]] = []
+
+    def __getattr__(self, name: str) -> Any:
+        def queue(*args: Any, **kwargs: Any) -> 'InMemoryPipeline':
+            self._commands.append((name, args, kwargs))
+            return self
+
+        return queue
+
+    async def execute(self) -> list[Any]:
+        commands, self._commands = self._commands, []
+        results = []
+        for name, args, kwargs in commands:
+            result = getattr(self._client, name)(*args, **kwargs)
+            # Асинхронные команды клиента не переключают задачи, пайплайн остается атомарным
+            results.append(await result if inspect.isawaitable(result) else result)
+        return results
+
+    async def __aenter__(self) -> 'InMemoryPipeline':
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        self._commands = []
+
+
+class InMemoryKeyValue:
+    """Заменитель Redis в памяти процесса: строки и хэши с TTL
+
+    Используется, когда FSM_REDIS_URL не задан, и для проверки хранилища без сервера.
+    Команды не переключают задачи, поэтому пайплайн выполняется атомарно, как MULTI/EXEC.
+    Истекший ключ удаляется при чтении, а ключи, которые больше не читают, - проходом по сроку
+    не чаще раза в sweep_interval секунд при записи.
+    """
+
+    def __init__(self, sweep_interval: float = FSM_SWEEP_INTERVAL) -> None:
+        self._values: dict[str, Any] = {}
+        self._expires: dict[str, float] = {}
+        self.sweep_interval = sweep_interval
+        self._next_sweep = time.monotonic() + sweep_interval
+
+    def _alive(self, name: str) -> bool:
+        expires_at = self._expires.get(name)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._values.pop(name, None)
+            self._expires.pop(name, None)
+        return name in self._values
+
+    def _sweep(self) -> None:
+        now = time.monotonic()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.sweep_interval
+        expired = [name for name, expires_at in self._expires.items() if expires_at <= now]
+        for name in expired:
+            self._values.pop(name, None)
+            del self._expires[name]
+        if expired:
+            logger.info(f'FSM storage: swept {len(expired)} expired keys')
+
+    def pipeline(self, transaction: bool = True) -> InMemoryPipeline:
+        return InMemoryPipeline(self)
+
+    # Команды записи используются только через пайплайн
+    def set(self, name: str, value: bytes, ex: Optional[int] = None) -> bool:
+        self._sweep()
+        self._values[name] = value
+        self._expires.pop(name, None)
+        if ex:
+            self._expires[name] = time.monotonic() + ex
+        return True
+
+    def hset(self, name: str, mapping: dict[str, bytes]) -> int:
+        self._sweep()
+        if not self._alive(name):
+            self._values[name] = {}
+        hash_value = self._values[name]
+        added = len(mapping.keys() - hash_value.keys())
+        hash_value.update(mapping)
+        return added
+
+    def hdel(self, name: str, *keys: str) -> int:
+        if not self._alive(name):
+            return 0
+        hash_value = self._values[name]
+        return sum(hash_value.pop(key, None) is not None for key in keys)
+
+    def delete(self, *names: str) -> int:
+        deleted = 0
+        for name in names:
+            if self._alive(name):
+                del self._values[name]
+                self._expires.pop(name, None)
+                deleted += 1
+        return deleted
+
+    def expire(self, name: str, seconds: int) -> bool:
+        if not self._alive(name):
+            return False
+        self._expires[name] = time.monotonic() + seconds
+        return True
+
+    async def get(self, name: str) -> Optional[bytes]:
+        return self._values[name] if self._alive(name) else None
+
+    async def hgetall(self, name: str) -> dict[str, bytes]:
+        return dict(self._values[name]) if self._alive(name) else {}
+
+    async def aclose(self) -> None:
+        self._values.clear()
+        self._expires.clear()
+
+
+def _pack(value: Any) -> bytes:
+    return msgpack.packb(value, use_bin_type=True)
+
+
+def _unpack(value: bytes) -> Any:
+    return msgpack.unpackb(value, raw=False)
+
+
+def _field(name: Any) -> str:
+    return name.decode() if isinstance(name, bytes) else name
+
+
+class KeyValueStorage(BaseStorage):
+    """FSM-хранилище поверх Redis-совместимого клиента
+
+    Состояние хранится строкой, данные - хэшем с полем на каждый ключ, значения сериализуются msgpack.
+    Каждая операция - один пайплайн, то есть один запрос к серверу. Ключи живут ttl секунд
+    с последней записи, так что состояние неактивных пользователей удаляется само.
+    """
+
+    def __init__(
+        self, client: KeyValueClient, ttl: Optional[int] = FSM_STATE_TTL, key_builder: Optional[KeyBuilder] = None
+    ) -> None:
+        self.client = client
+        self.ttl = ttl
+        self.key_builder = key_builder or DefaultKeyBuilder(prefix='fsm')
+
+    def _keys(self, key: StorageKey) -> tuple[str, str]:
+        return self.key_builder.build(key, 'state'), self.key_builder.build(key, 'data')
+
+    def _touch(self, pipe: Any, *names: str) -> None:
+        if self.ttl:
+            for name in names:
+                pipe.expire(name, self.ttl)
+
+    @staticmethod
+    def _decode_data(raw: dict[Any, bytes]) -> dict[str, Any]:
+        return {_field(name): _unpack(value) for name, value in raw.items()}
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state_key, data_key = self._keys(key)
+        value = state.state if isinstance(state, State) else state
+
+        async with self.client.pipeline(transaction=True) as pipe:
+            if value is None:
+                pipe.delete(state_key)
+            else:
+                pipe.set(state_key, value.encode(), ex=self.ttl or None)
+            self._touch(pipe, data_key)
+            await pipe.execute()
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state_key, _ = self._keys(key)
+        value = await self.client.get(state_key)
+        return _field(value) if value is not None else None
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        state_key, data_key = self._keys(key)
+
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.delete(data_key)
+            if data:
+                pipe.hset(data_key, mapping={name: _pack(value) for name, value in data.items()})
+            self._touch(pipe, state_key, data_key)
+            await pipe.execute()
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, data_key = self._keys(key)
+        return self._decode_data(await self.client.hgetall(data_key))
+
+    async def update_data(self, key: StorageKey, data: dict[str, Any]) -> dict[str, Any]:
+        """Записывает только переданные поля и возвращает новые данные за один запрос"""
+        return await self.update_fields(key, data)
+
+    async def update_fields(
+        self, key: StorageKey, changed: dict[str, Any], removed: Optional[list[str]] = None
+    ) -> dict[str, Any]:
+        """Меняет и удаляет отдельные поля данных, возвращает данные после изменения"""
+        state_key, data_key = self._keys(key)
+
+        async with self.client.pipeline(transaction=True) as pipe:
+            if changed:
+                pipe.hset(data_key, mapping={name: _pack(value) for name, value in changed.items()})
+            if removed:
+                pipe.hdel(data_key, *removed)
+            self._touch(pipe, state_key, data_key)
+            pipe.hgetall(data_key)
+            result = await pipe.execute()
+
+        return self._decode_data(result[-1])
+
+    async def apply_changes(
+        self,
+        key: StorageKey,
+        changed: dict[str, Any],
+        removed: Optional[list[str]] = None,
+        *,
+        replace: bool = False,
+        update_state: bool = False,
+        state: StateType = None,
+    ) -> None:
+        """Записывает накопленные изменения состояния и данных одним запросом
+
+        replace=True заменяет данные целиком на changed, иначе меняются только переданные поля.
+        """
+        state_key, data_key = self._keys(key)
+        value = state.state if isinstance(state, State) else state
+
+        async with self.client.pipeline(transaction=True) as pipe:
+            if update_state:
+                if value is None:
+                    pipe.delete(state_key)
+                else:
+                    pipe.set(state_key, value.encode(), ex=self.ttl or None)
+            if replace:
+                pipe.delete(data_key)
+            if changed:
+                pipe.hset(data_key, mapping={name: _pack(item) for name, item in changed.items()})
+            if removed and not replace:
+                pipe.hdel(data_key, *removed)
+            self._touch(pipe, state_key, data_key)
+            await pipe.execute()
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+def create_fsm_storage() -> KeyValueStorage:
+    """Redis при заданном FSM_REDIS_URL, иначе хранилище в памяти процесса"""
+    redis_url = os.environ.get('FSM_REDIS_URL')
+    if not redis_url:
+        logger.info('FSM storage: in-process key-value store')
+        return KeyValueStorage(InMemoryKeyValue())
+
+    try:
+        from redis.asyncio import Redis
+    except ImportError as e:
+        raise RuntimeError('FSM_REDIS_URL is set but the redis package is not installed') from e
+
+    logger.info('FSM storage: redis')
+    return KeyValueStorage(Redis.from_url(redis_url))
@@ -10,14 +10,13 @@ class UserData(StatesGroup):
     profession = State()  # str
     about = State()  # str
     interests = State()  # list[str]
-    shown_events = State()  # str
     edit_mode = State()  # str
     total_likes = State()  # int
 
 
 class PeopleSearch(StatesGroup):
     age_range = State()  # list[str]
-    shown_people_ids = State()  # list[int]
+    browsing = State()  # dict, курсор выдачи people_cursor
     waiting_for_username = State()  # str
 
 
@@ -1,12 +1,17 @@
 from aiogram import Router
 
+from src.bot.utils.admin_helpers import AdminFilter
+
 from .callbacks import router_admin as callback_router
 
 # from .commands import router_admin as command_router
 from .messages import router_admin as message_router
 
 
-router_admin = Router()
+router_admin = Router(name='admin')
+# Апдейты не-администраторов отсекаются здесь проверкой по кэшу, до фильтров хендлеров
+router_admin.message.filter(AdminFilter())
+router_admin.callback_query.filter(AdminFilter())
 router_admin.include_router(callback_router)
 # router_admin.include_router(command_router)
 router_admin.include_router(message_router)
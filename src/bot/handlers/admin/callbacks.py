@@ -1,46 +1,36 @@
 import asyncio
 import logging
 
-from typing import Any, Union
+from typing import Any
 
 from aiogram import Bot, F, Router
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
-from aiogram.types import (
-    CallbackQuery,
-    InputMediaAudio,
-    InputMediaDocument,
-    InputMediaPhoto,
-    InputMediaVideo,
-    Message,
-)
+from aiogram.types import CallbackQuery, Message
 
 import src.bot.db.repositories.admin_repository as req_admin
+import src.bot.db.repositories.mailing_repository as req_mailing
 import src.bot.db.repositories.support_repository as req_support
 import src.bot.keyboards.builders as kb
 
-from src.bot.db.repositories.admin_repository import is_admin
+from src.bot.db.repositories.admin_repository import MailingFilter
 from src.bot.fsm.admin_states import AdminChatState, MassSendMessage
 from src.bot.utils.admin_helpers import (
-    process_mailing_with_report,
+    format_bot_stats,
     process_single_media,
     selection_message_handler,
     validate_callback,
     validate_content,
 )
+from src.bot.utils.mailing import JobStatus
+from src.bot.utils.mailing_jobs import mailing_jobs
+from src.bot.utils.mailing_payload import MailingPayload
 
 
-InputMediaType = Union[
-    InputMediaPhoto,
-    InputMediaVideo,
-    InputMediaAudio,
-    InputMediaDocument,
-]
-
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-router_admin = Router()
+router_admin = Router(name='admin_callbacks')
 
 media_groups: dict[str, dict[str, Any]] = {}
 
@@ -52,10 +42,6 @@ async def handle_admin_chat(callback: CallbackQuery, state: FSMContext) -> None:
         await callback.answer('❌ Ошибка: данные не получены')
         return
 
-    if not await is_admin(callback.from_user.id):
-        await callback.answer('❌ Недостаточно прав!', show_alert=True)
-        return
-
     ticket_id = int(callback.data.split('_')[2])
     logger.info(f'➡️ User {callback.from_user.id} wants to see ticket {ticket_id}')
 
@@ -105,11 +91,6 @@ async def admin_reply_to_user(callback: CallbackQuery, state: FSMContext) -> Non
         await callback.answer('❌ При обработке данных произошла ошибка. Попробуйте ещё раз!')
         return
 
-    if not await is_admin(callback.from_user.id):
-        logger.info(f'❗️User {callback.from_user.id} is not admin')
-        await callback.answer('❌ Недостаточно прав!', show_alert=True)
-        return
-
     ticket_id = int(callback.data.split('_')[2])
     logger.info(f'➡️ Admin {callback.from_user.id} prepration send a message to {ticket_id}')
 
@@ -160,10 +141,6 @@ async def show_active_tickets(callback: CallbackQuery) -> None:
         await callback.answer('❌ При обработке данных произошла ошибка. Попробуйте ещё раз!')
         return
 
-    if not await is_admin(callback.from_user.id):
-        await callback.answer('❌ Недостаточно прав!', show_alert=True)
-        return
-
     tickets = await req_support.get_active_tickets()
     logger.info(f'➡️ User {callback.from_user.id} wants to see active tickets: {tickets}')
 
@@ -194,10 +171,6 @@ async def close_ticket_handler(callback: CallbackQuery) -> None:
         await callback.answer('❌ Ошибка: данные не получены')
         return
 
-    if not await is_admin(callback.from_user.id):
-        await callback.answer('❌ Недостаточно прав!', show_alert=True)
-        return
-
     ticket_id = int(callback.data.split('_')[2])
 
     try:
@@ -209,6 +182,17 @@ async def close_ticket_handler(callback: CallbackQuery) -> None:
         await callback.answer('❌ Не удалось закрыть тикет')
 
 
+@router_admin.callback_query(F.data == 'bot_stats')
+async def show_bot_stats(callback: CallbackQuery) -> None:
+    """Показать статистику пула соединений"""
+    if not callback.from_user or not isinstance(callback.message, Message):
+        await callback.answer('❌ При обработке данных произошла ошибка. Попробуйте ещё раз!')
+        return
+
+    await callback.message.answer(format_bot_stats(), parse_mode='html')
+    await callback.answer()
+
+
 @router_admin.callback_query(F.data == 'mass_send')
 async def age_selection_question(callback: CallbackQuery, state: FSMContext) -> None:
     """Начало массовой рассылки и выбор возраста"""
@@ -216,10 +200,6 @@ async def age_selection_question(callback: CallbackQuery, state: FSMContext) ->
         await callback.answer('❌ При обработке данных произошла ошибка. Попробуйте ещё раз!')
         return
 
-    if not await is_admin(callback.from_user.id):
-        await callback.answer('❌ Недостаточно прав!', show_alert=True)
-        return
-
     await state.update_data(is_full_mailing=False)
     await state.set_state(MassSendMessage.age_users)
     try:
@@ -237,10 +217,6 @@ async def age_selection_question(callback: CallbackQuery, state: FSMContext) ->
 @router_admin.callback_query(F.data.startswith('select_age'))
 async def age_selection_answer(callback: CallbackQuery, state: FSMContext, bot: Bot) -> None:
     """Обработчик выбора возраста"""
-    if not await is_admin(callback.from_user.id):
-        await callback.answer('❌ Недостаточно прав!', show_alert=True)
-        return
-
     try:
         age_users, updated_ranges = await selection_message_handler(callback=callback, state=state, key='age_users')
         try:
@@ -269,10 +245,6 @@ async def age_select_done(callback: CallbackQuery, state: FSMContext) -> None:
         await callback.answer('❌ При обработке данных произошла ошибка. Попробуйте ещё раз!')
         return
 
-    if not await is_admin(callback.from_user.id):
-        await callback.answer('❌ Недостаточно прав!', show_alert=True)
-        return
-
     await state.set_state(MassSendMessage.district_users)
     try:
         await callback.message.answer(
@@ -289,10 +261,6 @@ async def age_select_done(callback: CallbackQuery, state: FSMContext) -> None:
 @router_admin.callback_query(F.data.startswith('select_district'))
 async def district_selection_answer(callback: CallbackQuery, state: FSMContext, bot: Bot) -> None:
     """Обработчик выбора района"""
-    if not await is_admin(callback.from_user.id):
-        await callback.answer('❌ Недостаточно прав!', show_alert=True)
-        return
-
     try:
         district_users, updated_districts = await selection_message_handler(
             callback=callback, state=state, key='district_users'
@@ -323,10 +291,6 @@ async def district_select_done(callback: CallbackQuery, state: FSMContext) -> No
         await callback.answer('❌ При обработке данных произошла ошибка. Попробуйте ещё раз!')
         return
 
-    if not await is_admin(callback.from_user.id):
-        await callback.answer('❌ Недостаточно прав!', show_alert=True)
-        return
-
     await state.set_state(MassSendMessage.target_users)
     try:
         await callback.message.answer(
@@ -343,10 +307,6 @@ async def district_select_done(callback: CallbackQuery, state: FSMContext) -> No
 @router_admin.callback_query(F.data.startswith('select_target'))
 async def target_selection_answer(callback: CallbackQuery, state: FSMContext, bot: Bot) -> None:
     """Обработчик выбора цели"""
-    if not await is_admin(callback.from_user.id):
-        await callback.answer('❌ Недостаточно прав!', show_alert=True)
-        return
-
     try:
         target_users, updated_targets = await selection_message_handler(
             callback=callback, state=state, key='target_users'
@@ -377,10 +337,6 @@ async def target_select_done(callback: CallbackQuery, state: FSMContext) -> None
         await callback.answer('❌ При обработке данных произошла ошибка. Попробуйте ещё раз!')
         return
 
-    if not await is_admin(callback.from_user.id):
-        await callback.answer('❌ Недостаточно прав!', show_alert=True)
-        return
-
     await state.set_state(MassSendMessage.gender_users)
     try:
         await callback.message.answer(
@@ -397,10 +353,6 @@ async def target_select_done(callback: CallbackQuery, state: FSMContext) -> None
 @router_admin.callback_query(F.data.startswith('select_gender'))
 async def gender_selection_answer(callback: CallbackQuery, state: FSMContext, bot: Bot) -> None:
     """Обработчик выбора пола"""
-    if not await is_admin(callback.from_user.id):
-        await callback.answer('❌ Недостаточно прав!', show_alert=True)
-        return
-
     try:
         gender_users, updated_genders = await selection_message_handler(
             callback=callback, state=state, key='gender_users'
@@ -430,23 +382,20 @@ async def mass_send_all_flag(callback: CallbackQuery, state: FSMContext) -> None
         await callback.answer('❌ При обработке данных произошла ошибка. Попробуйте ещё раз!')
         return
     """Установка флага mass_send_all"""
-    if not await is_admin(callback.from_user.id):
-        await callback.answer('❌ Недостаточно прав!', show_alert=True)
-        return
-
     is_full_mailing = await state.update_data(mass_send_all=True)
     logger.info(f'➡️ User {callback.from_user.id} set mass_send_all flag to {is_full_mailing}')
 
-    users = await req_admin.get_all_users_tg_id()
-    logger.info(f'➡️ All users: {users}')
-    if not users:
+    mailing_filter = MailingFilter(all_users=True)
+    total = await req_admin.count_mailing_recipients(mailing_filter)
+    logger.info(f'➡️ All users: {total}')
+    if not total:
         await callback.answer('❌ Нет пользователей для отправки!', show_alert=True)
         return
-    await state.update_data(selected_users=users)
+    await state.update_data(mailing_filter=mailing_filter.to_dict())
 
     # Просто показываем количество пользователей
     await callback.message.answer(
-        f'Всего пользователей: 👥 {len(users)}',
+        f'Всего пользователей: 👥 {total}',
         reply_markup=await kb.add_send_message_kb(),
         parse_mode='html',
     )
@@ -460,37 +409,25 @@ async def gender_select_done(callback: CallbackQuery, state: FSMContext) -> None
         await callback.answer('❌ При обработке данных произошла ошибка. Попробуйте ещё раз!')
         return
 
-    if not await is_admin(callback.from_user.id):
-        await callback.answer('❌ Недостаточно прав!', show_alert=True)
-        return
-
-    users = await req_admin.get_users_for_mass_send(state=state)
-    if not users:
+    mailing_filter = MailingFilter.from_state_data(await state.get_data())
+    total = await req_admin.count_mailing_recipients(mailing_filter)
+    if not total:
         await callback.answer('❌ Нет пользователей для отправки!', show_alert=True)
         return
 
-    # Разбиваем список пользователей на части по 50
-    chunk_size = 50
-    user_chunks = [users[i : i + chunk_size] for i in range(0, len(users), chunk_size)]
-    users = [user[0] for chunk in user_chunks for user in chunk]
-    logger.info(f'✅ Users saved: {users}')
-    await state.update_data(selected_users=users)
-
-    # Отправляем первую часть с информацией о количестве пользователей
-    first_chunk = user_chunks[0]
-    response = [f'{username[1]}' for username in first_chunk]
-
-    await callback.message.answer('Список пользователей для рассылки:\n' + ', '.join(response))
+    # В FSM сохраняется только фильтр: получатели выбираются заново при запуске рассылки
+    await state.update_data(mailing_filter=mailing_filter.to_dict())
+    logger.info(f'✅ Mailing filter saved: {mailing_filter}, users: {total}')
     await callback.answer()
 
-    # Если есть еще части - отправляем их отдельными сообщениями
-    for chunk in user_chunks[1:]:
-        chunk_message = ', '.join(f'{username[1]}' for username in chunk)
-        await callback.message.answer(chunk_message)
-        await callback.answer()
+    # Список пользователей читается из БД пачками по 50 и сразу отправляется
+    header = 'Список пользователей для рассылки:\n'
+    async for chunk in req_admin.stream_mailing_recipients(mailing_filter, batch_size=50):
+        await callback.message.answer(header + ', '.join(f'{username}' for _, username in chunk))
+        header = ''
 
     await callback.message.answer(
-        f'👥 Найдено {len(users)} пользователей по фильтрам для рассылки\n'
+        f'👥 Найдено {total} пользователей по фильтрам для рассылки\n'
         'Нажмите кнопку чтобы написать сообщение для рассылки:',
         reply_markup=await kb.add_send_message_kb(),
     )
@@ -503,10 +440,6 @@ async def cancel_message_send(callback: CallbackQuery, state: FSMContext) -> Non
         await callback.answer('❌ При обработке данных произошла ошибка. Попробуйте ещё раз!')
         return
 
-    if not await is_admin(callback.from_user.id):
-        await callback.answer('❌ Недостаточно прав!', show_alert=True)
-        return
-
     await state.clear()
     await callback.message.answer(
         'Отменено ❌',
@@ -521,18 +454,14 @@ async def add_message_send_mass(callback: CallbackQuery, state: FSMContext) -> N
         await callback.answer('❌ При обработке данных произошла ошибка. Попробуйте ещё раз!')
         return
 
-    if not await is_admin(callback.from_user.id):
-        await callback.answer('❌ Недостаточно прав!', show_alert=True)
-        return
-
     data = await state.get_data()
-    selected_users = data.get('selected_users', [])
+    mailing_filter = data.get('mailing_filter')
     is_full_mailing = data.get('is_full_mailing')
 
     await state.clear()
 
-    if selected_users:
-        await state.update_data(selected_users=selected_users)
+    if mailing_filter:
+        await state.update_data(mailing_filter=mailing_filter)
         await state.update_data(is_full_mailing=is_full_mailing)
 
     await state.set_state(MassSendMessage.message_text)
@@ -552,11 +481,7 @@ async def process_message_text(message: Message, state: FSMContext) -> None:
     if not message.from_user or not message.text:
         return
 
-    if not await is_admin(message.from_user.id):
-        await message.answer('❌ Недостаточно прав!', show_alert=True)
-        return
-
-    text_data = await state.update_data(message_text=message.text)
+    text_data = await state.update_data(message_text=message.html_text)
     logger.info(f'✅ Updated message content: {text_data}')
     await state.set_state(MassSendMessage.media_upload)
     await message.answer(
@@ -572,50 +497,59 @@ async def process_media_group(message: Message, state: FSMContext) -> None:
     if not message.from_user or not message.media_group_id:
         return
 
-    if not await is_admin(message.from_user.id):
-        await message.answer('❌ Недостаточно прав!', show_alert=True)
-        return
-
     group_id = message.media_group_id
     current_msg_id = message.message_id
 
-    # Инициализация данных группы
+    # Инициализация данных группы: файлы уже загруженные до альбома берем из состояния один раз
     if group_id not in media_groups:
-        media_groups[group_id] = {'max_message_id': current_msg_id, 'media_count': 0, 'notified': False}
+        data = await state.get_data()
+        if group_id not in media_groups:
+            media_groups[group_id] = {
+                'max_message_id': current_msg_id,
+                'media_count': 0,
+                'notified': False,
+                'base': data.get('media_upload', []),
+                'items': {},
+            }
+    group = media_groups[group_id]
 
     # Обновляем максимальный message_id
-    if current_msg_id > media_groups[group_id]['max_message_id']:
-        media_groups[group_id]['max_message_id'] = current_msg_id
+    if current_msg_id > group['max_message_id']:
+        group['max_message_id'] = current_msg_id
 
     # Обработка медиа
     media = await process_single_media(message)
     if not media:
         return
 
-    # Обновляем состояние
-    data = await state.get_data()
-    media_list = data.get('media_upload', [])
-    media_list.append(media)
-    await state.update_data(media_upload=media_list)
-
-    media_groups[group_id]['media_count'] += 1
+    # Сообщения альбома обрабатываются параллельно, поэтому копим файлы в памяти,
+    # а в состояние пишем весь список целиком в порядке message_id
+    group['items'][current_msg_id] = media
+    group['media_count'] = len(group['items'])
+    await state.update_data(media_upload=media_group_upload(group))
 
     # Если это сообщение с максимальным ID - оно последнее в группе
-    if current_msg_id == media_groups[group_id]['max_message_id']:
+    if current_msg_id == group['max_message_id']:
         await asyncio.sleep(1)
 
         # Двойная проверка, что message_id не изменился
-        if current_msg_id == media_groups[group_id]['max_message_id']:
+        if current_msg_id == group['max_message_id']:
+            await state.update_data(media_upload=media_group_upload(group))
             await message.answer(
-                f'Медиагруппа из {media_groups[group_id]["media_count"]} файлов сохранено 💾',
+                f'Медиагруппа из {group["media_count"]} файлов сохранено 💾',
                 reply_markup=await kb.done_mailing_kb(),
                 parse_mode='html',
             )
-            media_groups[group_id]['notified'] = True
+            group['notified'] = True
             # Очищаем данные группы через 5 минут
             asyncio.create_task(clean_media_group(group_id, delay=300))
 
 
+def media_group_upload(group: dict[str, Any]) -> list[dict[str, Any]]:
+    """Файлы до альбома и файлы альбома в порядке message_id"""
+    return [*group['base'], *(group['items'][key] for key in sorted(group['items']))]
+
+
 async def clean_media_group(group_id: str, delay: int = 300) -> None:
     await asyncio.sleep(delay)
     if group_id in media_groups:
@@ -628,10 +562,6 @@ async def process_single_media_upload(message: Message, state: FSMContext) -> No
     if not message.from_user:
         return
 
-    if not await is_admin(message.from_user.id):
-        await message.answer('❌ Недостаточно прав!', show_alert=True)
-        return
-
     data = await state.get_data()
     media_list: list[dict[str, Any]] = data.get('media_upload', [])
 
@@ -655,10 +585,6 @@ async def finish_media_upload(callback: CallbackQuery, state: FSMContext, bot: B
         await callback.answer('❌ При обработке данных произошла ошибка. Попробуйте ещё раз!')
         return
 
-    if not await is_admin(callback.from_user.id):
-        await callback.answer('❌ Недостаточно прав!', show_alert=True)
-        return
-
     data = await state.get_data()
     media_list = data.get('media_upload', [])
     text = data.get('message_text')
@@ -671,53 +597,8 @@ async def finish_media_upload(callback: CallbackQuery, state: FSMContext, bot: B
         await callback.answer()
         return
 
-    # Отправляем превью
-    if media_list:
-        # Если медиа один - отправляем как одиночный файл
-        if len(media_list) == 1:
-            media = media_list[0]
-            if media['type'] == 'photo':
-                await bot.send_photo(
-                    chat_id=callback.message.chat.id,
-                    photo=media['file_id'],
-                    caption=media.get('caption', ''),
-                    parse_mode='HTML',
-                )
-            elif media['type'] == 'video':
-                await bot.send_video(
-                    chat_id=callback.message.chat.id,
-                    video=media['file_id'],
-                    caption=media.get('caption', ''),
-                    parse_mode='HTML',
-                )
-            elif media['type'] == 'document':
-                await bot.send_document(
-                    chat_id=callback.message.chat.id,
-                    document=media['file_id'],
-                    caption=media.get('caption', ''),
-                    parse_mode='HTML',
-                )
-        else:
-            # Если медиа несколько - отправляем как альбом
-            media_group: list[InputMediaType] = []
-            for media in media_list:
-                if media['type'] == 'photo':
-                    media_group.append(
-                        InputMediaPhoto(media=media['file_id'], caption=media.get('caption', ''), parse_mode='HTML')
-                    )
-                elif media['type'] == 'video':
-                    media_group.append(
-                        InputMediaVideo(media=media['file_id'], caption=media.get('caption', ''), parse_mode='HTML')
-                    )
-                elif media['type'] == 'document':
-                    media_group.append(
-                        InputMediaDocument(media=media['file_id'], caption=media.get('caption', ''), parse_mode='HTML')
-                    )
-
-            await bot.send_media_group(chat_id=callback.message.chat.id, media=media_group)
-
-    if text:
-        await callback.message.answer(f'{text}', parse_mode='HTML')
+    # Превью собирается тем же MailingPayload, что и рассылка
+    await MailingPayload.compile(text, media_list).send(bot, callback.message.chat.id)
 
     await callback.message.answer('Превью рассылки:', reply_markup=await kb.start_mailing_kb())
     await callback.answer()
@@ -732,10 +613,6 @@ async def start_mailing(callback: CallbackQuery, state: FSMContext, bot: Bot) ->
         await callback.answer('❌ При обработке данных произошла ошибка. Попробуйте ещё раз!')
         return
 
-    if not await is_admin(callback.from_user.id):
-        await callback.answer('❌ Недостаточно прав!', show_alert=True)
-        return
-
     if not await validate_callback(callback):
         return
 
@@ -743,18 +620,27 @@ async def start_mailing(callback: CallbackQuery, state: FSMContext, bot: Bot) ->
         await callback.answer('⏳ Рассылка началась', show_alert=True)
 
         data = await state.get_data()
-        users = data.get('selected_users', [])
+        filter_data = data.get('mailing_filter')
         text: Any = data.get('message_text')
         media_list = data.get('media_upload', [])
-        logger.info(f'*** ➡️ Start mailing: users: {users}, text: {text}, media_list: {media_list}')
+        logger.info(f'*** ➡️ Start mailing: filter: {filter_data}, text: {text}, media_list: {media_list}')
 
-        if not await validate_content(text, media_list, callback):
+        if not filter_data:
+            await callback.message.answer('❌ Не выбраны получатели рассылки')
             return
 
-        total = len(users)
-        progress_msg = await callback.message.answer(f'⏳ Начало рассылки... 0/{total}')
+        if not await validate_content(text, media_list, callback):
+            return
 
-        asyncio.create_task(process_mailing_with_report(users, text, media_list, bot, progress_msg, callback.message))
+        # Задание и получатели сохраняются в БД: рассылку можно приостановить и продолжить после перезапуска
+        job = await req_mailing.create_mailing_job(
+            callback.message.chat.id, text, media_list, MailingFilter.from_dict(filter_data)
+        )
+        progress_msg = await callback.message.answer(
+            f'⏳ Начало рассылки... 0/{job.total}', reply_markup=await kb.mailing_control_kb(job.id)
+        )
+        await req_mailing.set_progress_message(job.id, progress_msg.message_id)
+        mailing_jobs.start(bot, job.id)
 
     except Exception as e:
         logger.error(f'❗️Error in start_mailing: {e}')
@@ -762,3 +648,42 @@ async def start_mailing(callback: CallbackQuery, state: FSMContext, bot: Bot) ->
     finally:
         await state.clear()
         await callback.answer()
+
+
+@router_admin.callback_query(F.data.regexp(r'^mailing_(pause|resume|cancel)_\d+$'))
+async def control_mailing(callback: CallbackQuery, bot: Bot) -> None:
+    """Пауза, продолжение и отмена запущенной рассылки"""
+    if not callback.data or not callback.from_user or not isinstance(callback.message, Message):
+        await callback.answer('❌ Ошибка: данные не получены')
+        return
+
+    _, action, job_id_str = callback.data.split('_')
+    job_id = int(job_id_str)
+
+    if action == 'pause':
+        if not await req_mailing.set_job_status(job_id, JobStatus.PAUSED, (JobStatus.RUNNING,)):
+            await callback.answer('Рассылка уже не выполняется')
+            return
+        await callback.message.edit_reply_markup(reply_markup=await kb.mailing_control_kb(job_id, JobStatus.PAUSED))
+        await callback.answer('⏸ Рассылка остановится после текущей пачки')
+
+    elif action == 'resume':
+        if not await req_mailing.set_job_status(job_id, JobStatus.RUNNING, (JobStatus.PAUSED,)):
+            await callback.answer('Рассылка не на паузе')
+            return
+        await callback.message.edit_reply_markup(reply_markup=await kb.mailing_control_kb(job_id))
+        mailing_jobs.start(bot, job_id)
+        await callback.answer('▶️ Рассылка продолжена')
+
+    else:
+        # Задание на паузе никто не выполняет, поэтому отчет отправляем сами
+        if await req_mailing.set_job_status(job_id, JobStatus.CANCELLED, (JobStatus.PAUSED,)):
+            job = await req_mailing.get_mailing_job(job_id)
+            if job is not None:
+                await mailing_jobs.show_progress(bot, job, JobStatus.CANCELLED)
+                await mailing_jobs.send_report(bot, job, JobStatus.CANCELLED)
+        elif not await req_mailing.set_job_status(job_id, JobStatus.CANCELLED, (JobStatus.RUNNING,)):
+            await callback.answer('Рассылка уже завершена')
+            return
+        await callback.message.edit_reply_markup(reply_markup=None)
+        await callback.answer('⛔ Рассылка отменена')
@@ -7,14 +7,13 @@ from aiogram.types import Message
 import src.bot.db.repositories.support_repository as req_support
 import src.bot.keyboards.builders as kb
 
-from src.bot.db.repositories.admin_repository import is_admin
 from src.bot.fsm.admin_states import AdminChatState
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-router_admin = Router()
+router_admin = Router(name='admin_messages')
 
 
 @router_admin.message(F.text == '🪪')
@@ -36,10 +35,6 @@ async def process_admin_reply(message: Message, state: FSMContext, bot: Bot) ->
         await message.answer('❌ Ошибка сервера')
         return
 
-    if not await is_admin(message.from_user.id):
-        logger.info(f'❗User {message.from_user.id} is not admin!')
-        await message.answer('❌ Недостаточно прав!', show_alert=True)
-        return
     data = await state.get_data()
     ticket_id = data.get('current_ticket_id')
 
@@ -5,7 +5,7 @@ from .commands import router_user as command_router
 from .messages import router_user as message_router
 
 
-router_user = Router()
+router_user = Router(name='user')
 router_user.include_router(callback_router)
 router_user.include_router(command_router)
 router_user.include_router(message_router)
@@ -1,6 +1,8 @@
 import asyncio
 import logging
 
+from functools import partial
+
 from aiogram import Bot, F, Router
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
@@ -11,9 +13,14 @@ import src.bot.db.repositories.event_repository as req_event
 import src.bot.db.repositories.user_repository as req_user
 import src.bot.keyboards.builders as kb
 
+from src.bot.db.repositories.relation_graph import relation_graph
+from src.bot.db.repositories.user_data_utils import profile_form_data
 from src.bot.fsm.user_states import PeopleSearch, UserData
+from src.bot.utils.seen import seen_events
+from src.bot.utils.toggles import relation_toggles
 from src.bot.utils.user_helpers import (
     data_get_update,
+    notify_match,
     refresh_profile_message,
     safe_delete_message,
     send_events_list,
@@ -26,7 +33,7 @@ from src.bot.utils.user_helpers import (
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-router_user = Router()
+router_user = Router(name='user_callbacks')
 
 
 # --- Хендлеры для Events ---
@@ -37,15 +44,11 @@ async def repeat_recommendations(callback: CallbackQuery, state: FSMContext, bot
         await callback.answer('❌ При обработке данных произошла ошибка. Попробуйте ещё раз!')
         return
 
-    data = await state.get_data()
-    shown_events = data.get('shown_events', [])  # Список уже показанных ID
-    logger.info(f'Shown events: {shown_events}')
+    logger.info(f'Shown events: {seen_events.count(callback.from_user.id)}')
 
     try:
         # Получаем рекомендации, исключая показанные
-        events = await req_event.get_recommended_events_new(
-            tg_id=callback.from_user.id, limit=3, exclude_ids=shown_events
-        )
+        events = await req_event.get_recommended_events_new(tg_id=callback.from_user.id, limit=3)
         await callback.answer()
 
         if not events:
@@ -58,10 +61,8 @@ async def repeat_recommendations(callback: CallbackQuery, state: FSMContext, bot
             await callback.answer()
             return
 
-        # Обновляем список показанных ID
-        new_shown_events = shown_events + [event.id for event in events]
-        await state.update_data(shown_events=new_shown_events)
-        logger.info(f'Updated shown events: {new_shown_events}')
+        # Запоминаем показанные события
+        seen_events.mark(callback.from_user.id, [event.id for event in events])
 
         await send_events_list(callback, events, bot)
     except Exception as e:
@@ -84,17 +85,11 @@ async def edit_events(callback: CallbackQuery, state: FSMContext) -> None:
 
         await state.set_state(UserData.interests)
         await state.update_data(
-            year=user_data.get('year'),
-            gender=user_data.get('gender'),
-            status=user_data.get('status'),
-            target=user_data.get('target'),
-            district=user_data.get('district'),
-            profession=user_data.get('profession'),
-            about=user_data.get('about'),
-            interests=user_data.get('interests', []),
-            shown_events=user_data.get('shown_events', []),
+            **profile_form_data(user_data),
             edit_mode='only_interests',
         )
+        # С новыми интересами подборка событий начинается заново
+        seen_events.reset(callback.from_user.id)
 
         await callback.message.answer(
             'Обновите интересы:',
@@ -106,94 +101,58 @@ async def edit_events(callback: CallbackQuery, state: FSMContext) -> None:
         await callback.answer('❌ При обработке данных произошла ошибка. Попробуйте ещё раз!')
 
 
-# TODO: оптимизировать в общую логику toggle_like and toggle_friend
-# --- Хендлеры для лайков ---
-@router_user.callback_query(F.data.startswith('like_toggle_'))
-async def toggle_like(callback: CallbackQuery, state: FSMContext, bot: Bot) -> None:
-    """Обрабатывает нажатие кнопки Лайк для отношений"""
+async def toggle_relation(callback: CallbackQuery, state: FSMContext, bot: Bot) -> None:
+    """Общая логика кнопок Лайк для отношений и дружбы
+
+    Ответ на нажатие приходит сразу, а запись в БД и обновление клавиатуры откладываются
+    до паузы в нажатиях: из серии быстрых нажатий записывается только итог.
+    """
     if not callback.from_user or not callback.data or not isinstance(callback.message, Message):
         await callback.answer('❌ При обработке данных произошла ошибка. Попробуйте ещё раз!')
         return
 
     callback_list = callback.data.split('_')
     to_user_id = int(callback_list[-1])
-    like_tag = callback_list[0]
-    data = await state.get_data()
-    liked_ids = data.get('liked_profile_ids', [])
-    reciprocated_ids = data.get('reciprocated_profile_ids', [])
-
-    if to_user_id in liked_ids:
-        liked_ids.remove(to_user_id)
-        if to_user_id in reciprocated_ids:
-            reciprocated_ids.remove(to_user_id)
-        await callback.answer('Лайк убран')
-        await req_user.delete_like_and_friend_from_db(
-            from_tg_id=callback.from_user.id,
-            to_tg_id=to_user_id,
-            action_type=like_tag,
-        )
-        await req_user.delete_total_like(to_tg_id=to_user_id)
-    else:
-        liked_ids.append(to_user_id)
-        await callback.answer('Лайк поставлен!')
-        await req_user.add_like_and_friend_to_db(
-            from_tg_id=callback.from_user.id,
-            to_tg_id=to_user_id,
-            action_type=like_tag,
-            state=state,
-            bot=bot,
-        )
-        await req_user.add_total_like(to_tg_id=to_user_id)
+    action_type = callback_list[0]
+    from_user_id = callback.from_user.id
+    key = (from_user_id, to_user_id, action_type)
+
+    async def apply(enabled: bool) -> None:
+        # Граф связей обновляется после коммита записи, клавиатура строится уже по нему
+        if enabled:
+            result = await req_user.add_like_and_friend_to_db(
+                from_tg_id=from_user_id,
+                to_tg_id=to_user_id,
+                action_type=action_type,
+            )
+            if result.created and result.reciprocated:
+                await notify_match(bot, from_user_id, to_user_id, state, action_type)
+        else:
+            await req_user.delete_like_and_friend_from_db(
+                from_tg_id=from_user_id,
+                to_tg_id=to_user_id,
+                action_type=action_type,
+            )
+        await refresh_profile_message(callback=callback, state=state)
 
-        data = await state.get_data()
-        reciprocated_ids = data.get('reciprocated_profile_ids', [])
+    # Исходное состояние - связь из графа, дальше переключается последнее нажатие, еще не записанное в БД
+    enabled = await relation_toggles.toggle(
+        key, partial(relation_graph.has_edge, from_user_id, to_user_id, action_type), apply
+    )
+    await callback.answer('Лайк поставлен!' if enabled else 'Лайк убран')
 
-    await state.update_data({'liked_profile_ids': liked_ids, 'reciprocated_profile_ids': reciprocated_ids})
-    await refresh_profile_message(callback=callback, state=state)
+
+# --- Хендлеры для лайков ---
+@router_user.callback_query(F.data.startswith('like_toggle_'))
+async def toggle_like(callback: CallbackQuery, state: FSMContext, bot: Bot) -> None:
+    """Обрабатывает нажатие кнопки Лайк для отношений"""
+    await toggle_relation(callback, state, bot)
 
 
 @router_user.callback_query(F.data.startswith('friend_toggle_'))
 async def toggle_friend(callback: CallbackQuery, state: FSMContext, bot: Bot) -> None:
     """Обрабатывает нажатие кнопки Лайк для дружбы"""
-    if not callback.from_user or not callback.data or not isinstance(callback.message, Message):
-        await callback.answer('❌ При обработке данных произошла ошибка. Попробуйте ещё раз!')
-        return
-
-    callback_list = callback.data.split('_')
-    to_user_id = int(callback_list[-1])
-    friend_tag = callback_list[0]
-    data = await state.get_data()
-    friend_ids = data.get('friend_profile_ids', [])
-    reciprocated_ids = data.get('reciprocated_profile_ids', [])
-    logger.info(
-        f'*** to_user_id: {to_user_id}, friend_tag: {friend_tag}, callback.from_user.id: {callback.from_user.id}'
-    )
-
-    if to_user_id in friend_ids:
-        friend_ids.remove(to_user_id)
-        if to_user_id in reciprocated_ids:
-            reciprocated_ids.remove(to_user_id)
-        await callback.answer('Лайк убран')
-        await req_user.delete_like_and_friend_from_db(
-            from_tg_id=callback.from_user.id,
-            to_tg_id=to_user_id,
-            action_type=friend_tag,
-        )
-        await req_user.delete_total_like(to_tg_id=to_user_id)
-    else:
-        friend_ids.append(to_user_id)
-        await callback.answer('Лайк поставлен!')
-        await req_user.add_like_and_friend_to_db(
-            from_tg_id=callback.from_user.id,
-            to_tg_id=to_user_id,
-            action_type=friend_tag,
-            state=state,
-            bot=bot,
-        )
-        await req_user.add_total_like(to_tg_id=to_user_id)
-
-    await state.update_data({'friend_profile_ids': friend_ids})
-    await refresh_profile_message(callback=callback, state=state)
+    await toggle_relation(callback, state, bot)
 
 
 # --- Хендлеры для профиля ---
@@ -243,17 +202,6 @@ async def find_people(callback: CallbackQuery, state: FSMContext) -> None:
         return
 
     try:
-        await req_user.load_user_like_and_friend(callback.from_user.id, state=state)
-        data = await state.get_data()
-        if 'shown_people_ids' not in data:
-            await state.update_data(shown_people_ids=[])
-        if 'liked_profile_ids' not in data:
-            await state.update_data(liked_profile_ids=[])
-        if 'friend_profile_ids' not in data:
-            await state.update_data(friend_profile_ids=[])
-        if 'reciprocated_profile_ids' not in data:
-            await state.update_data(reciprocated_profile_ids=[])
-
         await state.set_state(PeopleSearch.age_range)
         await callback.message.answer(
             """
@@ -292,8 +240,7 @@ async def get_age_range(callback: CallbackQuery, state: FSMContext, bot: Bot) ->
             else [*current_ranges, age_range]
         )
 
-        await state.update_data(age_ranges=updated_ranges)
-        updated_data = await state.get_data()
+        updated_data = await state.update_data(age_ranges=updated_ranges)
         logger.info(f'Updated age ranges: {updated_data}')
 
         try:
@@ -327,7 +274,7 @@ async def age_done(callback: CallbackQuery, state: FSMContext, bot: Bot) -> None
             await callback.answer('❌ Выберите хотя бы один возрастной диапазон!', show_alert=True)
             return
 
-        await state.set_state(PeopleSearch.shown_people_ids)
+        await state.set_state(PeopleSearch.browsing)
         await callback.message.answer(
             """
             Подождите, идет поиск...
@@ -358,16 +305,6 @@ async def show_more_people(callback: CallbackQuery, state: FSMContext, bot: Bot)
         return
 
     try:
-        await req_user.load_user_like_and_friend(callback.from_user.id, state=state)
-        data = await state.get_data()
-        if 'shown_people_ids' not in data:
-            await state.update_data(shown_people_ids=[])
-        if 'liked_profile_ids' not in data:
-            await state.update_data(liked_profile_ids=[])
-        if 'friend_profile_ids' not in data:
-            await state.update_data(friend_profile_ids=[])
-        if 'reciprocated_profile_ids' not in data:
-            await state.update_data(reciprocated_profile_ids=[])
         chat_id = callback.message.chat.id
 
         async def show_typing() -> None:
@@ -547,9 +484,7 @@ async def get_save(callback: CallbackQuery, state: FSMContext, bot: Bot) -> None
             else [*current_interests, interests]
         )
 
-        await state.update_data(interests=updated_interests)
-
-        updated_data = await state.get_data()
+        updated_data = await state.update_data(interests=updated_interests)
         logger.info(f'✅ Updated interests: {updated_data}')
 
         try:
@@ -642,8 +577,4 @@ async def save_data(callback: CallbackQuery, state: FSMContext, bot: Bot) -> Non
         logger.error(f'Error in status_save: {e}', exc_info=True)
         await callback.answer('❌ Произошла ошибка. Попробуйте ещё раз.')
     finally:
-        data = await state.get_data()
-        shown_events = data.get('shown_events', [])
         await state.clear()
-        await state.update_data(shown_events=shown_events)
-        logger.info(f'Updated shown events in state save: {shown_events}')
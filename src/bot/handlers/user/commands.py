@@ -12,7 +12,7 @@ from src.bot.utils.texts import get_text_command_start
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-router_user = Router()
+router_user = Router(name='user_commands')
 
 
 @router_user.message(CommandStart())
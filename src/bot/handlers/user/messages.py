@@ -13,13 +13,14 @@ import src.bot.db.repositories.user_repository as req_user
 import src.bot.keyboards.builders as kb
 
 from src.bot.fsm.user_states import PeopleSearch, UserData
+from src.bot.utils.delivery_health import delivery_health
 from src.bot.utils.user_helpers import show_user_profile, start_events_list
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-router_user = Router()
+router_user = Router(name='user_messages')
 
 MAIN_MENU_BUTTONS = {'Резиденты', 'Мероприятия', 'Баллы', 'Чат', '🪪', '🎉 Начнём 🎉'}
 
@@ -82,7 +83,7 @@ async def user_message_to_support(message: Message) -> None:
         is_from_user=True,
     )
 
-    admins = await req_admin.get_all_admin()
+    admins = delivery_health.filter_alive(await req_admin.get_all_admin())
     logger.info(f'➡️ Sending message to {len(admins)} admins list: {admins}')
     for admin_id in admins:
         try:
@@ -101,6 +102,7 @@ async def user_message_to_support(message: Message) -> None:
             )
         except Exception as e:
             logger.error(f'❗Failed to send message to admin {admin_id}: {e}')
+            await delivery_health.record_error(admin_id, e)
 
     messages = await req_support.get_all_messages_from_ticket(ticket_id=ticket.id)
     if len(messages) == 1:
@@ -163,7 +165,7 @@ async def get_status(message: Message, state: FSMContext) -> None:
 
     data = await state.update_data(year=age)
     if not data.get('year'):
-        await message.answer('❌ Пожалуйста, укажите свой возраст', show_alert=True)
+        await message.answer('❌ Пожалуйста, укажите свой возраст')
         return
     await state.set_state(UserData.gender)
 
@@ -186,7 +188,7 @@ async def get_profession(message: Message, state: FSMContext) -> None:
 
     data = await state.update_data(profession=message.text)
     if not data.get('profession'):
-        await message.answer('❌ Пожалуйста, укажите свою профессию', show_alert=True)
+        await message.answer('❌ Пожалуйста, укажите свою профессию')
         return
 
     await state.set_state(UserData.about)
@@ -208,7 +210,7 @@ async def get_about(message: Message, state: FSMContext) -> None:
 
     data = await state.update_data(about=message.text)
     if not data.get('about'):
-        await message.answer('❌ Пожалуйста, укажите о себе', show_alert=True)
+        await message.answer('❌ Пожалуйста, укажите о себе')
         return
 
     await state.set_state(UserData.interests)
@@ -14,6 +14,8 @@ from src.bot.db.repositories.options_repository import (
     get_all_marital_status,
     get_all_target,
 )
+from src.bot.db.repositories.relation_graph import relation_graph
+from src.bot.utils.mailing import JobStatus
 
 
 logging.basicConfig(level=logging.INFO)
@@ -27,6 +29,7 @@ async def get_admin_menu_kb() -> InlineKeyboardMarkup:
         InlineKeyboardButton(text='Массовая рассылка (по фильтрам)', callback_data='mass_send'),
         InlineKeyboardButton(text='Массовая рассылка (всем)', callback_data='mass_send_all'),
         InlineKeyboardButton(text='Проверить обращения', callback_data='check_tickets'),
+        InlineKeyboardButton(text='Статистика бота', callback_data='bot_stats'),
     )
 
     menu_inline.adjust(1)
@@ -170,6 +173,18 @@ async def done_mailing_kb() -> InlineKeyboardMarkup:
     return menu_inline.as_markup()
 
 
+async def mailing_control_kb(job_id: int, status: JobStatus = JobStatus.RUNNING) -> InlineKeyboardMarkup:
+    menu_inline = InlineKeyboardBuilder()
+    if status is JobStatus.PAUSED:
+        menu_inline.add(InlineKeyboardButton(text='▶️ Продолжить', callback_data=f'mailing_resume_{job_id}'))
+    else:
+        menu_inline.add(InlineKeyboardButton(text='⏸ Пауза', callback_data=f'mailing_pause_{job_id}'))
+    menu_inline.add(InlineKeyboardButton(text='⛔ Отменить', callback_data=f'mailing_cancel_{job_id}'))
+
+    menu_inline.adjust(2)
+    return menu_inline.as_markup()
+
+
 # Кнопки обработки тикетов
 async def get_admin_reply_message_kb(ticket_id: int) -> InlineKeyboardMarkup:
     menu_inline = InlineKeyboardBuilder()
@@ -295,19 +310,15 @@ async def show_more_people_kb() -> InlineKeyboardMarkup:
 async def send_message_user_and_like_kb(
     tg_id: int,
     username: str | None,
-    state: FSMContext,
-    target: str,
+    viewer_tg_id: int,
+    target: str | None,
 ) -> InlineKeyboardMarkup:
-    data = await state.get_data()
-
-    liked_ids = data.get('liked_profile_ids', [])
-    friend_ids = data.get('friend_profile_ids', [])
-    reciprocated_ids = data.get('reciprocated_profile_ids', [])
-    logger.info(f'*** liked_ids: {liked_ids}, friend_ids: {friend_ids}, reciprocated_ids: {reciprocated_ids}')
+    """Кнопки под профилем tg_id, который смотрит viewer_tg_id; состояние лайков из графа связей"""
+    relations = await relation_graph.get(viewer_tg_id)
 
-    is_liked = tg_id in liked_ids
-    is_friend = tg_id in friend_ids
-    is_reciprocated = tg_id in reciprocated_ids
+    is_liked = tg_id in relations.liked
+    is_friend = tg_id in relations.friends
+    is_reciprocated = tg_id in relations.reciprocated
     logger.info(f'*** is_liked: {is_liked}, is_friend: {is_friend}, is_reciprocated: {is_reciprocated}')
 
     menu_inline = InlineKeyboardBuilder()
@@ -1,15 +1,10 @@
 import asyncio
 import logging
-import os
-
-from pathlib import Path
-
-from aiogram import Bot, Dispatcher
-from dotenv import load_dotenv
 
+from src.bot.config import load_config
 from src.bot.db.models import create_db_and_tables
-from src.bot.handlers.admin import router_admin
-from src.bot.handlers.user import router_user
+from src.bot.dispatcher import create_bot, create_dispatcher, start_background, stop_background
+from src.bot.webhook import run_webhook
 
 
 logging.basicConfig(level=logging.INFO)
@@ -17,30 +12,24 @@ logger = logging.getLogger(__name__)
 
 
 async def main() -> None:
-    project_root = Path(__file__).parent.parent.parent
-    env_path = project_root / '.env.local'
-
-    if env_path.exists():
-        load_dotenv(env_path)
-        logger.info('Load bot: .env.local')
-    else:
-        load_dotenv()
-        logger.info('Load bot: .env')
-
-    TOKEN = os.environ.get('BOT_TOKEN')
-
-    if TOKEN is None:
-        raise ValueError('BOT_TOKEN is not set')
+    config = load_config()
 
     logger.info('Connecting to database...')
     await create_db_and_tables()
 
-    bot = Bot(token=TOKEN)
-    dp = Dispatcher()
-    dp.include_router(router_admin)
-    dp.include_router(router_user)
+    if config.is_webhook:
+        logger.info('Application startup complete (webhook)')
+        await run_webhook(config)
+        return
+
+    bot = create_bot(config)
+    background = await start_background(bot)
+    dp = create_dispatcher()
     logger.info('Application startup complete')
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        stop_background(background)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,16 @@
+from .db_session import DbSessionMiddleware, ReleaseDbSessionRequestMiddleware
+from .delivery_health import DeliveryHealthMiddleware
+from .routing_profiler import ROUTING_PROFILE, RoutingProfileMiddleware, instrument_router
+from .state_proxy import BufferedFSMContext, StateProxyMiddleware
+
+
+__all__ = [
+    'BufferedFSMContext',
+    'DbSessionMiddleware',
+    'DeliveryHealthMiddleware',
+    'ROUTING_PROFILE',
+    'ReleaseDbSessionRequestMiddleware',
+    'RoutingProfileMiddleware',
+    'StateProxyMiddleware',
+    'instrument_router',
+]
@@ -0,0 +1,67 @@
+import logging
+
+from collections.abc import Awaitable
+from typing import Any, Callable
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject
+
+from src.bot.db.connection import (
+    bind_current_session,
+    release_current_session,
+    unbind_current_session,
+    unit_of_work_session,
+)
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    """Одна сессия БД на весь апдейт.
+
+    Соединение берется из пула при первом запросе и возвращается перед каждым запросом
+    к Telegram (ReleaseDbSessionRequestMiddleware), так что транзакция длится от запросов к БД
+    до ближайшего ответа пользователю. После хендлера выполняется commit, при исключении — rollback
+    того, что еще не зафиксировано.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        async with unit_of_work_session() as session:
+            token = bind_current_session(session)
+            data['session'] = session
+            try:
+                result = await handler(event, data)
+                await session.complete()
+                return result
+            except Exception:
+                await session.rollback()
+                raise
+            finally:
+                unbind_current_session(token)
+
+
+class ReleaseDbSessionRequestMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: перед запросом к Telegram фиксирует транзакцию апдейта
+
+    Иначе соединение простаивает в открытой транзакции все время сетевых запросов и пауз хендлера,
+    и несколько десятков одновременных апдейтов исчерпывают пул.
+    """
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        await release_current_session()
+        return await make_request(bot, method)
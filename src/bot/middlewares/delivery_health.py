@@ -0,0 +1,31 @@
+import logging
+
+from collections.abc import Awaitable
+from typing import Any, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User
+
+from src.bot.utils.delivery_health import delivery_health
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class DeliveryHealthMiddleware(BaseMiddleware):
+    """Снимает отметку недоступного чата, когда пользователь снова пишет боту
+
+    Проверка - поиск в множестве процесса, запрос к БД только для чатов с отметкой.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        user = data.get('event_from_user')
+        if isinstance(user, User) and delivery_health.is_dead(user.id):
+            await delivery_health.revive(user.id)
+        return await handler(event, data)
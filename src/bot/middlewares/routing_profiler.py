@@ -0,0 +1,70 @@
+import logging
+import os
+import time
+
+from collections.abc import Awaitable
+from contextvars import ContextVar
+from typing import Any, Callable, Optional
+
+from aiogram import BaseMiddleware, Router
+from aiogram.types import TelegramObject
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# ROUTING_PROFILE=1 пишет в лог, сколько времени апдейт провел в фильтрах каждого роутера
+ROUTING_PROFILE = bool(int(os.environ.get('ROUTING_PROFILE', 0)))
+
+_filter_timings: ContextVar[Optional[dict[str, float]]] = ContextVar('filter_timings', default=None)
+
+
+def _timed(router_name: str, check: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        timings = _filter_timings.get()
+        if timings is None:
+            return await check(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return await check(*args, **kwargs)
+        finally:
+            timings[router_name] = timings.get(router_name, 0.0) + time.perf_counter() - started
+
+    return wrapper
+
+
+def instrument_router(router: Router) -> None:
+    """Оборачивает фильтры роутера и всех вложенных роутеров замером времени
+
+    Замеряются корневые фильтры роутера и фильтры каждого хендлера; время самих хендлеров не входит.
+    """
+    for item in router.chain_tail:
+        for observer in item.observers.values():
+            observer.check_root_filters = _timed(item.name, observer.check_root_filters)  # type: ignore[method-assign]
+            for handler in observer.handlers:
+                handler.check = _timed(item.name, handler.check)  # type: ignore[assignment]
+
+
+class RoutingProfileMiddleware(BaseMiddleware):
+    """Логирует время апдейта и долю, ушедшую на фильтры роутеров"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        timings: dict[str, float] = {}
+        token = _filter_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            total = time.perf_counter() - started
+            _filter_timings.reset(token)
+            routing = sum(timings.values())
+            details = ', '.join(f'{name} {seconds * 1000:.2f}ms' for name, seconds in timings.items())
+            logger.info(
+                f'Update {getattr(event, "update_id", None)}: {total * 1000:.2f}ms, '
+                f'filters {routing * 1000:.2f}ms ({details})'
+            )
@@ -0,0 +1,155 @@
+import copy
+import logging
+
+from collections.abc import Awaitable
+from typing import Any, Callable, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.types import TelegramObject
+
+from src.bot.fsm.storage import KeyValueStorage
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class BufferedFSMContext(FSMContext):
+    """FSMContext, который читает данные из хранилища один раз за апдейт и копит записи
+
+    Чтения возвращают копии локального снимка. Изменения записываются одним запросом в flush():
+    только измененные и удаленные ключи. После flush() контекст работает напрямую с хранилищем,
+    чтобы фоновые задачи, пережившие апдейт, не теряли записи.
+    """
+
+    def __init__(self, storage: BaseStorage, key: StorageKey, state: Optional[str]) -> None:
+        super().__init__(storage=storage, key=key)
+        self._state = state
+        self._state_dirty = False
+        self._data: Optional[dict[str, Any]] = None
+        self._original: dict[str, Any] = {}
+        self._replaced = False
+        self._flushed = False
+
+    async def _load(self) -> dict[str, Any]:
+        if self._data is None:
+            self._data = await self.storage.get_data(key=self.key)
+            self._original = copy.deepcopy(self._data)
+        return self._data
+
+    async def set_state(self, state: StateType = None) -> None:
+        if self._flushed:
+            return await super().set_state(state)
+        self._state = state.state if isinstance(state, State) else state
+        self._state_dirty = True
+
+    async def get_state(self) -> Optional[str]:
+        if self._flushed:
+            return await super().get_state()
+        return self._state
+
+    async def set_data(self, data: dict[str, Any]) -> None:
+        if self._flushed:
+            return await super().set_data(data)
+        # Прежние данные не нужны: при flush данные заменяются целиком
+        self._data = copy.deepcopy(data)
+        self._replaced = True
+
+    async def get_data(self) -> dict[str, Any]:
+        if self._flushed:
+            return await super().get_data()
+        return copy.deepcopy(await self._load())
+
+    async def get_value(self, key: str, default: Optional[Any] = None) -> Optional[Any]:
+        if self._flushed:
+            return await super().get_value(key, default)
+        return copy.deepcopy((await self._load()).get(key, default))
+
+    async def update_data(self, data: Optional[dict[str, Any]] = None, **kwargs: Any) -> dict[str, Any]:
+        if self._flushed:
+            return await super().update_data(data, **kwargs)
+        if data:
+            kwargs.update(data)
+        current = await self._load()
+        current.update(copy.deepcopy(kwargs))
+        return copy.deepcopy(current)
+
+    async def flush(self) -> None:
+        """Записывает накопленные изменения одним обращением к хранилищу"""
+        if self._flushed:
+            return
+        self._flushed = True
+
+        changed: dict[str, Any] = {}
+        removed: list[str] = []
+        if self._data is not None:
+            if self._replaced:
+                changed = self._data
+            else:
+                changed = {
+                    name: value
+                    for name, value in self._data.items()
+                    if name not in self._original or self._original[name] != value
+                }
+                removed = [name for name in self._original if name not in self._data]
+
+        if not self._state_dirty and not self._replaced and not changed and not removed:
+            return
+
+        if isinstance(self.storage, KeyValueStorage):
+            await self.storage.apply_changes(
+                self.key,
+                changed,
+                removed,
+                replace=self._replaced,
+                update_state=self._state_dirty,
+                state=self._state,
+            )
+            return
+
+        # Хранилища без частичной записи: обычные вызовы BaseStorage
+        if self._state_dirty:
+            await self.storage.set_state(key=self.key, state=self._state)
+        if self._replaced:
+            await self.storage.set_data(key=self.key, data=changed)
+        elif changed or removed:
+            current = await self.storage.get_data(key=self.key)
+            current.update(changed)
+            for name in removed:
+                current.pop(name, None)
+            await self.storage.set_data(key=self.key, data=current)
+
+
+class StateProxyMiddleware(BaseMiddleware):
+    """Подменяет FSMContext апдейта на BufferedFSMContext и сбрасывает изменения после хендлера
+
+    Регистрируется как outer middleware апдейтов после встроенного FSMContextMiddleware.
+    Изменения записываются и при исключении в хендлере, как это было бы без буфера.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        context = data.get('state')
+        if not isinstance(context, FSMContext):
+            return await handler(event, data)
+
+        buffered = BufferedFSMContext(context.storage, context.key, data.get('raw_state'))
+        data['state'] = buffered
+        try:
+            result = await handler(event, data)
+        except Exception:
+            try:
+                await buffered.flush()
+            except Exception as e:
+                logger.error(f'Failed to flush FSM state for {context.key}: {e}', exc_info=True)
+            raise
+
+        await buffered.flush()
+        return result
@@ -1,38 +1,26 @@
-import asyncio
 import logging
 
-from typing import Any, Callable, Optional, Union
+from typing import Any, Optional, Union
 
-from aiogram import Bot
+from aiogram.filters import BaseFilter
 from aiogram.fsm.context import FSMContext
-from aiogram.types import (
-    CallbackQuery,
-    InputMediaAudio,
-    InputMediaDocument,
-    InputMediaPhoto,
-    InputMediaVideo,
-    Message,
-)
+from aiogram.types import CallbackQuery, Message
 
 import src.bot.db.repositories.admin_repository as req_admin
 
+from src.bot.db.connection import get_pool_stats
+from src.bot.utils.cache import get_cache_stats
 
-InputMediaType = Union[
-    InputMediaPhoto,
-    InputMediaVideo,
-    InputMediaAudio,
-    InputMediaDocument,
-]
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-# Проверка пользователя на администратора
-class AdminFilter(logging.Filter):
-    async def __call__(self, message: Message) -> bool:
-        if message.from_user is not None:
-            return await req_admin.is_admin(message.from_user.id)
+# Проверка пользователя на администратора (по кэшу администраторов, без запроса к БД)
+class AdminFilter(BaseFilter):
+    async def __call__(self, event: Union[Message, CallbackQuery]) -> bool:
+        if event.from_user is not None:
+            return await req_admin.is_admin(event.from_user.id)
         return False
 
 
@@ -60,20 +48,16 @@ async def selection_message_handler(
     )
 
     if key == 'age_users':
-        await state.update_data(age_users=updated_ranges)
-        updated_data = await state.get_data()
+        updated_data = await state.update_data(age_users=updated_ranges)
         logger.info(f'✅ Updated age ranges: {updated_data}')
     elif key == 'district_users':
-        await state.update_data(district_users=updated_ranges)
-        updated_data = await state.get_data()
+        updated_data = await state.update_data(district_users=updated_ranges)
         logger.info(f'✅ Updated district ranges: {updated_data}')
     elif key == 'target_users':
-        await state.update_data(target_users=updated_ranges)
-        updated_data = await state.get_data()
+        updated_data = await state.update_data(target_users=updated_ranges)
         logger.info(f'✅ Updated status ranges: {updated_data}')
     elif key == 'gender_users':
-        await state.update_data(gender_users=updated_ranges)
-        updated_data = await state.get_data()
+        updated_data = await state.update_data(gender_users=updated_ranges)
         logger.info(f'✅ Updated gender ranges: {updated_data}')
     else:
         await callback.answer('❌ При обработке данных произошла ошибка. Попробуйте ещё раз!')
@@ -84,12 +68,14 @@ async def selection_message_handler(
 
 async def process_single_media(message: Message) -> Optional[dict[str, Any]]:
     """Обработка одиночного медиафайла"""
+    # Подпись сохраняем в HTML с форматированием администратора, рассылка идет с parse_mode='HTML'
+    caption = message.html_text if message.caption else None
     if message.photo:
-        return {'type': 'photo', 'file_id': message.photo[-1].file_id, 'caption': message.caption}
+        return {'type': 'photo', 'file_id': message.photo[-1].file_id, 'caption': caption}
     elif message.video:
-        return {'type': 'video', 'file_id': message.video.file_id, 'caption': message.caption}
+        return {'type': 'video', 'file_id': message.video.file_id, 'caption': caption}
     elif message.document:
-        return {'type': 'document', 'file_id': message.document.file_id, 'caption': message.caption}
+        return {'type': 'document', 'file_id': message.document.file_id, 'caption': caption}
     return None
 
 
@@ -109,114 +95,26 @@ async def validate_content(text: str, media_list: list, callback: CallbackQuery)
     return True
 
 
-async def process_mailing(
-    users: list[int], text: str, media_list: list, bot: Bot, progress_msg: Message
-) -> tuple[int, int]:
-    """Обработка рассылки сообщений"""
-    success = 0
-    errors = 0
-    total = len(users)
-
-    for i, tg_id in enumerate(users, 1):
-        try:
-            if media_list:
-                await send_media_message(tg_id, text, media_list, bot, i)
-            else:
-                await send_text_message(tg_id, text, bot)
-
-            success += 1
-            await update_progress(progress_msg, i, total, success, errors)
-
-        except Exception as e:
-            errors += 1
-            logger.error(f'Ошибка отправки для {tg_id}: {e}')
-
-        await asyncio.sleep(0.1)  # Задержка перед следующей итерацией
-
-    return success, errors
-
-
-async def process_mailing_with_report(
-    users: list[int],
-    text: str,
-    media_list: list[dict[str, Any]],
-    bot: Bot,
-    progress_msg: Message,
-    message: Message,
-) -> None:
-    """Фоновая задача для обработки рассылки с отчетом"""
-    try:
-        success, errors = await process_mailing(users, text, media_list, bot, progress_msg)
-        await send_final_report(message, len(users), success, errors)
-    except Exception as e:
-        logger.error(f'❗Error in background mailing: {e}')
-        await message.answer('❌ Рассылка прервана из-за ошибки в фоновой задаче!')
-
-
-async def send_media_message(chat_id: int, text: str, media_list: list, bot: Bot, current_index: int) -> None:
-    """Отправка медиа-сообщения"""
-    if len(media_list) == 1:
-        await send_single_media(chat_id, text, media_list[0], bot)
+def format_bot_stats() -> str:
+    """Текст со статистикой пула соединений БД и кэшей"""
+    pool = get_pool_stats()
+    if not pool:
+        text = '📊 Статистика пула недоступна'
     else:
-        await send_media_group(chat_id, text, media_list, bot, current_index)
-
-
-async def send_single_media(chat_id: int, text: str, media: dict, bot: Bot) -> None:
-    """Отправка одиночного медиафайла с явной типизацией"""
-    media_types: dict[str, Callable[..., Any]] = {
-        'photo': bot.send_photo,
-        'video': bot.send_video,
-        'document': bot.send_document,
-    }
-
-    if media['type'] in media_types:
-        send_func = media_types[media['type']]
-        media_file = str(media['file_id']) if isinstance(media['file_id'], str) else media['file_id']
-
-        await send_func(
-            chat_id=chat_id,
-            **{media['type']: media_file},  # photo=file_id или video=file_id и т.д.
-            caption=media.get('caption', text) or None,
-            parse_mode='HTML',
+        text = (
+            '<b>📊 Пул соединений БД</b>\n'
+            f'▪ Размер: {pool["size"]} (+{pool["max_overflow"]} overflow)\n'
+            f'▪ Занято: {pool["checked_out"]}, свободно: {pool["checked_in"]}\n'
+            f'▪ Overflow сейчас: {pool["overflow"]}\n'
+            f'▪ Выдано соединений: {pool["checkouts"]}, таймаутов: {pool["timeouts"]}\n'
+            f'▪ Ожидание: среднее {pool["avg_wait_ms"]:.1f} мс, максимум {pool["max_wait_ms"]:.1f} мс'
         )
 
-
-async def send_media_group(chat_id: int, text: str, media_list: list, bot: Bot, current_index: int) -> None:
-    """Отправка группы медиафайлов"""
-    media_types = {'photo': InputMediaPhoto, 'video': InputMediaVideo, 'document': InputMediaDocument}
-
-    media_group = [
-        media_types[media['type']](
-            media=media['file_id'], caption=media.get('caption') if current_index == 0 else None, parse_mode='HTML'
+    for cache in get_cache_stats():
+        text += (
+            f'\n\n<b>🗂 Кэш {cache["name"]}</b>\n'
+            f'▪ Записей: {cache["size"]}/{cache["maxsize"]}, TTL {cache["ttl"]} с\n'
+            f'▪ Попаданий: {cache["hits"]}, промахов: {cache["misses"]} ({cache["hit_rate"]:.0%})\n'
+            f'▪ Вытеснений: {cache["evictions"]}'
         )
-        for media in media_list
-        if media['type'] in media_types
-    ]
-
-    await bot.send_media_group(chat_id=chat_id, media=media_group)
-
-    if text and not any(m.get('caption') for m in media_list):
-        await bot.send_message(chat_id=chat_id, text=text, parse_mode='HTML')
-
-
-async def send_text_message(chat_id: int, text: str, bot: Bot) -> None:
-    """Отправка текстового сообщения"""
-    await bot.send_message(chat_id=chat_id, text=text, parse_mode='HTML')
-
-
-async def update_progress(progress_msg: Message, current: int, total: int, success: int, errors: int) -> None:
-    """Обновление прогресса рассылки"""
-    if current % 10 == 0 or current == total:
-        try:
-            await progress_msg.edit_text(
-                f'⏳ Рассылка... {current}/{total}\n✅ Успешно: {success}\n❌ Ошибок: {errors}'
-            )
-            logger.info(f'➡️ Progress send message: {current}/{total}, ✅ Success: {success}, ❌ Errors: {errors}')
-        except Exception:
-            pass
-
-
-async def send_final_report(message: Message, total: int, success: int, errors: int) -> None:
-    """Отправка финального отчета"""
-    await message.answer(f'📤 Рассылка завершена\n▪ Всего: {total}\n▪ Успешно: {success}\n▪ Ошибок: {errors}')
-    logger.info(f'➡️ Final send message: 🟢 {total}, ✅ Success: {success}, ❌ Errors: {errors}')
+    return text
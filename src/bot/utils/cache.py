@@ -0,0 +1,65 @@
+import logging
+
+from collections.abc import Callable, Hashable
+from typing import Any, Optional
+
+from cachetools import TTLCache
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Признак отсутствия значения в кэше (None тоже может быть закэширован)
+MISSING: Any = object()
+
+_registry: dict[str, 'StatsTTLCache'] = {}
+
+
+class StatsTTLCache(TTLCache):
+    """LRU-кэш с TTL и счётчиками попаданий, промахов и вытеснений
+
+    С getsizeof maxsize ограничивает суммарный размер значений, а не их количество.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float, getsizeof: Optional[Callable[[Any], int]] = None) -> None:
+        super().__init__(maxsize=maxsize, ttl=ttl, getsizeof=getsizeof)
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        _registry[name] = self
+
+    def popitem(self) -> tuple[Any, Any]:
+        # Вызывается только при переполнении: вытесняем самый давний элемент
+        self.evictions += 1
+        return super().popitem()
+
+    def lookup(self, key: Hashable) -> Any:
+        """Возвращает значение или MISSING, обновляя счётчики"""
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def invalidate(self, key: Hashable) -> None:
+        self.pop(key, None)
+
+    def stats(self) -> dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'name': self.name,
+            'size': self.currsize,
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+def get_cache_stats() -> list[dict[str, Any]]:
+    """Статистика всех кэшей процесса"""
+    return [cache.stats() for cache in _registry.values()]
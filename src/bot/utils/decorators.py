@@ -1,9 +1,10 @@
 import logging
 
 from collections.abc import Awaitable
+from functools import wraps
 from typing import Any, Callable
 
-from src.bot.db.connection import async_session
+from src.bot.db.connection import async_session, get_current_session
 
 
 logging.basicConfig(level=logging.INFO)
@@ -12,9 +13,18 @@ logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
 
 
 def connect_db(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
-    """Декоратор для подключения к БД"""
+    """Декоратор для подключения к БД
 
+    Внутри апдейта переиспользует сессию DbSessionMiddleware,
+    в фоновых задачах открывает собственную сессию
+    """
+
+    @wraps(func)
     async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        current_session = get_current_session()
+        if current_session is not None:
+            return await func(current_session, *args, **kwargs)
+
         async with async_session() as session:
             return await func(session, *args, **kwargs)
 
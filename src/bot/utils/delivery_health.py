@@ -0,0 +1,68 @@
+import asyncio
+import logging
+import os
+
+from collections.abc import Iterable
+from typing import Optional
+
+import src.bot.db.repositories.delivery_repository as req_delivery
+
+from src.bot.utils.mailing import DeliveryStatus, classify_error
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DELIVERY_HEALTH_REFRESH_INTERVAL = int(os.environ.get('DELIVERY_HEALTH_REFRESH_INTERVAL', 600))
+
+
+class DeliveryHealthRegistry:
+    """Множество недоступных чатов процесса, чтобы не тратить на них запросы к Bot API
+
+    Источник истины - таблица delivery_health; множество перечитывается раз в
+    DELIVERY_HEALTH_REFRESH_INTERVAL секунд и сразу обновляется отправками этого процесса.
+    """
+
+    def __init__(self, refresh_interval: int = DELIVERY_HEALTH_REFRESH_INTERVAL) -> None:
+        self.refresh_interval = refresh_interval
+        self._dead: set[int] = set()
+
+    def is_dead(self, tg_id: int) -> bool:
+        return tg_id in self._dead
+
+    def filter_alive(self, tg_ids: Iterable[int]) -> list[int]:
+        return [tg_id for tg_id in tg_ids if tg_id not in self._dead]
+
+    async def refresh(self) -> None:
+        self._dead = await req_delivery.get_dead_chat_ids()
+        logger.info(f'Delivery health refreshed: {len(self._dead)} dead chats')
+
+    async def run(self) -> None:
+        """Фоновая задача периодического перечитывания"""
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f'Failed to refresh delivery health: {e}', exc_info=True)
+            await asyncio.sleep(self.refresh_interval)
+
+    async def record(self, results: list[tuple[int, DeliveryStatus, Optional[str]]]) -> None:
+        """Записывает итоги пачки отправок"""
+        for tg_id, status, _ in results:
+            if status is DeliveryStatus.BLOCKED:
+                self._dead.add(tg_id)
+            elif status is DeliveryStatus.SENT:
+                self._dead.discard(tg_id)
+        await req_delivery.record_deliveries(results)
+
+    async def record_error(self, tg_id: int, error: Exception) -> None:
+        """Ошибка одиночной отправки (уведомление, сообщение администратору)"""
+        await self.record([(tg_id, classify_error(error), str(error))])
+
+    async def revive(self, tg_id: int) -> None:
+        if tg_id in self._dead:
+            self._dead.discard(tg_id)
+            await req_delivery.mark_alive(tg_id)
+
+
+delivery_health = DeliveryHealthRegistry()
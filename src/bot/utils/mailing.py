@@ -0,0 +1,278 @@
+import asyncio
+import logging
+import os
+import random
+import time
+
+from collections.abc import AsyncIterable, Awaitable, Iterable
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Callable, Optional, Union
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from cachetools import TTLCache
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Ответы Bot API, после которых писать в чат бессмысленно
+UNREACHABLE_CHAT_ERRORS = ('chat not found', 'user not found', 'user is deactivated', 'peer_id_invalid')
+
+Recipients = Union[Iterable[int], AsyncIterable[int]]
+SendFunc = Callable[[Bot, int], Awaitable[Any]]
+DeliveryCallback = Callable[[int, 'DeliveryStatus', Optional[str]], Awaitable[None]]
+
+
+@dataclass(frozen=True, slots=True)
+class MailingSettings:
+    """Пропускная способность рассылки
+
+    Telegram пропускает около 30 сообщений в секунду от бота и около одного в секунду в один чат;
+    по умолчанию рассылка берет 25 в секунду, оставляя запас для ответов пользователям.
+    """
+
+    workers: int = 16
+    rate: float = 25.0  # Сообщений в секунду на всю рассылку
+    burst: float = 25.0
+    chat_rate: float = 1.0  # Сообщений в секунду в один чат
+    chat_burst: float = 3.0  # Медиагруппа и текст уходят в чат подряд
+    max_retries: int = 5
+    backoff: float = 1.0  # Базовая пауза при сетевых ошибках и 5xx, удваивается с каждой попыткой
+    progress_interval: float = 3.0
+    batch_size: int = 50  # Получателей, которых задание рассылки забирает из БД за раз
+
+    @classmethod
+    def from_env(cls) -> 'MailingSettings':
+        return cls(
+            workers=max(1, int(os.environ.get('MAILING_WORKERS', 16))),
+            rate=float(os.environ.get('MAILING_RATE', 25)),
+            burst=float(os.environ.get('MAILING_BURST', 25)),
+            chat_rate=float(os.environ.get('MAILING_CHAT_RATE', 1)),
+            chat_burst=float(os.environ.get('MAILING_CHAT_BURST', 3)),
+            max_retries=int(os.environ.get('MAILING_MAX_RETRIES', 5)),
+            backoff=float(os.environ.get('MAILING_BACKOFF', 1)),
+            progress_interval=float(os.environ.get('MAILING_PROGRESS_INTERVAL', 3)),
+            batch_size=max(1, int(os.environ.get('MAILING_BATCH_SIZE', 50))),
+        )
+
+
+class DeliveryStatus(str, Enum):
+    PENDING = 'pending'
+    SENDING = 'sending'  # Забран воркером, результат еще не записан
+    SENT = 'sent'
+    BLOCKED = 'blocked'  # Бот заблокирован, пользователь удален или чат не найден
+    FAILED = 'failed'
+    INTERRUPTED = 'interrupted'  # Процесс упал во время отправки: повторно не шлем, чтобы не задублировать
+
+
+class JobStatus(str, Enum):
+    RUNNING = 'running'
+    PAUSED = 'paused'
+    CANCELLED = 'cancelled'
+    DONE = 'done'
+
+
+def classify_error(error: Exception) -> DeliveryStatus:
+    """Отличает недоступный чат от ошибки, которую имеет смысл повторить позже"""
+    if isinstance(error, TelegramForbiddenError):
+        return DeliveryStatus.BLOCKED
+    if isinstance(error, TelegramBadRequest) and any(
+        reason in error.message.lower() for reason in UNREACHABLE_CHAT_ERRORS
+    ):
+        return DeliveryStatus.BLOCKED
+    return DeliveryStatus.FAILED
+
+
+@dataclass(slots=True)
+class MailingStats:
+    sent: int = 0
+    blocked: int = 0
+    failed: int = 0
+    retries: int = 0
+    started: float = field(default_factory=time.monotonic)
+
+    @property
+    def processed(self) -> int:
+        return self.sent + self.blocked + self.failed
+
+    @property
+    def rate(self) -> float:
+        """Обработано получателей в секунду"""
+        elapsed = time.monotonic() - self.started
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+    def add(self, status: DeliveryStatus) -> None:
+        if status is DeliveryStatus.SENT:
+            self.sent += 1
+        elif status is DeliveryStatus.BLOCKED:
+            self.blocked += 1
+        else:
+            self.failed += 1
+
+
+class TokenBucket:
+    """Ограничитель частоты: rate токенов в секунду, не больше capacity в запасе"""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """Не выдавать токены seconds секунд (flood wait); запас после паузы начинается с нуля"""
+        self._tokens = 0.0
+        self._updated = max(self._updated, time.monotonic() + seconds)
+
+    async def acquire(self) -> None:
+        # Lock выдает токены ожидающим по очереди
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._updated:
+                    await asyncio.sleep(self._updated - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ThrottlingRequestMiddleware(BaseRequestMiddleware):
+    """Middleware сессии рассылки: лимиты Telegram и повтор запросов
+
+    Каждый запрос берет токен из бакета чата и из общего бакета. На 429 вся рассылка
+    ждет retry_after, на сетевые ошибки и 5xx - экспоненциальную паузу со случайным разбросом.
+    """
+
+    def __init__(self, settings: MailingSettings, stats: MailingStats) -> None:
+        self.settings = settings
+        self.stats = stats
+        self.bucket = TokenBucket(settings.rate, settings.burst)
+        self._chat_buckets: TTLCache = TTLCache(maxsize=max(1000, settings.workers * 8), ttl=60)
+
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.settings.chat_rate, self.settings.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, 'chat_id', None)
+        attempt = 0
+        while True:
+            if chat_id is not None:
+                await self._chat_bucket(chat_id).acquire()
+            await self.bucket.acquire()
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt >= self.settings.max_retries:
+                    raise
+                logger.warning(f'Mailing flood wait {e.retry_after}s on {chat_id}')
+                self.bucket.pause(e.retry_after)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                if attempt >= self.settings.max_retries:
+                    raise
+                delay = self.settings.backoff * 2**attempt
+                logger.warning(f'Mailing request to {chat_id} failed ({e}), retry in {delay:.1f}s')
+                await asyncio.sleep(delay + random.uniform(0, self.settings.backoff))
+            attempt += 1
+            self.stats.retries += 1
+
+
+class MailingEngine:
+    """Рассылка пулом воркеров через отдельную сессию бота с ограничением частоты
+
+    Своя сессия не дает рассылке занять соединения и лимиты, нужные для ответов пользователям.
+    """
+
+    def __init__(self, bot: Bot, settings: Optional[MailingSettings] = None) -> None:
+        self.bot = bot
+        self.settings = settings or MailingSettings.from_env()
+
+    def _create_bot(self, stats: MailingStats) -> Bot:
+        session = AiohttpSession(api=self.bot.session.api, limit=self.settings.workers)
+        session.middleware(ThrottlingRequestMiddleware(self.settings, stats))
+        return Bot(token=self.bot.token, session=session, default=self.bot.default)
+
+    async def run(
+        self,
+        recipients: Recipients,
+        send: SendFunc,
+        on_progress: Optional[Callable[[MailingStats], Awaitable[None]]] = None,
+        on_delivery: Optional[DeliveryCallback] = None,
+    ) -> MailingStats:
+        """Отправляет send(bot, chat_id) каждому получателю, recipients читаются по мере отправки"""
+        stats = MailingStats()
+        bot = self._create_bot(stats)
+        queue: asyncio.Queue[Optional[int]] = asyncio.Queue(maxsize=self.settings.workers * 2)
+
+        async def deliver(chat_id: int) -> None:
+            status, error = DeliveryStatus.SENT, None
+            try:
+                await send(bot, chat_id)
+            except Exception as e:
+                status, error = classify_error(e), str(e)
+                if status is DeliveryStatus.FAILED:
+                    logger.error(f'Ошибка отправки для {chat_id}: {e}')
+            stats.add(status)
+            if on_delivery is not None:
+                await on_delivery(chat_id, status, error)
+
+        async def worker() -> None:
+            while (chat_id := await queue.get()) is not None:
+                await deliver(chat_id)
+
+        async def report(callback: Callable[[MailingStats], Awaitable[None]]) -> None:
+            while True:
+                await asyncio.sleep(self.settings.progress_interval)
+                await callback(stats)
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.settings.workers)]
+        reporter = asyncio.create_task(report(on_progress)) if on_progress is not None else None
+        try:
+            if isinstance(recipients, AsyncIterable):
+                async for chat_id in recipients:
+                    await queue.put(chat_id)
+            else:
+                for chat_id in recipients:
+                    await queue.put(chat_id)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            if reporter is not None:
+                reporter.cancel()
+            await bot.session.close()
+
+        logger.info(
+            f'Mailing finished: sent {stats.sent}, blocked {stats.blocked}, failed {stats.failed}, '
+            f'retries {stats.retries}, {stats.rate:.1f} msg/s'
+        )
+        if on_progress is not None:
+            await on_progress(stats)
+        return stats
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+
+from collections.abc import AsyncIterator
+from functools import partial
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+
+import src.bot.db.repositories.mailing_repository as req_mailing
+import src.bot.keyboards.builders as kb
+
+from src.bot.db.connection import after_commit, get_current_session
+from src.bot.db.models import MailingJob
+from src.bot.utils.delivery_health import delivery_health
+from src.bot.utils.mailing import DeliveryStatus, JobStatus, MailingEngine, MailingSettings, MailingStats
+from src.bot.utils.mailing_payload import MAILING_STAGING_CHAT_ID, MailingPayload
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def format_job_progress(job: MailingJob, counts: dict[DeliveryStatus, int], status: JobStatus) -> str:
+    processed = sum(
+        counts.get(item, 0)
+        for item in (DeliveryStatus.SENT, DeliveryStatus.BLOCKED, DeliveryStatus.FAILED, DeliveryStatus.INTERRUPTED)
+    )
+    title = {
+        JobStatus.RUNNING: '⏳ Рассылка...',
+        JobStatus.PAUSED: '⏸ Рассылка на паузе',
+        JobStatus.CANCELLED: '⛔ Рассылка отменена',
+        JobStatus.DONE: '📤 Рассылка завершена',
+    }[status]
+    text = (
+        f'{title} {processed}/{job.total}\n'
+        f'✅ Успешно: {counts.get(DeliveryStatus.SENT, 0)}\n'
+        f'🚫 Заблокировали бота: {counts.get(DeliveryStatus.BLOCKED, 0)}\n'
+        f'❌ Ошибок: {counts.get(DeliveryStatus.FAILED, 0)}'
+    )
+    if interrupted := counts.get(DeliveryStatus.INTERRUPTED, 0):
+        text += f'\n⚠️ Прервано перезапуском: {interrupted}'
+    return text
+
+
+class MailingJobs:
+    """Задания рассылки, которые выполняются в этом процессе
+
+    Прогресс хранится в mailing_deliveries, поэтому задание можно поставить на паузу, отменить
+    или продолжить после перезапуска бота. Пауза и отмена срабатывают на границе пачки получателей.
+    """
+
+    def __init__(self) -> None:
+        self._tasks: dict[int, asyncio.Task] = {}
+        self._restarts: set[int] = set()
+
+    def start(self, bot: Bot, job_id: int) -> None:
+        """Запускает задание; внутри апдейта - после фиксации его транзакции"""
+        session = get_current_session()
+        if session is not None:
+            after_commit(session, partial(self._spawn, bot, job_id))
+        else:
+            self._spawn(bot, job_id)
+
+    def _spawn(self, bot: Bot, job_id: int) -> None:
+        if job_id in self._tasks:
+            # Прежняя задача могла уже решить выйти: перезапустим задание, когда она завершится
+            self._restarts.add(job_id)
+            return
+        task = asyncio.create_task(self._run(bot, job_id))
+        self._tasks[job_id] = task
+        task.add_done_callback(partial(self._finished, bot, job_id))
+
+    def _finished(self, bot: Bot, job_id: int, _: asyncio.Task) -> None:
+        self._tasks.pop(job_id, None)
+        if job_id in self._restarts:
+            self._restarts.discard(job_id)
+            self._spawn(bot, job_id)
+
+    async def resume_all(self, bot: Bot) -> None:
+        """Продолжает задания, прерванные остановкой бота"""
+        for job_id in await req_mailing.get_running_job_ids():
+            interrupted = await req_mailing.interrupt_sending(job_id)
+            logger.info(f'Resuming mailing job {job_id}, interrupted deliveries: {interrupted}')
+            self._spawn(bot, job_id)
+
+    async def _run(self, bot: Bot, job_id: int) -> None:
+        job = await req_mailing.get_mailing_job(job_id)
+        # Перезапуск мог прийти, когда задание уже снова на паузе или отменено
+        if job is None or await req_mailing.get_job_status(job_id) is not JobStatus.RUNNING:
+            return
+
+        try:
+            # Запросы собираются один раз на задание, получателю подставляется только chat_id
+            payload = MailingPayload.compile(job.text, job.media)
+            if MAILING_STAGING_CHAT_ID is not None:
+                payload = await payload.stage(bot, MAILING_STAGING_CHAT_ID)
+
+            while True:
+                exhausted = await self._send_batches(bot, job, payload)
+                status = await req_mailing.get_job_status(job_id)
+                if (
+                    status is JobStatus.RUNNING
+                    and exhausted
+                    and await req_mailing.set_job_status(job_id, JobStatus.DONE, (JobStatus.RUNNING,))
+                ):
+                    status = JobStatus.DONE
+                # Задание могли поставить на паузу и сразу продолжить: тогда идем на следующий круг
+                if status is not JobStatus.RUNNING:
+                    break
+        except Exception as e:
+            logger.error(f'❗Error in mailing job {job_id}: {e}', exc_info=True)
+            await bot.send_message(job.admin_chat_id, '❌ Рассылка прервана из-за ошибки, её можно продолжить')
+            await req_mailing.set_job_status(job_id, JobStatus.PAUSED, (JobStatus.RUNNING,))
+            status = JobStatus.PAUSED
+
+        await self.show_progress(bot, job, status)
+        if status in (JobStatus.DONE, JobStatus.CANCELLED):
+            await self.send_report(bot, job, status)
+
+    async def _send_batches(self, bot: Bot, job: MailingJob, payload: MailingPayload) -> bool:
+        """Отправляет пачки, пока задание в статусе running; True - если получатели закончились"""
+        settings = MailingSettings.from_env()
+        results: list[tuple[int, DeliveryStatus, Optional[str]]] = []
+        exhausted = False
+
+        async def flush() -> None:
+            if results:
+                batch = results.copy()
+                results.clear()
+                await req_mailing.save_delivery_results(job.id, batch)
+                await delivery_health.record(batch)
+
+        async def recipients() -> AsyncIterator[int]:
+            nonlocal exhausted
+            while await req_mailing.get_job_status(job.id) is JobStatus.RUNNING:
+                batch = await req_mailing.claim_deliveries(job.id, settings.batch_size)
+                if not batch:
+                    exhausted = True
+                    return
+                for tg_id in batch:
+                    yield tg_id
+
+        async def on_delivery(tg_id: int, status: DeliveryStatus, error: Optional[str]) -> None:
+            results.append((tg_id, status, error))
+            if len(results) >= settings.batch_size:
+                await flush()
+
+        async def on_progress(_: MailingStats) -> None:
+            await flush()
+            await self.show_progress(bot, job, JobStatus.RUNNING)
+
+        try:
+            await MailingEngine(bot, settings).run(
+                recipients(), payload.send, on_progress=on_progress, on_delivery=on_delivery
+            )
+        finally:
+            await flush()
+        return exhausted
+
+    async def show_progress(self, bot: Bot, job: MailingJob, status: JobStatus) -> None:
+        """Обновляет сообщение с прогрессом и кнопками управления"""
+        if job.progress_message_id is None:
+            job = await req_mailing.get_mailing_job(job.id) or job
+            if job.progress_message_id is None:
+                return
+
+        counts = await req_mailing.count_deliveries(job.id)
+        markup = (
+            await kb.mailing_control_kb(job.id, status) if status in (JobStatus.RUNNING, JobStatus.PAUSED) else None
+        )
+        try:
+            await bot.edit_message_text(
+                format_job_progress(job, counts, status),
+                chat_id=job.admin_chat_id,
+                message_id=job.progress_message_id,
+                reply_markup=markup,
+            )
+        except TelegramBadRequest as e:
+            if 'message is not modified' not in str(e):
+                logger.warning(f'Failed to update progress of mailing job {job.id}: {e}')
+        except Exception as e:
+            logger.error(f'❗Error updating progress of mailing job {job.id}: {e}', exc_info=True)
+
+    async def send_report(self, bot: Bot, job: MailingJob, status: JobStatus) -> None:
+        """Отправка финального отчета"""
+        counts = await req_mailing.count_deliveries(job.id)
+        await bot.send_message(job.admin_chat_id, format_job_progress(job, counts, status))
+        logger.info(f'➡️ Mailing job {job.id} finished with status {status.value}: {dict(counts)}')
+
+
+mailing_jobs = MailingJobs()
@@ -0,0 +1,114 @@
+import html
+import logging
+import os
+import re
+
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from aiogram import Bot
+from aiogram.methods import (
+    CopyMessages,
+    SendDocument,
+    SendMediaGroup,
+    SendMessage,
+    SendPhoto,
+    SendVideo,
+    TelegramMethod,
+)
+from aiogram.types import InputMediaDocument, InputMediaPhoto, InputMediaVideo, Message
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Служебный чат: payload отправляется туда один раз, получателям уходит copyMessages
+MAILING_STAGING_CHAT_ID = int(os.environ.get('MAILING_STAGING_CHAT_ID', 0)) or None
+
+CAPTION_LIMIT = 1024
+MEDIA_GROUP_LIMIT = 10
+
+PayloadMethod = TelegramMethod[Any]
+
+SINGLE_MEDIA_METHODS: dict[str, Any] = {'photo': SendPhoto, 'video': SendVideo, 'document': SendDocument}
+INPUT_MEDIA_TYPES: dict[str, Any] = {'photo': InputMediaPhoto, 'video': InputMediaVideo, 'document': InputMediaDocument}
+
+HTML_TAG = re.compile(r'<[^>]+>')
+
+
+def visible_length(html_text: str) -> int:
+    """Длина текста после разбора HTML в единицах UTF-16, как ее считает Telegram"""
+    plain = html.unescape(HTML_TAG.sub('', html_text))
+    return len(plain.encode('utf-16-le')) // 2
+
+
+@dataclass(frozen=True, slots=True)
+class MailingPayload:
+    """Запросы рассылки, собранные один раз; для получателя подставляется только chat_id
+
+    Текст уходит подписью к медиа, если у медиа нет своих подписей и он укладывается в лимит,
+    иначе - отдельным сообщением после медиа. Так же выглядит превью у администратора.
+    """
+
+    methods: tuple[PayloadMethod, ...]
+
+    @classmethod
+    def compile(cls, text: Optional[str], media_list: list[dict[str, Any]]) -> 'MailingPayload':
+        media_list = [media for media in media_list if media.get('type') in INPUT_MEDIA_TYPES]
+        text = text or None
+        methods: list[PayloadMethod] = []
+
+        text_as_caption = (
+            text is not None
+            and bool(media_list)
+            and not any(media.get('caption') for media in media_list)
+            and visible_length(text) <= CAPTION_LIMIT
+        )
+
+        if len(media_list) == 1:
+            media = media_list[0]
+            method = SINGLE_MEDIA_METHODS[media['type']]
+            methods.append(
+                method(
+                    chat_id=0,
+                    **{media['type']: media['file_id']},
+                    caption=text if text_as_caption else media.get('caption'),
+                    parse_mode='HTML',
+                )
+            )
+        else:
+            for start in range(0, len(media_list), MEDIA_GROUP_LIMIT):
+                group = [
+                    INPUT_MEDIA_TYPES[media['type']](
+                        media=media['file_id'],
+                        caption=text if text_as_caption and start + index == 0 else media.get('caption'),
+                        parse_mode='HTML',
+                    )
+                    for index, media in enumerate(media_list[start : start + MEDIA_GROUP_LIMIT])
+                ]
+                methods.append(SendMediaGroup(chat_id=0, media=group))
+
+        if text is not None and not text_as_caption:
+            methods.append(SendMessage(chat_id=0, text=text, parse_mode='HTML'))
+
+        return cls(methods=tuple(methods))
+
+    async def send(self, bot: Bot, chat_id: int) -> None:
+        for method in self.methods:
+            await bot(method.model_copy(update={'chat_id': chat_id}))
+
+    async def stage(self, bot: Bot, staging_chat_id: int) -> 'MailingPayload':
+        """Отправляет payload в служебный чат и возвращает payload из одного copyMessages
+
+        copyMessages сохраняет альбомы и подписи, а Telegram не нужно заново принимать файлы и разметку.
+        """
+        message_ids: list[int] = []
+        for method in self.methods:
+            result = await bot(method.model_copy(update={'chat_id': staging_chat_id}))
+            if isinstance(result, Message):
+                message_ids.append(result.message_id)
+            elif isinstance(result, list):
+                message_ids.extend(message.message_id for message in result)
+
+        logger.info(f'Mailing payload staged in {staging_chat_id}: {message_ids}')
+        return MailingPayload(methods=(CopyMessages(chat_id=0, from_chat_id=staging_chat_id, message_ids=message_ids),))
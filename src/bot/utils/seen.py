@@ -0,0 +1,134 @@
+import logging
+import os
+import sys
+
+from collections.abc import Iterable
+from typing import Union
+
+from src.bot.utils.cache import StatsTTLCache
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Кэш ограничен суммарным размером записей в байтах, а не числом пользователей
+SEEN_CACHE_BYTES = int(os.environ.get('SEEN_CACHE_BYTES', 32 * 1024 * 1024))
+SEEN_CACHE_TTL = int(os.environ.get('SEEN_CACHE_TTL', 7 * 24 * 3600))
+# Id выше этого хранятся только во множестве, битовая карта не растет дальше SEEN_MAX_ID бит
+SEEN_MAX_ID = int(os.environ.get('SEEN_MAX_ID', 1 << 20))
+
+# Примерная цена одного id во множестве: слот хэш-таблицы с запасом и объект int
+_SET_ITEM_BYTES = 64
+
+Seen = Union[int, frozenset[int]]
+
+
+def _set_bytes(count: int) -> int:
+    return sys.getsizeof(frozenset()) + count * _SET_ITEM_BYTES
+
+
+def _bitmap_bytes(top_id: int) -> int:
+    return sys.getsizeof(0) + top_id // 8
+
+
+def _seen_size(seen: Seen) -> int:
+    if isinstance(seen, int):
+        return sys.getsizeof(seen)
+    return _set_bytes(len(seen))
+
+
+def _bitmap_ids(bitmap: int) -> frozenset[int]:
+    raw = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    return frozenset(index * 8 + bit for index, byte in enumerate(raw) if byte for bit in range(8) if byte >> bit & 1)
+
+
+def _ids_bitmap(ids: Iterable[int], top_id: int) -> int:
+    raw = bytearray(top_id // 8 + 1)
+    for item_id in ids:
+        raw[item_id // 8] |= 1 << item_id % 8
+    return int.from_bytes(raw, 'little')
+
+
+class SeenRegistry:
+    """Показанные пользователю id вне данных FSM: битовая карта (int) или множество
+
+    Для каждого пользователя хранится меньшее из двух представлений: плотные id - битовой картой,
+    редкие или далекие друг от друга - множеством. Размер кэша считается в байтах (SEEN_CACHE_BYTES),
+    давно неактивные пользователи вытесняются из него по TTL и LRU.
+
+    Данные живут только в памяти процесса: после перезапуска бота показанные события начинают
+    рекомендоваться заново, а воркеры вебхука не видят данные друг друга (пользователь закреплен за
+    одним воркером, но при смене WEBHOOK_WORKERS он переезжает и теряет историю).
+    """
+
+    def __init__(
+        self, name: str, maxsize: int = SEEN_CACHE_BYTES, ttl: int = SEEN_CACHE_TTL, max_id: int = SEEN_MAX_ID
+    ) -> None:
+        self.max_id = max_id
+        self._seen = StatsTTLCache(name, maxsize=maxsize, ttl=ttl, getsizeof=_seen_size)
+
+    def _get(self, tg_id: int) -> Seen:
+        return self._seen.get(tg_id, 0)
+
+    @staticmethod
+    def _contains(seen: Seen, item_id: int) -> bool:
+        if isinstance(seen, int):
+            return item_id >= 0 and bool(seen >> item_id & 1)
+        return item_id in seen
+
+    def is_seen(self, tg_id: int, item_id: int) -> bool:
+        return self._contains(self._get(tg_id), item_id)
+
+    def seen_ids(self, tg_id: int) -> frozenset[int]:
+        """Все показанные id пользователя, например для фильтра в SQL"""
+        seen = self._get(tg_id)
+        return _bitmap_ids(seen) if isinstance(seen, int) else seen
+
+    def mark(self, tg_id: int, item_ids: Iterable[int]) -> None:
+        new_ids = []
+        for item_id in item_ids:
+            if item_id >= 0:
+                new_ids.append(item_id)
+            else:
+                logger.warning(f'Seen id {item_id} is out of range for user {tg_id}')
+        if not new_ids:
+            return
+
+        seen = self._get(tg_id)
+        top_id = max(new_ids)
+        if isinstance(seen, int) and top_id < self.max_id:
+            bitmap = seen
+            for item_id in new_ids:
+                bitmap |= 1 << item_id
+            # Битовая карта заметно больше множества тех же id: id редкие, переходим на множество
+            if _bitmap_bytes(bitmap.bit_length()) > 2 * _set_bytes(bitmap.bit_count()):
+                self._store(tg_id, _bitmap_ids(bitmap))
+            else:
+                self._store(tg_id, bitmap)
+            return
+
+        ids = (_bitmap_ids(seen) if isinstance(seen, int) else seen) | frozenset(new_ids)
+        top_id = max(ids)
+        # Id стали плотными: битовая карта меньше, возвращаемся к ней
+        if top_id < self.max_id and 2 * _bitmap_bytes(top_id) < _set_bytes(len(ids)):
+            self._store(tg_id, _ids_bitmap(ids, top_id))
+        else:
+            self._store(tg_id, ids)
+
+    def _store(self, tg_id: int, seen: Seen) -> None:
+        try:
+            self._seen[tg_id] = seen
+        except ValueError:
+            # Запись больше всего кэша: лучше показать событие повторно, чем вытеснить всех
+            logger.warning(f'Seen ids of user {tg_id} do not fit into the cache, dropping them')
+            self._seen.invalidate(tg_id)
+
+    def count(self, tg_id: int) -> int:
+        seen = self._get(tg_id)
+        return seen.bit_count() if isinstance(seen, int) else len(seen)
+
+    def reset(self, tg_id: int) -> None:
+        self._seen.invalidate(tg_id)
+
+
+seen_events = SeenRegistry('seen_events')
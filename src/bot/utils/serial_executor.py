@@ -0,0 +1,43 @@
+import asyncio
+import logging
+
+from collections.abc import Awaitable
+from typing import Any, Callable, Optional
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class SerialExecutor:
+    """Задачи с одним ключом выполняются строго по очереди, с разными - параллельно
+
+    Ключ - пользователь для апдейтов вебхука или чат для отправки сообщений.
+    """
+
+    def __init__(self) -> None:
+        self._tails: dict[Optional[int], asyncio.Task] = {}
+
+    def submit(self, key: Optional[int], job: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        previous = self._tails.get(key)
+
+        async def run() -> None:
+            if previous is not None:
+                await asyncio.wait([previous])
+            try:
+                await job()
+            except Exception as e:
+                logger.error(f'Serial job for {key} failed: {e}', exc_info=True)
+
+        task = asyncio.create_task(run())
+        self._tails[key] = task
+        task.add_done_callback(lambda done: self._release(key, done))
+        return task
+
+    def _release(self, key: Optional[int], task: asyncio.Task) -> None:
+        if self._tails.get(key) is task:
+            del self._tails[key]
+
+    async def drain(self) -> None:
+        if self._tails:
+            await asyncio.wait(list(self._tails.values()))
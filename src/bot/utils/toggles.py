@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import os
+import time
+
+from collections.abc import Awaitable
+from dataclasses import dataclass
+from typing import Callable
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Пауза после последнего нажатия, после которой итоговое состояние записывается в БД
+TOGGLE_DEBOUNCE = float(os.environ.get('TOGGLE_DEBOUNCE', 0.7))
+
+ToggleKey = tuple[int, int, str]  # (от кого, кому, like/friend)
+ApplyFunc = Callable[[bool], Awaitable[None]]
+LoadFunc = Callable[[], Awaitable[bool]]
+
+
+@dataclass(slots=True)
+class _Burst:
+    persisted: bool  # Состояние в БД до серии нажатий или после последней записи
+    enabled: bool  # Состояние после последнего нажатия
+    apply: ApplyFunc
+    deadline: float
+
+
+class ToggleDebouncer:
+    """Склеивает серию нажатий одной кнопки-переключателя в одну запись
+
+    На ключ работает не больше одной задачи: она ждет паузы в нажатиях и вызывает apply только с
+    итоговым состоянием, если оно отличается от записанного. Нажатия во время записи не теряются,
+    задача подхватит их следующим кругом, поэтому две записи одного ключа не идут параллельно.
+    """
+
+    def __init__(self, delay: float = TOGGLE_DEBOUNCE) -> None:
+        self.delay = delay
+        self._bursts: dict[ToggleKey, _Burst] = {}
+        self._tasks: dict[ToggleKey, asyncio.Task] = {}
+        self._loading: dict[ToggleKey, asyncio.Future[bool]] = {}
+
+    def submit(self, key: ToggleKey, enabled: bool, apply: ApplyFunc) -> None:
+        """Нажатие переключателя: enabled - новое состояние, apply(enabled) записывает его"""
+        deadline = time.monotonic() + self.delay
+        burst = self._bursts.get(key)
+        if burst is None:
+            self._bursts[key] = _Burst(persisted=not enabled, enabled=enabled, apply=apply, deadline=deadline)
+        else:
+            burst.enabled, burst.apply, burst.deadline = enabled, apply, deadline
+
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._run(key))
+
+    async def toggle(self, key: ToggleKey, load: LoadFunc, apply: ApplyFunc) -> bool:
+        """Переключает состояние и возвращает новое
+
+        Состояние до серии нажатий читает load(); одновременные первые нажатия ждут одно чтение,
+        а переключают по очереди, поэтому два быстрых нажатия дают исходное состояние, а не два включения.
+        """
+        if key not in self._bursts:
+            loading = self._loading.get(key)
+            if loading is None:
+                loading = asyncio.ensure_future(load())
+                self._loading[key] = loading
+                loading.add_done_callback(lambda _: self._loading.pop(key, None))
+            persisted = await asyncio.shield(loading)
+            # Пока шло чтение, серию мог начать другой апдейт: тогда переключаем его состояние
+            if key not in self._bursts:
+                self._bursts[key] = _Burst(persisted=persisted, enabled=persisted, apply=apply, deadline=0.0)
+
+        enabled = not self._bursts[key].enabled
+        self.submit(key, enabled, apply)
+        return enabled
+
+    async def _run(self, key: ToggleKey) -> None:
+        burst = self._bursts[key]
+        try:
+            while True:
+                delay = burst.deadline - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                if burst.enabled == burst.persisted:
+                    return
+
+                enabled = burst.enabled
+                await burst.apply(enabled)
+                burst.persisted = enabled
+        except Exception as e:
+            logger.error(f'Failed to apply toggle {key}: {e}', exc_info=True)
+        finally:
+            self._bursts.pop(key, None)
+            self._tasks.pop(key, None)
+
+
+relation_toggles = ToggleDebouncer()
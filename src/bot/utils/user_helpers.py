@@ -1,6 +1,8 @@
 import asyncio
 import logging
+import os
 
+from dataclasses import dataclass
 from typing import Optional, Union
 
 from aiogram import Bot
@@ -16,13 +18,18 @@ from aiogram.types import (
     MaybeInaccessibleMessage,
     Message,
     ReplyKeyboardMarkup,
+    ReplyParameters,
 )
 
 import src.bot.db.repositories.event_repository as req_event
 import src.bot.db.repositories.user_repository as req_user
 import src.bot.keyboards.builders as kb
 
+from src.bot.db.repositories.user_data_utils import UserProfileData, get_profile_cards, profile_form_data
 from src.bot.fsm.user_states import UserData
+from src.bot.utils.delivery_health import delivery_health
+from src.bot.utils.seen import seen_events
+from src.bot.utils.serial_executor import SerialExecutor
 
 
 InputMediaType = Union[
@@ -36,6 +43,11 @@ InputMediaType = Union[
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Страницы выдачи в один чат уходят по очереди, в разные чаты - параллельно
+chat_senders = SerialExecutor()
+# Сколько карточек одной страницы отправляется одновременно
+CARD_SEND_CONCURRENCY = int(os.environ.get('CARD_SEND_CONCURRENCY', 3))
+
 
 # Получаем значение обрабатываем и возвращаем старое и новое значение
 async def data_get_update(callback: CallbackQuery, state: FSMContext, key: str) -> tuple[str, Optional[str]] | None:
@@ -126,21 +138,8 @@ async def start_events_list(user_id: int, message: Message, state: FSMContext) -
 
     user_data = await req_event.get_user_data(user_id)
 
-    await state.set_data(
-        {
-            'year': user_data.get('year'),
-            'gender': user_data.get('gender'),
-            'status': user_data.get('status'),
-            'target': user_data.get('target'),
-            'district': user_data.get('district'),
-            'profession': user_data.get('profession'),
-            'about': user_data.get('about'),
-            'interests': user_data.get('interests', []),
-            'shown_events': user_data.get('shown_events', []),
-        }
-    )
-
-    await state.update_data(shown_events=[])
+    await state.set_data(profile_form_data(user_data))
+    seen_events.reset(user_id)
     await state.set_state(UserData.year)
     await message.answer(
         """
@@ -174,34 +173,39 @@ async def show_people_results(callback: CallbackQuery, state: FSMContext) -> Non
         return
 
     data = await state.get_data()
-    shown_ids = data.get('shown_people_ids', [])
+    cursor = req_user.SearchCursor.from_dict(data.get('people_cursor'))
     age_ranges = data.get('age_ranges', [])
 
     try:
-        # Ищем совместимых пользователей
-        users = await req_user.find_compatible_users(
-            tg_id=callback.from_user.id, age_ranges=age_ranges, limit=7, exclude_ids=shown_ids
+        # Ищем следующую порцию совместимых пользователей
+        user_ids, cursor = await req_user.find_compatible_users(
+            tg_id=callback.from_user.id, age_ranges=age_ranges, limit=7, cursor=cursor
         )
 
-        if not users:
+        if not user_ids:
             await callback.message.answer('😔 Больше подходящих людей не найдено, попробуй изменить анкету')
-            # Очищаем состояние
+            # Очищаем состояние, следующий поиск начнется с новой случайной точки
             await state.clear()
-            await state.update_data(shown_people_ids=[])
             return
 
-        # Показываем каждого пользователя
-        for user in users:
-            await show_user_profile(callback.message, user.tg_id, state=state)
+        # Карточки собираются сразу для всей порции, отправка идет в очереди чата после апдейта
+        cards = await build_profile_cards(user_ids, viewer_tg_id=callback.from_user.id)
+        more_kb = await kb.show_more_people_kb()
+        message = callback.message
+
+        async def deliver() -> None:
+            try:
+                if not await send_profile_cards(message, cards, message.bot):
+                    await message.answer('❌ Не все анкеты удалось показать')
+                await message.answer('Хотите увидеть больше?', reply_markup=more_kb)
+            except Exception as e:
+                logger.error(f'Error delivering people results: {e}', exc_info=True)
+                await message.answer('❌ Ошибка при показе результатов')
 
-        # Обновляем список показанных ID
-        new_shown_ids = shown_ids + [user.tg_id for user in users]
-        await state.update_data(shown_people_ids=new_shown_ids)
+        chat_senders.submit(message.chat.id, deliver)
 
-        await callback.message.answer(
-            'Хотите увидеть больше?',
-            reply_markup=await kb.show_more_people_kb(),
-        )
+        # Запоминаем позицию выдачи
+        await state.update_data(people_cursor=cursor.to_dict())
 
     except Exception as e:
         logger.error(f'Error in show_people_results: {e}', exc_info=True)
@@ -227,14 +231,17 @@ async def refresh_profile_message(callback: CallbackQuery, state: FSMContext) ->
 
     target_id = int(callback.data.split('_')[-1])
     user_data = await req_user.get_user_data(target_id)
+    if user_data is None:
+        logger.warning(f'Profile {target_id} not found for refresh')
+        return
 
     current_markup = callback.message.reply_markup
 
     new_markup = await kb.send_message_user_and_like_kb(
         tg_id=target_id,
-        username=user_data.get('username'),
-        state=state,
-        target=user_data.get('target'),
+        username=user_data.username,
+        viewer_tg_id=callback.from_user.id,
+        target=user_data.target,
     )
 
     if str(current_markup) != str(new_markup):
@@ -254,6 +261,10 @@ async def send_match_notification(
     state: FSMContext,
     target: str,
 ) -> None:
+    # Пользователь заблокировал бота: уведомление не дойдет
+    if delivery_health.is_dead(recipient_tg_id):
+        return
+
     try:
         # Отправляем уведомление о взаимном лайке
         if target == 'like':
@@ -267,37 +278,100 @@ async def send_match_notification(
 
     except Exception as e:
         logger.error(f'Failed to send match notification: {e}')
+        await delivery_health.record_error(recipient_tg_id, e)
+
+
+async def notify_match(bot: Bot, from_tg_id: int, to_tg_id: int, state: FSMContext, target: str) -> None:
+    """Уведомляет обоих пользователей о взаимном лайке или дружбе"""
+    try:
+        await send_match_notification(bot, from_tg_id, to_tg_id, state, target)
+        await send_match_notification(bot, to_tg_id, from_tg_id, state, target)
+    except Exception as e:
+        logger.error(f'*** Ошибка в send_match_notification: {e}', exc_info=True)
 
 
-async def get_user_profile_data(user_id: int) -> tuple[list[str] | None, str] | tuple[None, None]:
+def build_profile_text(user_data: UserProfileData) -> str:
+    """Текст карточки профиля"""
+    return f"""
+👤 <b>{user_data.first_name or 'не указан'}</b>
+
+❤️ <b>Лайков:</b> {user_data.total_likes}
+
+🎂 <b>Возраст:</b> {user_data.year or 'не указан'}
+♂️ <b>Пол:</b> {user_data.gender or 'не указан'}
+💍 <b>Статус:</b> {user_data.status or 'не указан'}{'(а)' if user_data.status == 'Свободен' else ''}
+🎯 <b>Цель:</b> {user_data.target or 'не указана'}
+🏙 <b>Район:</b> {user_data.district or 'не указан'}
+🎮 <b>Интересы:</b> {', '.join(user_data.interests) or 'не указаны'}
+💼 <b>Профессия:</b> {user_data.profession or 'не указана'}
+📄 <b>О себе:</b> {user_data.about or 'не указано'}
+    """
+
+
+async def get_user_profile_data(
+    user_id: int,
+) -> tuple[list[str] | None, str, UserProfileData] | tuple[None, None, None]:
     """
     Получает данные профиля пользователя
-    Возвращает tuple: (список photo_ids, текст профиля) или (None, None) если пользователь не найден
+    Возвращает tuple: (список photo_ids, текст профиля, профиль) или (None, None, None) если пользователь не найден
     """
     user_data = await req_user.get_user_data(user_id)
 
     if not user_data:
-        return None, None
+        return None, None, None
 
     photo_ids = await req_user.get_user_photos(user_id)
 
-    interests = user_data.get('interests', []) or []
+    return photo_ids, build_profile_text(user_data), user_data
+
+
+@dataclass(frozen=True, slots=True)
+class ProfileCard:
+    """Собранная карточка профиля: остается только отправить"""
+
+    tg_id: int
+    photo_ids: tuple[str, ...]
+    text: str
+    reply_markup: Optional[InlineKeyboardMarkup] = None
+
+
+async def build_profile_cards(tg_ids: list[int], viewer_tg_id: int) -> list[ProfileCard]:
+    """Карточки для выдачи поиска: профили и фото одним запросом, кнопки из графа связей"""
+    profiles = await get_profile_cards(tg_ids)
+    cards = []
+    for tg_id in tg_ids:
+        if tg_id not in profiles:
+            logger.warning(f'Profile {tg_id} not found for search results')
+            continue
+        user_data, photo_ids = profiles[tg_id]
+        reply_markup = await kb.send_message_user_and_like_kb(
+            tg_id=tg_id,
+            username=user_data.username,
+            viewer_tg_id=viewer_tg_id,
+            target=user_data.target,
+        )
+        cards.append(ProfileCard(tg_id, photo_ids, build_profile_text(user_data), reply_markup))
+    return cards
 
-    profile_text = f"""
-👤 <b>{user_data.get('first_name', 'не указан')}</b>
 
-❤️ <b>Лайков:</b> {user_data.get('total_likes', '_')}
+async def send_profile_cards(message: Message, cards: list[ProfileCard], bot: Optional[Bot]) -> bool:
+    """Отправляет карточки страницы параллельно, не больше CARD_SEND_CONCURRENCY одновременно
 
-🎂 <b>Возраст:</b> {user_data.get('year', 'не указан')}
-♂️ <b>Пол:</b> {user_data.get('gender', 'не указан')}
-💍 <b>Статус:</b> {user_data.get('status', 'не указан')}{'(а)' if user_data.get('status') == 'Свободен' else ''}
-🎯 <b>Цель:</b> {user_data.get('target', 'не указана')}
-🏙 <b>Район:</b> {user_data.get('district', 'не указан')}
-🎮 <b>Интересы:</b> {', '.join(interests) or 'не указаны'}
-💼 <b>Профессия:</b> {user_data.get('profession', 'не указана')}
-📄 <b>О себе:</b> {user_data.get('about', 'не указано')}
+    Карточки стартуют в порядке выдачи. Текст карточки отвечает на ее альбом, поэтому кнопки
+    остаются привязаны к своим фото, даже если альбом соседней карточки придет раньше.
+    Возвращает False, если отправка карточки упала и пользователь не получил даже сообщения об ошибке.
     """
-    return photo_ids, profile_text
+    window = asyncio.Semaphore(CARD_SEND_CONCURRENCY)
+
+    async def send(card: ProfileCard) -> bool:
+        async with window:
+            return await send_profile_card(message, card, bot)
+
+    results = await asyncio.gather(*(send(card) for card in cards), return_exceptions=True)
+    failed = [card.tg_id for card, result in zip(cards, results) if isinstance(result, BaseException)]
+    if failed:
+        logger.error(f'Failed to send profile cards {failed}: {[r for r in results if isinstance(r, BaseException)]}')
+    return not failed
 
 
 # Отправить профиль
@@ -319,76 +393,103 @@ async def send_user_profile(
             return False
     try:
         # Получаем данные профиля
-        photo_ids, profile_text = await get_user_profile_data(user_id)
-        if profile_text is None:
+        photo_ids, profile_text, user_data = await get_user_profile_data(user_id)
+        if profile_text is None or user_data is None:
             await _send_error(recipient, '❌ Профиль пользователя не найден', bot)
             return False
 
+        reply_markup = (
+            await kb.send_message_user_and_like_kb(
+                tg_id=user_id,
+                username=user_data.username,
+                viewer_tg_id=_recipient_id(recipient),
+                target=user_data.target,
+            )
+            if state
+            else None
+        )
+
+    except Exception as e:
+        logger.error(f'Error showing user profile {user_id}: {e}')
+        await _send_error(recipient, '❌ Не удалось загрузить профиль', bot)
+        return False
+
+    return await send_profile_card(
+        recipient, ProfileCard(user_id, tuple(photo_ids or ()), profile_text, reply_markup), bot
+    )
+
+
+async def send_profile_card(
+    recipient: Union[Message, CallbackQuery, int],
+    card: ProfileCard,
+    bot: Optional[Bot] = None,
+) -> bool:
+    """Отправляет фото и текст карточки; при устаревших file_id обновляет фото и повторяет"""
+    try:
         # Отправка медиа с оброботкой ошибок
-        if photo_ids:
+        sent: list[Message] = []
+        if card.photo_ids:
             try:
-                media_group: list[InputMediaType] = [InputMediaPhoto(media=pid) for pid in photo_ids[:10]]
-                await _send_media(media_group, recipient, bot)
+                media_group: list[InputMediaType] = [InputMediaPhoto(media=pid) for pid in card.photo_ids[:10]]
+                sent = await _send_media(media_group, recipient, bot)
             except Exception as e:
-                if 'FILE_REFERENCE' in str(e):
-                    logger.warning(f'🔴 Photo expired for user {user_id}, updating...: {e}')
-                    new_photos = await req_user.update_user_photos(bot=bot, tg_id=user_id)
+                if 'FILE_REFERENCE' in str(e) and bot is not None:
+                    logger.warning(f'🔴 Photo expired for user {card.tg_id}, updating...: {e}')
+                    new_photos = await req_user.update_user_photos(bot=bot, tg_id=card.tg_id)
                     if new_photos:
                         update_media_group: list[InputMediaType] = [
                             InputMediaPhoto(media=pid) for pid in new_photos[:10]
                         ]
-                        await _send_media(update_media_group, recipient, bot)
+                        sent = await _send_media(update_media_group, recipient, bot)
                     else:
                         await _send_error(recipient, '❌ Не удалось загрузить новые фотографии', bot)
                         return False
                 else:
-                    logger.error(f'❗Error showing user profile {user_id}: {e}')
+                    logger.error(f'❗Error showing user profile {card.tg_id}: {e}')
                     await _send_error(recipient, '❌ Не удалось найти ошибку FILE_REFERENCE', bot)
                     return False
 
         else:
-            await _send_message('Нет фотографий профиля', recipient, bot)
+            no_photos = await _send_message('Нет фотографий профиля', recipient, bot)
+            sent = [no_photos] if no_photos else []
 
-        # Отправка текста профиля
-        user_data = await req_user.get_user_data(user_id)
-        reply_markup = (
-            await kb.send_message_user_and_like_kb(
-                tg_id=user_id,
-                username=user_data.get('username'),
-                state=state,
-                target=user_data.get('target'),
-            )
-            if state
-            else None
-        )
-
-        await _send_message(profile_text, recipient, bot, reply_markup)
+        # Отправка текста профиля ответом на его фото
+        await _send_message(card.text, recipient, bot, card.reply_markup, reply_to=sent[0].message_id if sent else None)
         return True
 
     except Exception as e:
-        logger.error(f'Error showing user profile {user_id}: {e}')
+        logger.error(f'Error showing user profile {card.tg_id}: {e}')
         await _send_error(recipient, '❌ Не удалось загрузить профиль', bot)
         return False
 
 
 #  --- Вспомогательные функции системы лайков ---
+def _recipient_id(recipient: Union[Message, CallbackQuery, int]) -> int:
+    """Чат, которому показывается профиль"""
+    if isinstance(recipient, Message):
+        return recipient.chat.id
+    if isinstance(recipient, CallbackQuery):
+        return recipient.from_user.id
+    return recipient
+
+
 async def _send_media(
     media: list[InputMediaType],
     recipient: Union[Message, CallbackQuery, int],
     bot: Optional[Bot] = None,
-) -> None:
+) -> list[Message]:
     try:
         if isinstance(recipient, Message):
-            await recipient.answer_media_group(media=media)
+            return await recipient.answer_media_group(media=media)
         elif isinstance(recipient, CallbackQuery):
             if recipient.message and isinstance(recipient.message, Message):
-                await recipient.message.answer_media_group(media=media)
+                return await recipient.message.answer_media_group(media=media)
             else:
                 if not bot:
                     raise ValueError('Bot instance is required when recipient.message is not available')
-                await bot.send_media_group(chat_id=recipient.from_user.id, media=media)
+                return await bot.send_media_group(chat_id=recipient.from_user.id, media=media)
         elif isinstance(recipient, int) and bot:
-            await bot.send_media_group(chat_id=recipient, media=media)
+            return await bot.send_media_group(chat_id=recipient, media=media)
         else:
             raise ValueError('Invalid recipient type or missing bot instance')
     except Exception as e:
@@ -401,34 +502,41 @@ async def _send_message(
     recipient: Union[Message, CallbackQuery, int],
     bot: Optional[Bot],
     reply_markup: Optional[Union[InlineKeyboardMarkup, ReplyKeyboardMarkup]] = None,
-) -> None:
+    reply_to: Optional[int] = None,
+) -> Optional[Message]:
+    reply_parameters = ReplyParameters(message_id=reply_to, allow_sending_without_reply=True) if reply_to else None
     if isinstance(recipient, Message):
-        await recipient.answer(
+        return await recipient.answer(
             text,
             reply_markup=reply_markup,
             parse_mode='html',
+            reply_parameters=reply_parameters,
         )
     elif isinstance(recipient, CallbackQuery):
         if recipient.message is not None and isinstance(recipient.message, Message):
-            await recipient.message.answer(
+            return await recipient.message.answer(
                 text,
                 reply_markup=reply_markup,
                 parse_mode='html',
+                reply_parameters=reply_parameters,
             )
         elif bot:
-            await bot.send_message(
+            return await bot.send_message(
                 chat_id=recipient.from_user.id,
                 text=text,
                 reply_markup=reply_markup,
                 parse_mode='html',
+                reply_parameters=reply_parameters,
             )
     elif bot and isinstance(recipient, int):
-        await bot.send_message(
+        return await bot.send_message(
             chat_id=recipient,
             text=text,
             reply_markup=reply_markup,
             parse_mode='html',
+            reply_parameters=reply_parameters,
         )
+    return None
 
 
 async def _send_error(recipient: Union[Message, CallbackQuery, int], text: str, bot: Optional[Bot]) -> None:
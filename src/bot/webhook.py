@@ -0,0 +1,242 @@
+import asyncio
+import hmac
+import json
+import logging
+import multiprocessing
+import signal
+
+from collections.abc import Coroutine
+from functools import partial
+from multiprocessing.context import SpawnProcess
+from typing import Any, Callable, Optional
+
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+
+from src.bot.config import BotConfig, load_config
+from src.bot.dispatcher import create_bot, create_dispatcher, start_background, stop_background
+from src.bot.utils.serial_executor import SerialExecutor
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def update_user_id(update: dict[str, Any]) -> Optional[int]:
+    """Пользователь (или чат), к которому относится апдейт"""
+    for name, payload in update.items():
+        if name == 'update_id' or not isinstance(payload, dict):
+            continue
+        for field in ('from', 'user', 'chat'):
+            entity = payload.get(field)
+            if isinstance(entity, dict) and isinstance(entity.get('id'), int):
+                return entity['id']
+        message = payload.get('message')
+        if isinstance(message, dict) and isinstance(message.get('chat'), dict):
+            return message['chat'].get('id')
+    return None
+
+
+def update_media_group_id(update: dict[str, Any]) -> Optional[str]:
+    """Альбом, частью которого является сообщение апдейта"""
+    for name, payload in update.items():
+        if name != 'update_id' and isinstance(payload, dict) and payload.get('media_group_id'):
+            return str(payload['media_group_id'])
+    return None
+
+
+def worker_index(user_id: Optional[int], workers: int) -> int:
+    """Один пользователь всегда попадает в один воркер"""
+    return (user_id or 0) % workers
+
+
+class _Album:
+    """Части альбома: ждут очереди пользователя, затем обрабатываются параллельно"""
+
+    def __init__(self) -> None:
+        self.updates: list[dict[str, Any]] = []
+        self.tasks: set[asyncio.Task] = set()
+        self.started = False
+
+
+class UpdateRouter:
+    """Апдейты одного пользователя обрабатываются по очереди, части одного альбома - вместе
+
+    Telegram присылает каждое фото альбома отдельным апдейтом, а хендлеры альбомов рассчитаны
+    на параллельную обработку частей (пауза и проверка последнего message_id). Поэтому части
+    копятся по media_group_id и встают в очередь пользователя одной задачей, которая запускает их
+    параллельно; части, пришедшие во время ее работы, присоединяются к ней сразу.
+    """
+
+    def __init__(self, feed: Callable[[dict[str, Any]], Coroutine[Any, Any, Any]]) -> None:
+        self.feed = feed
+        self.executor = SerialExecutor()
+        self._albums: dict[str, _Album] = {}
+
+    def submit(self, update: dict[str, Any]) -> None:
+        user_id = update_user_id(update)
+        album_id = update_media_group_id(update)
+        if album_id is None:
+            self.executor.submit(user_id, partial(self.feed, update))
+            return
+
+        album = self._albums.get(album_id)
+        if album is None:
+            album = self._albums[album_id] = _Album()
+            self.executor.submit(user_id, partial(self._run_album, album_id, album))
+        if album.started:
+            album.tasks.add(asyncio.create_task(self.feed(update)))
+        else:
+            album.updates.append(update)
+
+    async def _run_album(self, album_id: str, album: _Album) -> None:
+        album.started = True
+        album.tasks.update(asyncio.create_task(self.feed(update)) for update in album.updates)
+        try:
+            while album.tasks:
+                done, _ = await asyncio.wait(album.tasks)
+                album.tasks -= done
+                for task in done:
+                    if not task.cancelled() and task.exception() is not None:
+                        logger.error(f'Album part of {album_id} failed: {task.exception()}')
+        finally:
+            del self._albums[album_id]
+
+    async def drain(self) -> None:
+        await self.executor.drain()
+
+
+class LocalDispatch:
+    """Обработка апдейтов в текущем процессе (WEBHOOK_WORKERS=1)"""
+
+    def __init__(self, bot: Bot, dp: Dispatcher) -> None:
+        self.router = UpdateRouter(partial(dp.feed_raw_update, bot))
+
+    def submit(self, update: dict[str, Any]) -> None:
+        self.router.submit(update)
+
+
+class WorkerPool:
+    """Процессы-воркеры, каждый со своей очередью апдейтов"""
+
+    def __init__(self, workers: int) -> None:
+        context = multiprocessing.get_context('spawn')
+        self.queues = [context.Queue() for _ in range(workers)]
+        self.processes: list[SpawnProcess] = [
+            context.Process(target=run_worker, args=(index, queue), name=f'bot-worker-{index}', daemon=True)
+            for index, queue in enumerate(self.queues)
+        ]
+
+    def start(self) -> None:
+        for process in self.processes:
+            process.start()
+        logger.info(f'Started {len(self.processes)} webhook workers')
+
+    def submit(self, update: dict[str, Any]) -> None:
+        # Очередь FIFO, так что порядок апдейтов пользователя сохраняется до воркера
+        self.queues[worker_index(update_user_id(update), len(self.queues))].put_nowait(update)
+
+    def stop(self, timeout: float = 30) -> None:
+        for queue in self.queues:
+            queue.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+
+
+async def _worker_loop(index: int, queue: Any) -> None:
+    config = load_config()
+    bot = create_bot(config)
+    dp = create_dispatcher()
+    # Незавершенные рассылки продолжает только первый воркер
+    background = await start_background(bot if index == 0 else None)
+    router = UpdateRouter(partial(dp.feed_raw_update, bot))
+    loop = asyncio.get_running_loop()
+    logger.info(f'Webhook worker {index} started')
+
+    try:
+        while True:
+            update = await loop.run_in_executor(None, queue.get)
+            if update is None:
+                break
+            router.submit(update)
+        await router.drain()
+    finally:
+        stop_background(background)
+        await bot.session.close()
+        logger.info(f'Webhook worker {index} stopped')
+
+
+def run_worker(index: int, queue: Any) -> None:
+    """Точка входа процесса-воркера"""
+    try:
+        asyncio.run(_worker_loop(index, queue))
+    except KeyboardInterrupt:
+        pass
+
+
+async def run_webhook(config: BotConfig) -> None:
+    """Принимает апдейты на порту web_port и раздает их воркерам по tg_id"""
+    bot = create_bot(config)
+    background: list[asyncio.Task] = []
+    pool: Optional[WorkerPool] = None
+    local: Optional[LocalDispatch] = None
+    submit: Callable[[dict[str, Any]], None]
+
+    if config.workers > 1:
+        pool = WorkerPool(config.workers)
+        pool.start()
+        submit = pool.submit
+        allowed_updates = create_dispatcher().resolve_used_update_types()
+    else:
+        dp = create_dispatcher()
+        background = await start_background(bot)
+        local = LocalDispatch(bot, dp)
+        submit = local.submit
+        allowed_updates = dp.resolve_used_update_types()
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if config.webhook_secret and not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, ''), config.webhook_secret
+        ):
+            return web.Response(status=401)
+        try:
+            update = json.loads(await request.read())
+        except ValueError:
+            return web.Response(status=400)
+        submit(update)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(config.webhook_path, handle_update)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=config.web_host, port=config.web_port)
+    await site.start()
+
+    await bot.set_webhook(
+        url=f'{(config.webhook_url or "").rstrip("/")}{config.webhook_path}',
+        secret_token=config.webhook_secret,
+        allowed_updates=allowed_updates,
+    )
+    logger.info(f'Webhook server listening on {config.web_host}:{config.web_port}, workers: {config.workers}')
+
+    # docker stop шлет SIGTERM: корректно останавливаем прием и воркеры
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_running_loop().add_signal_handler(sig, stop.set)
+
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        if pool is not None:
+            await asyncio.get_running_loop().run_in_executor(None, pool.stop)
+        if local is not None:
+            await local.router.drain()
+        stop_background(background)
+        await bot.session.close()
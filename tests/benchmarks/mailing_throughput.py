@@ -0,0 +1,91 @@
+"""Пропускная способность рассылки против локального Bot API с лимитами Telegram
+
+Запуск: python -m tests.benchmarks.mailing_throughput --recipients 1000 --rate 25
+
+Проверяет, что MailingEngine держит частоту не выше MAILING_RATE (пик запросов за секунду),
+а после 429 выдерживает retry_after (запросы во время паузы считаются нарушениями).
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from src.bot.utils.mailing import MailingEngine, MailingSettings
+from tests.fake_bot_api import FakeBotAPI
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--recipients', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--rate', type=float, default=25.0, help='MAILING_RATE')
+    parser.add_argument('--burst', type=float, default=25.0, help='MAILING_BURST')
+    parser.add_argument('--max-retries', type=int, default=5)
+    parser.add_argument('--backoff', type=float, default=0.2)
+    parser.add_argument('--server-rate', type=int, default=30, help='Лимит сервера, запросов в секунду')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--flood-every', type=int, default=200, help='Принудительный 429 на каждый N-й запрос')
+    parser.add_argument('--server-errors', type=float, default=0.01, help='Доля ответов 502')
+    parser.add_argument('--latency', type=float, default=0.02)
+    return parser.parse_args()
+
+
+async def run(args: argparse.Namespace) -> bool:
+    server = FakeBotAPI(
+        rate=args.server_rate,
+        retry_after=args.retry_after,
+        latency=args.latency,
+        server_error_rate=args.server_errors,
+        flood_every=args.flood_every,
+    )
+    base_url = await server.start()
+    bot = Bot('42:benchmark', session=AiohttpSession(api=TelegramAPIServer.from_base(base_url)))
+    settings = MailingSettings(
+        workers=args.workers,
+        rate=args.rate,
+        burst=args.burst,
+        max_retries=args.max_retries,
+        backoff=args.backoff,
+        progress_interval=3600,
+    )
+
+    async def send(mailing_bot: Bot, chat_id: int) -> None:
+        await mailing_bot.send_message(chat_id, 'benchmark')
+
+    started = time.monotonic()
+    try:
+        stats = await MailingEngine(bot, settings).run(range(1, args.recipients + 1), send)
+    finally:
+        await bot.session.close()
+        await server.stop()
+    elapsed = time.monotonic() - started
+
+    peak = server.stats.peak_rate()
+    print(f'recipients      {args.recipients}')
+    print(f'elapsed         {elapsed:.2f}s')
+    print(f'throughput      {stats.processed / elapsed:.1f} msg/s (rate {args.rate:g}, burst {args.burst:g})')
+    print(f'peak per second {peak}')
+    print(f'sent/failed     {stats.sent}/{stats.failed}, retries {stats.retries}')
+    print(
+        f'server          {server.stats.requests} requests, 429: {server.stats.flood}, 502: {server.stats.server_errors}'
+    )
+    print(f'flood violations {server.stats.flood_violations}')
+
+    # Пик может превысить rate на величину начального запаса burst
+    ok = server.stats.flood_violations == 0 and peak <= args.rate + args.burst and stats.failed == 0
+    print('OK' if ok else 'FAILED')
+    return ok
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.WARNING)
+    raise SystemExit(0 if asyncio.run(run(parse_args())) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+import os
+
+
+# Модули бота создают движок БД при импорте; юнит-тестам сервер не нужен
+os.environ.setdefault('DATABASE_URL', 'sqlite+aiosqlite://')
@@ -0,0 +1,121 @@
+import asyncio
+import random
+import time
+
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from aiohttp import web
+
+
+@dataclass
+class FakeBotAPIStats:
+    requests: int = 0
+    ok: int = 0
+    flood: int = 0  # Ответов 429
+    flood_violations: int = 0  # Запросов, отправленных до истечения выданного retry_after
+    server_errors: int = 0
+    timestamps: list[float] = field(default_factory=list)
+
+    def peak_rate(self, window: float = 1.0) -> int:
+        """Наибольшее число запросов за любое окно window секунд"""
+        peak, start = 0, 0
+        for end, moment in enumerate(self.timestamps):
+            while moment - self.timestamps[start] >= window:
+                start += 1
+            peak = max(peak, end - start + 1)
+        return peak
+
+
+class FakeBotAPI:
+    """Локальный Bot API с лимитами как у Telegram
+
+    Больше rate запросов за секунду от бота или chat_rate в один чат - ответ 429 с retry_after,
+    после которого сервер не принимает запросы retry_after секунд. server_error_rate - доля ответов 502.
+    Запросы, пришедшие в первые flood_grace секунд после 429, считаются уже летевшими и не нарушением.
+    """
+
+    def __init__(
+        self,
+        rate: int = 30,
+        chat_rate: int = 3,
+        retry_after: int = 1,
+        latency: float = 0.02,
+        server_error_rate: float = 0.0,
+        flood_every: Optional[int] = None,
+        flood_grace: float = 0.05,
+    ) -> None:
+        self.rate = rate
+        self.chat_rate = chat_rate
+        self.retry_after = retry_after
+        self.latency = latency
+        self.server_error_rate = server_error_rate
+        self.flood_every = flood_every  # Принудительный 429 на каждый N-й запрос
+        self.flood_grace = flood_grace
+        self.stats = FakeBotAPIStats()
+        self._recent: deque[float] = deque()
+        self._recent_by_chat: dict[int, deque[float]] = defaultdict(deque)
+        self._blocked_since = 0.0
+        self._blocked_until = 0.0
+        self._runner: Optional[web.AppRunner] = None
+
+    @staticmethod
+    def _over_limit(recent: deque[float], now: float, limit: int) -> bool:
+        while recent and now - recent[0] >= 1.0:
+            recent.popleft()
+        recent.append(now)
+        return len(recent) > limit
+
+    def _flood(self) -> web.Response:
+        self.stats.flood += 1
+        now = time.monotonic()
+        if now >= self._blocked_until:
+            self._blocked_since = now
+        self._blocked_until = now + self.retry_after
+        return self._error(429, 'Too Many Requests: retry later', parameters={'retry_after': self.retry_after})
+
+    @staticmethod
+    def _error(code: int, description: str, **extra: Any) -> web.Response:
+        return web.json_response({'ok': False, 'error_code': code, 'description': description, **extra}, status=code)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        data = await request.post()
+        chat_id = int(str(data.get('chat_id', 0)))
+        now = time.monotonic()
+        self.stats.requests += 1
+        self.stats.timestamps.append(now)
+
+        if now < self._blocked_until:
+            if now - self._blocked_since >= self.flood_grace:
+                self.stats.flood_violations += 1
+            return self._flood()
+        if self.flood_every and self.stats.requests % self.flood_every == 0:
+            return self._flood()
+        over_global = self._over_limit(self._recent, now, self.rate)
+        if self._over_limit(self._recent_by_chat[chat_id], now, self.chat_rate) or over_global:
+            return self._flood()
+
+        await asyncio.sleep(self.latency)
+        if random.random() < self.server_error_rate:
+            self.stats.server_errors += 1
+            return self._error(502, 'Bad Gateway')
+
+        self.stats.ok += 1
+        message = {'message_id': self.stats.ok, 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'private'}}
+        return web.json_response({'ok': True, 'result': {**message, 'text': data.get('text', '')}})
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Запускает сервер и возвращает базовый адрес для TelegramAPIServer.from_base"""
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        sockets = site._server.sockets  # type: ignore[union-attr]
+        return f'http://{host}:{sockets[0].getsockname()[1]}'
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
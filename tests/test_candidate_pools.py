@@ -0,0 +1,101 @@
+import asyncio
+import time
+
+from types import SimpleNamespace
+
+import pytest
+
+import src.bot.db.repositories.user_repository as req_user
+
+from src.bot.db.repositories.candidate_pools import CandidatePools, CandidateRow
+
+
+AGE_RANGES = ('18-25', '22-30', '31+')
+
+
+def make_pools(rows: list[CandidateRow]) -> CandidatePools:
+    pools = CandidatePools()
+    pools._age_ranges = AGE_RANGES
+    pools._loaded_at = time.monotonic()
+    for row in rows:
+        pools.update_user(row)
+    return pools
+
+
+def row(user_id: int, rank: float, year: int, district: str = 'ЦАО') -> CandidateRow:
+    return CandidateRow(id=user_id, tg_id=1000 + user_id, search_rank=rank, year=year, district=district)
+
+
+def test_fetch_merges_pools_in_rank_order() -> None:
+    pools = make_pools([row(1, 0.9, 20), row(2, 0.1, 35, 'ЗАО'), row(3, 0.5, 24), row(4, 0.3, 33)])
+
+    found = pools.fetch(['ЦАО', 'ЗАО'], ['18-25', '31+'], 0.0, 1.0, None, limit=10, exclude_tg_id=0)
+
+    assert [candidate.id for candidate in found] == [2, 4, 3, 1]
+
+
+def test_fetch_deduplicates_overlapping_age_ranges() -> None:
+    # 24 года попадает и в 18-25, и в 22-30
+    pools = make_pools([row(1, 0.2, 24), row(2, 0.4, 23), row(3, 0.6, 29)])
+
+    found = pools.fetch(None, ['18-25', '22-30'], 0.0, 1.0, None, limit=10, exclude_tg_id=0)
+
+    assert [candidate.id for candidate in found] == [1, 2, 3]
+
+
+def test_fetch_respects_range_position_limit_and_exclusion() -> None:
+    pools = make_pools([row(user_id, user_id / 10, 20) for user_id in range(1, 10)])
+
+    found = pools.fetch(None, ['18-25'], 0.3, 0.8, (0.4, 4), limit=2, exclude_tg_id=1005)
+
+    assert [candidate.id for candidate in found] == [6, 7]
+
+
+def test_fetch_filters_districts() -> None:
+    pools = make_pools([row(1, 0.1, 20, 'ЦАО'), row(2, 0.2, 20, 'ЮАО')])
+
+    found = pools.fetch(['ЮАО'], ['18-25'], 0.0, 1.0, None, limit=10, exclude_tg_id=0)
+
+    assert [candidate.id for candidate in found] == [2]
+
+
+def test_update_user_moves_user_between_pools() -> None:
+    pools = make_pools([row(1, 0.1, 20)])
+
+    pools.update_user(row(1, 0.1, 40, 'ЮАО'))
+
+    assert pools.fetch(None, ['18-25'], 0.0, 1.0, None, limit=10, exclude_tg_id=0) == []
+    assert [c.id for c in pools.fetch(['ЮАО'], ['31+'], 0.0, 1.0, None, limit=10, exclude_tg_id=0)] == [1]
+
+
+def test_search_cursor_round_trip() -> None:
+    cursor = req_user.SearchCursor(start=0.25, last_rank=0.5, last_id=7, wrapped=True)
+
+    assert req_user.SearchCursor.from_dict(cursor.to_dict()) == cursor
+    assert 0.0 <= req_user.SearchCursor.from_dict(None).start < 1.0
+
+
+def test_search_pages_wrap_around_and_show_everyone_once(monkeypatch: pytest.MonkeyPatch) -> None:
+    rows = [row(user_id, rank, 20) for user_id, rank in enumerate([0.05, 0.15, 0.35, 0.45, 0.55, 0.65, 0.85], 1)]
+    pools = make_pools(rows)
+    viewer = SimpleNamespace(district='ЦАО')
+
+    async def get_user_data(tg_id: int) -> SimpleNamespace:
+        return viewer
+
+    monkeypatch.setattr(req_user, 'get_user_data', get_user_data)
+    monkeypatch.setattr(req_user, 'candidate_pools', pools)
+
+    async def walk() -> list[list[int]]:
+        pages: list[list[int]] = []
+        cursor = req_user.SearchCursor(start=0.5)
+        while True:
+            tg_ids, cursor = await req_user.find_compatible_users(tg_id=1, age_ranges=['18-25'], limit=3, cursor=cursor)
+            if not tg_ids:
+                return pages
+            pages.append(tg_ids)
+
+    pages = asyncio.run(walk())
+
+    # Сначала ранги от точки старта до конца, затем с начала до точки старта
+    assert pages == [[1005, 1006, 1007], [1001, 1002, 1003], [1004]]
@@ -0,0 +1,74 @@
+import asyncio
+
+from typing import Any
+
+from sqlalchemy import text
+
+from src.bot.db.connection import after_commit, bind_current_session, unbind_current_session, unit_of_work_session
+from src.bot.middlewares.db_session import ReleaseDbSessionRequestMiddleware
+
+
+async def telegram_call(session: Any) -> tuple[bool, bool]:
+    """Запрос к Telegram через middleware: была ли открыта транзакция во время запроса"""
+    during: list[bool] = []
+
+    async def make_request(bot: Any, method: Any) -> bool:
+        during.append(session.in_transaction())
+        return True
+
+    await ReleaseDbSessionRequestMiddleware()(make_request, None, None)  # type: ignore[arg-type]
+    return during[0], session.in_transaction()
+
+
+def test_telegram_request_releases_update_connection() -> None:
+    async def scenario() -> tuple[bool, tuple[bool, bool], list[str], bool]:
+        fired: list[str] = []
+        async with unit_of_work_session() as session:
+            token = bind_current_session(session)
+            try:
+                await session.execute(text('SELECT 1'))
+                after_commit(session, lambda: fired.append('committed'))
+                before = session.in_transaction()
+                during = await telegram_call(session)
+                # Следующий запрос к БД в том же апдейте открывает новую транзакцию
+                await session.execute(text('SELECT 1'))
+                return before, during, fired, session.in_transaction()
+            finally:
+                unbind_current_session(token)
+
+    before, during, fired, reopened = asyncio.run(scenario())
+
+    assert before is True
+    assert during == (False, False)
+    assert fired == ['committed']
+    assert reopened is True
+
+
+def test_telegram_request_keeps_open_savepoint() -> None:
+    async def scenario() -> tuple[bool, bool]:
+        async with unit_of_work_session() as session:
+            token = bind_current_session(session)
+            try:
+                await session.execute(text('SELECT 1'))
+                async with session.begin_nested():
+                    during, _ = await telegram_call(session)
+                return during, session.in_transaction()
+            finally:
+                unbind_current_session(token)
+
+    assert asyncio.run(scenario()) == (True, True)
+
+
+def test_background_task_does_not_release_update_session() -> None:
+    async def scenario() -> bool:
+        async with unit_of_work_session() as session:
+            token = bind_current_session(session)
+            try:
+                await session.execute(text('SELECT 1'))
+                # Задача, созданная из апдейта, не должна фиксировать его транзакцию
+                await asyncio.create_task(telegram_call(session))
+                return session.in_transaction()
+            finally:
+                unbind_current_session(token)
+
+    assert asyncio.run(scenario()) is True
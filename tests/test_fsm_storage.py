@@ -0,0 +1,129 @@
+import asyncio
+import time
+
+from typing import Any
+
+from aiogram.fsm.storage.base import StorageKey
+
+from src.bot.fsm.storage import InMemoryKeyValue, KeyValueStorage
+from src.bot.middlewares.state_proxy import BufferedFSMContext
+
+
+KEY = StorageKey(bot_id=1, chat_id=10, user_id=10)
+
+
+class RecordingKeyValue(InMemoryKeyValue):
+    """InMemoryKeyValue, который запоминает команды записи"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.writes: list[tuple[str, Any]] = []
+
+    def set(self, name: str, value: bytes, ex: Any = None) -> bool:
+        self.writes.append(('set', value))
+        return super().set(name, value, ex=ex)
+
+    def hset(self, name: str, mapping: dict[str, bytes]) -> int:
+        self.writes.append(('hset', sorted(mapping)))
+        return super().hset(name, mapping)
+
+    def hdel(self, name: str, *keys: str) -> int:
+        self.writes.append(('hdel', sorted(keys)))
+        return super().hdel(name, *keys)
+
+
+def test_update_data_writes_fields_and_returns_merged_data() -> None:
+    async def scenario() -> tuple[dict[str, Any], dict[str, Any]]:
+        storage = KeyValueStorage(InMemoryKeyValue())
+        await storage.set_data(KEY, {'a': 1, 'b': [1, 2]})
+        merged = await storage.update_data(KEY, {'b': [3], 'c': {'x': 'y'}})
+        return merged, await storage.get_data(KEY)
+
+    merged, stored = asyncio.run(scenario())
+
+    assert merged == stored == {'a': 1, 'b': [3], 'c': {'x': 'y'}}
+
+
+def test_state_and_data_expire_and_are_swept() -> None:
+    async def scenario() -> tuple[Any, dict[str, Any], int]:
+        client = InMemoryKeyValue(sweep_interval=0)
+        storage = KeyValueStorage(client, ttl=60)
+        await storage.set_state(KEY, 'Form:name')
+        await storage.set_data(KEY, {'a': 1})
+        client._expires = {name: time.monotonic() - 1 for name in client._expires}
+        # Любая запись запускает проход по истекшим ключам
+        await storage.set_state(StorageKey(bot_id=1, chat_id=11, user_id=11), 'Other:state')
+        remaining = len(client._values)
+        return await storage.get_state(KEY), await storage.get_data(KEY), remaining
+
+    state, data, remaining = asyncio.run(scenario())
+
+    assert state is None
+    assert data == {}
+    assert remaining == 1
+
+
+def test_buffered_context_flushes_only_changes() -> None:
+    async def scenario() -> tuple[list[tuple[str, Any]], dict[str, Any], Any]:
+        client = RecordingKeyValue()
+        storage = KeyValueStorage(client)
+        await storage.set_data(KEY, {'keep': 1, 'change': 'old'})
+        client.writes.clear()
+
+        context = BufferedFSMContext(storage, KEY, state=None)
+        await context.update_data(change='new', added=[1])
+        await context.update_data(keep=1)
+        # Изменения копии, полученной из get_data, в хранилище не попадают
+        (await context.get_data())['added'].append(2)
+        await context.set_state('Form:name')
+        assert client.writes == []
+
+        await context.flush()
+        return client.writes, await storage.get_data(KEY), await storage.get_state(KEY)
+
+    writes, stored, state = asyncio.run(scenario())
+
+    assert writes == [('set', b'Form:name'), ('hset', ['added', 'change'])]
+    assert stored == {'keep': 1, 'change': 'new', 'added': [1]}
+    assert state == 'Form:name'
+
+
+def test_buffered_context_without_changes_does_not_write() -> None:
+    async def scenario() -> list[tuple[str, Any]]:
+        client = RecordingKeyValue()
+        storage = KeyValueStorage(client)
+        await storage.set_data(KEY, {'a': 1})
+        client.writes.clear()
+
+        context = BufferedFSMContext(storage, KEY, state='Form:name')
+        await context.get_data()
+        await context.update_data(a=1)
+        await context.flush()
+        return client.writes
+
+    assert asyncio.run(scenario()) == []
+
+
+def test_buffered_context_set_data_replaces_everything() -> None:
+    async def scenario() -> dict[str, Any]:
+        storage = KeyValueStorage(InMemoryKeyValue())
+        await storage.set_data(KEY, {'old': 1})
+
+        context = BufferedFSMContext(storage, KEY, state=None)
+        await context.set_data({'new': 2})
+        await context.flush()
+        return await storage.get_data(KEY)
+
+    assert asyncio.run(scenario()) == {'new': 2}
+
+
+def test_buffered_context_writes_through_after_flush() -> None:
+    async def scenario() -> dict[str, Any]:
+        storage = KeyValueStorage(InMemoryKeyValue())
+        context = BufferedFSMContext(storage, KEY, state=None)
+        await context.flush()
+        # Фоновая задача, пережившая апдейт, пишет сразу в хранилище
+        await context.update_data(late=True)
+        return await storage.get_data(KEY)
+
+    assert asyncio.run(scenario()) == {'late': True}
@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+from typing import Any
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.methods import SendMediaGroup, SendMessage, SendPhoto
+
+from src.bot.utils.mailing import MailingEngine, MailingSettings, TokenBucket
+from src.bot.utils.mailing_payload import CAPTION_LIMIT, MailingPayload
+from tests.fake_bot_api import FakeBotAPI
+
+
+def photo(file_id: str, caption: str | None = None) -> dict:
+    return {'type': 'photo', 'file_id': file_id, 'caption': caption}
+
+
+def sent_methods(payload: MailingPayload) -> list[Any]:
+    return list(payload.methods)
+
+
+def test_compile_text_only() -> None:
+    payload = MailingPayload.compile('<b>Привет</b>', [])
+
+    assert [type(method) for method in sent_methods(payload)] == [SendMessage]
+    assert sent_methods(payload)[0].text == '<b>Привет</b>'
+
+
+def test_compile_single_photo_takes_text_as_caption() -> None:
+    payload = MailingPayload.compile('Привет', [photo('p1')])
+
+    assert [type(method) for method in sent_methods(payload)] == [SendPhoto]
+    assert sent_methods(payload)[0].caption == 'Привет'
+
+
+def test_compile_long_text_goes_after_media() -> None:
+    # Теги не входят в лимит подписи, поэтому текст длиннее лимита только по видимым символам
+    text = '<b>' + 'я' * (CAPTION_LIMIT + 1) + '</b>'
+    payload = MailingPayload.compile(text, [photo('p1')])
+
+    assert [type(method) for method in sent_methods(payload)] == [SendPhoto, SendMessage]
+    assert sent_methods(payload)[0].caption is None
+
+
+def test_compile_keeps_own_captions_and_splits_albums() -> None:
+    media = [photo(f'p{index}', caption='своя' if index == 0 else None) for index in range(12)]
+    payload = MailingPayload.compile('Текст', media + [{'type': 'sticker', 'file_id': 's'}])
+
+    assert [type(method) for method in sent_methods(payload)] == [SendMediaGroup, SendMediaGroup, SendMessage]
+    assert [len(method.media) for method in sent_methods(payload)[:2]] == [10, 2]
+    assert sent_methods(payload)[0].media[0].caption == 'своя'
+
+
+def test_token_bucket_limits_rate_after_burst() -> None:
+    async def scenario() -> float:
+        bucket = TokenBucket(rate=50, capacity=5)
+        started = time.monotonic()
+        for _ in range(15):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    # 5 токенов из запаса сразу, остальные 10 - по 50 в секунду
+    assert 0.18 <= asyncio.run(scenario()) < 0.5
+
+
+def test_token_bucket_pause_blocks_and_resets_burst() -> None:
+    async def scenario() -> float:
+        bucket = TokenBucket(rate=100, capacity=10)
+        bucket.pause(0.2)
+        started = time.monotonic()
+        await bucket.acquire()
+        await bucket.acquire()
+        return time.monotonic() - started
+
+    assert 0.2 <= asyncio.run(scenario()) < 0.4
+
+
+def test_engine_waits_out_flood_and_retries_server_errors() -> None:
+    async def scenario() -> tuple:
+        server = FakeBotAPI(rate=1000, retry_after=1, latency=0, flood_every=7, server_error_rate=0.1)
+        base_url = await server.start()
+        bot = Bot('42:test', session=AiohttpSession(api=TelegramAPIServer.from_base(base_url)))
+        settings = MailingSettings(workers=4, rate=100, burst=10, max_retries=10, backoff=0.01)
+
+        async def send(mailing_bot: Bot, chat_id: int) -> None:
+            await mailing_bot.send_message(chat_id, 'test')
+
+        try:
+            stats = await MailingEngine(bot, settings).run(range(1, 21), send)
+        finally:
+            await bot.session.close()
+            await server.stop()
+        return stats, server.stats
+
+    stats, server_stats = asyncio.run(scenario())
+
+    assert stats.sent == 20 and stats.failed == 0
+    assert server_stats.flood > 0
+    assert stats.retries == server_stats.flood + server_stats.server_errors
+    # После 429 запросы не уходят, пока не истечет retry_after
+    assert server_stats.flood_violations == 0
@@ -0,0 +1,55 @@
+import asyncio
+
+from typing import Any
+
+import pytest
+
+import src.bot.utils.user_helpers as helpers
+
+from src.bot.utils.user_helpers import ProfileCard, send_profile_cards
+
+
+def cards(count: int) -> list[ProfileCard]:
+    return [ProfileCard(tg_id=index, photo_ids=(), text=f'card {index}') for index in range(count)]
+
+
+def test_cards_are_sent_concurrently_within_window(monkeypatch: pytest.MonkeyPatch) -> None:
+    started: list[int] = []
+    in_flight = peak = 0
+
+    async def send_profile_card(recipient: Any, card: ProfileCard, bot: Any = None) -> bool:
+        nonlocal in_flight, peak
+        started.append(card.tg_id)
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.05)
+        in_flight -= 1
+        return True
+
+    monkeypatch.setattr(helpers, 'send_profile_card', send_profile_card)
+    monkeypatch.setattr(helpers, 'CARD_SEND_CONCURRENCY', 3)
+
+    async def scenario() -> tuple[bool, float]:
+        loop = asyncio.get_running_loop()
+        begin = loop.time()
+        ok = await send_profile_cards(None, cards(7), None)  # type: ignore[arg-type]
+        return ok, loop.time() - begin
+
+    ok, elapsed = asyncio.run(scenario())
+
+    assert ok is True
+    assert peak == 3
+    # Карточки стартуют в порядке выдачи, страница идет три волны, а не семь отправок подряд
+    assert started == list(range(7))
+    assert elapsed < 0.3
+
+
+def test_failed_card_is_reported(monkeypatch: pytest.MonkeyPatch) -> None:
+    async def send_profile_card(recipient: Any, card: ProfileCard, bot: Any = None) -> bool:
+        if card.tg_id == 2:
+            raise RuntimeError('network is down')
+        return True
+
+    monkeypatch.setattr(helpers, 'send_profile_card', send_profile_card)
+
+    assert asyncio.run(send_profile_cards(None, cards(4), None)) is False  # type: ignore[arg-type]
@@ -0,0 +1,12 @@
+from src.bot.utils.seen import SeenRegistry
+
+
+def test_seen_ids_from_bitmap_and_set() -> None:
+    registry = SeenRegistry('test_seen', max_id=1 << 10)
+    registry.mark(1, [1, 2, 3, 5])
+    # Id выше max_id хранятся множеством
+    registry.mark(2, [7, 5000])
+
+    assert registry.seen_ids(1) == {1, 2, 3, 5}
+    assert registry.seen_ids(2) == {7, 5000}
+    assert registry.seen_ids(3) == frozenset()
@@ -0,0 +1,83 @@
+import asyncio
+
+from src.bot.utils.toggles import ToggleDebouncer
+
+
+KEY = (1, 2, 'like')
+
+
+class Recorder:
+    def __init__(self, persisted: bool = False) -> None:
+        self.persisted = persisted
+        self.loads = 0
+        self.applied: list[bool] = []
+
+    async def load(self) -> bool:
+        self.loads += 1
+        await asyncio.sleep(0.01)
+        return self.persisted
+
+    async def apply(self, enabled: bool) -> None:
+        self.applied.append(enabled)
+        self.persisted = enabled
+
+
+async def tap(debouncer: ToggleDebouncer, recorder: Recorder, times: int) -> list[bool]:
+    return [await debouncer.toggle(KEY, recorder.load, recorder.apply) for _ in range(times)]
+
+
+def test_burst_writes_only_final_state() -> None:
+    async def scenario() -> tuple[list[bool], Recorder]:
+        debouncer, recorder = ToggleDebouncer(delay=0.05), Recorder()
+        states = await tap(debouncer, recorder, 3)
+        await asyncio.sleep(0.2)
+        return states, recorder
+
+    states, recorder = asyncio.run(scenario())
+
+    assert states == [True, False, True]
+    assert recorder.applied == [True]
+    assert recorder.loads == 1
+
+
+def test_even_taps_write_nothing() -> None:
+    async def scenario() -> Recorder:
+        debouncer, recorder = ToggleDebouncer(delay=0.05), Recorder(persisted=True)
+        await tap(debouncer, recorder, 2)
+        await asyncio.sleep(0.2)
+        return recorder
+
+    assert asyncio.run(scenario()).applied == []
+
+
+def test_concurrent_first_taps_share_one_load() -> None:
+    async def scenario() -> tuple[list[bool], Recorder]:
+        debouncer, recorder = ToggleDebouncer(delay=0.05), Recorder()
+        states = await asyncio.gather(*(debouncer.toggle(KEY, recorder.load, recorder.apply) for _ in range(2)))
+        await asyncio.sleep(0.2)
+        return list(states), recorder
+
+    states, recorder = asyncio.run(scenario())
+
+    # Два быстрых первых нажатия: включить и выключить, а не два включения
+    assert states == [True, False]
+    assert recorder.loads == 1
+    assert recorder.applied == []
+
+
+def test_taps_during_apply_are_written_next_round() -> None:
+    async def scenario() -> Recorder:
+        debouncer, recorder = ToggleDebouncer(delay=0.02), Recorder()
+        slow_apply = recorder.apply
+
+        async def apply(enabled: bool) -> None:
+            await asyncio.sleep(0.05)
+            await slow_apply(enabled)
+
+        await debouncer.toggle(KEY, recorder.load, apply)
+        await asyncio.sleep(0.04)  # Запись уже идет
+        await debouncer.toggle(KEY, recorder.load, apply)
+        await asyncio.sleep(0.3)
+        return recorder
+
+    assert asyncio.run(scenario()).applied == [True, False]
@@ -0,0 +1,49 @@
+import asyncio
+
+from typing import Any
+
+from src.bot.webhook import UpdateRouter, update_media_group_id
+
+
+USER = {'id': 10}
+
+
+def message(update_id: int, media_group_id: str | None = None) -> dict[str, Any]:
+    payload: dict[str, Any] = {'message_id': update_id, 'from': USER, 'chat': USER}
+    if media_group_id:
+        payload['media_group_id'] = media_group_id
+    return {'update_id': update_id, 'message': payload}
+
+
+def test_media_group_id_is_read_from_message() -> None:
+    assert update_media_group_id(message(1, 'album')) == 'album'
+    assert update_media_group_id(message(1)) is None
+
+
+def test_album_parts_run_together_in_user_order() -> None:
+    async def scenario() -> list[tuple[str, int]]:
+        events: list[tuple[str, int]] = []
+
+        async def feed(update: dict[str, Any]) -> None:
+            events.append(('start', update['update_id']))
+            await asyncio.sleep(0.05)
+            events.append(('end', update['update_id']))
+
+        router = UpdateRouter(feed)
+        router.submit(message(1))
+        router.submit(message(2, 'album'))
+        router.submit(message(3, 'album'))
+        await asyncio.sleep(0.07)
+        # Часть альбома, пришедшая во время его обработки, не ждет остальные части
+        router.submit(message(4, 'album'))
+        router.submit(message(5))
+        await router.drain()
+        return events
+
+    events = asyncio.run(scenario())
+
+    assert events[:2] == [('start', 1), ('end', 1)]
+    assert events[2:4] == [('start', 2), ('start', 3)]
+    assert events.index(('start', 4)) < events.index(('end', 3))
+    # Следующий апдейт пользователя - только после всего альбома
+    assert events[-2:] == [('start', 5), ('end', 5)]